@@ -0,0 +1,42 @@
+"""Rewrite timestamps stored as ISO strings by earlier versions as BSON dates.
+
+    python migrate_timestamps.py
+    python migrate_timestamps.py --collection agreements --batch-size 200 --pause 0.1
+
+Uses MONGO_URL and DB_NAME like the server and is safe to run while it
+serves traffic. Progress is checkpointed in db.migrations after every
+batch, so an interrupted run continues where it stopped; --restart scans
+the collections from the start again. The server runs the same migration
+in the background at startup; the command is for migrating ahead of a
+deploy or with a gentler pace.
+"""
+import argparse
+import asyncio
+import json
+
+import server
+
+
+async def main(args):
+    server.open_database()
+    try:
+        report = await server.migrate_timestamps(
+            batch_size=args.batch_size,
+            pause=args.pause,
+            collections=args.collection,
+            restart=args.restart,
+        )
+    finally:
+        server.close_database()
+    print(json.dumps(report))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--collection", action="append", choices=list(server.TIMESTAMP_MIGRATIONS),
+                        help="Collection to migrate (repeatable; default all)")
+    parser.add_argument("--batch-size", type=int, default=server.TIMESTAMP_MIGRATION_BATCH_SIZE)
+    parser.add_argument("--pause", type=float, default=server.TIMESTAMP_MIGRATION_PAUSE,
+                        help="Seconds to wait between batches")
+    parser.add_argument("--restart", action="store_true", help="Ignore checkpoints of earlier runs")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,169 @@
+"""Local stand-in for the BankID and Swish APIs.
+
+Models the parts of both APIs the backend uses, with configurable latency,
+so the provider layer can be exercised and load-tested without real
+credentials:
+
+    uvicorn provider_simulator:app --port 8010
+    BANKID_PROVIDER=http SWISH_PROVIDER=http uvicorn server:app --port 8001
+
+BankID orders move from outstandingTransaction via userSign to complete
+once SIMULATOR_SIGN_SECONDS have passed; Swish payment requests go from
+CREATED to PAID after SIMULATOR_PAY_SECONDS. SIMULATOR_ERROR_RATE answers
+that share of calls with 503 and SIMULATOR_DECLINE_RATE lets that share of
+users cancel, to exercise retries, circuit breaking and failed sessions.
+"""
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+from typing import Optional
+from datetime import datetime, timezone
+import asyncio
+import os
+import random
+import time
+import uuid
+
+LATENCY_MS = float(os.environ.get('SIMULATOR_LATENCY_MS', '150'))
+JITTER_MS = float(os.environ.get('SIMULATOR_JITTER_MS', '100'))
+SIGN_SECONDS = float(os.environ.get('SIMULATOR_SIGN_SECONDS', '4'))
+PAY_SECONDS = float(os.environ.get('SIMULATOR_PAY_SECONDS', '4'))
+ERROR_RATE = float(os.environ.get('SIMULATOR_ERROR_RATE', '0'))
+DECLINE_RATE = float(os.environ.get('SIMULATOR_DECLINE_RATE', '0'))
+# Finished BankID orders can be collected for this long, like the real service
+ORDER_RETENTION_SECONDS = 180
+
+app = FastAPI(title="BankID/Swish simulator")
+
+# orderRef -> order, instruction ID -> payment request
+orders = {}
+payment_requests = {}
+
+@app.middleware("http")
+async def simulate_network(request: Request, call_next):
+    await asyncio.sleep(max(0.0, random.gauss(LATENCY_MS, JITTER_MS / 2)) / 1000)
+    if random.random() < ERROR_RATE:
+        return JSONResponse({"errorCode": "unavailable", "details": "Simulated outage"}, status_code=503)
+    return await call_next(request)
+
+def bankid_error(error_code: str, details: str) -> HTTPException:
+    return HTTPException(status_code=400, detail={"errorCode": error_code, "details": details})
+
+@app.exception_handler(HTTPException)
+async def error_body(request: Request, exc: HTTPException):
+    # Both APIs put the error object at the top level
+    body = exc.detail if isinstance(exc.detail, (dict, list)) else {"details": exc.detail}
+    return JSONResponse(body, status_code=exc.status_code)
+
+# BankID
+class AuthRequest(BaseModel):
+    endUserIp: str
+    requirement: Optional[dict] = None
+
+class CollectRequest(BaseModel):
+    orderRef: str
+
+@app.post("/rp/v6.0/auth")
+@app.post("/rp/v6.0/sign")
+async def bankid_auth(data: AuthRequest):
+    personal_number = (data.requirement or {}).get("personalNumber")
+    for order in orders.values():
+        # A new order for the same person cancels the one in progress
+        if personal_number and order['personal_number'] == personal_number and order['status'] == "pending":
+            order.update(status="failed", hint="cancelled", finished_at=time.monotonic())
+    order_ref = str(uuid.uuid4())
+    orders[order_ref] = {
+        "personal_number": personal_number,
+        "started_at": time.monotonic(),
+        "status": "pending",
+        "hint": "outstandingTransaction",
+        "declines": random.random() < DECLINE_RATE,
+    }
+    return {
+        "orderRef": order_ref,
+        "autoStartToken": str(uuid.uuid4()),
+        "qrStartToken": str(uuid.uuid4()),
+        "qrStartSecret": str(uuid.uuid4()),
+    }
+
+@app.post("/rp/v6.0/collect")
+async def bankid_collect(data: CollectRequest):
+    order = orders.get(data.orderRef)
+    now = time.monotonic()
+    if order is None or now - order.get('finished_at', now) > ORDER_RETENTION_SECONDS:
+        raise bankid_error("invalidParameters", "No such order")
+
+    elapsed = now - order['started_at']
+    if order['status'] == "pending":
+        if elapsed >= SIGN_SECONDS:
+            if order['declines']:
+                order.update(status="failed", hint="userCancel", finished_at=now)
+            else:
+                order.update(status="complete", hint=None, finished_at=now)
+        elif elapsed >= SIGN_SECONDS / 3:
+            order['hint'] = "userSign"
+
+    body = {"orderRef": data.orderRef, "status": order['status']}
+    if order['hint']:
+        body["hintCode"] = order['hint']
+    if order['status'] == "complete":
+        body["completionData"] = {
+            "user": {"personalNumber": order['personal_number'], "name": "Test Testsson"},
+            "device": {"ipAddress": "127.0.0.1"},
+            "bankIdIssueDate": "2024-01-01",
+            "signature": "c2ltdWxhdGVk",
+            "ocspResponse": "c2ltdWxhdGVk",
+        }
+    return body
+
+@app.post("/rp/v6.0/cancel")
+async def bankid_cancel(data: CollectRequest):
+    order = orders.get(data.orderRef)
+    if order is None or order['status'] != "pending":
+        raise bankid_error("invalidParameters", "No such order")
+    order.update(status="failed", hint="cancelled", finished_at=time.monotonic())
+    return {}
+
+# Swish
+class PaymentRequest(BaseModel):
+    payeePaymentReference: Optional[str] = None
+    payeeAlias: str
+    payerAlias: Optional[str] = None
+    amount: str
+    currency: str
+    message: Optional[str] = None
+
+@app.put("/swish-cpcapi/api/v2/paymentrequests/{instruction_id}", status_code=201)
+async def create_payment_request(instruction_id: str, data: PaymentRequest):
+    if instruction_id in payment_requests:
+        # Same instruction ID again: the request already exists
+        raise HTTPException(status_code=409, detail=[{"errorCode": "RP08", "errorMessage": "Duplicate instruction"}])
+    if data.currency != "SEK":
+        raise HTTPException(status_code=422, detail=[{"errorCode": "PA01", "errorMessage": "Invalid currency"}])
+    payment_requests[instruction_id] = {
+        "id": instruction_id,
+        "payeePaymentReference": data.payeePaymentReference,
+        "payeeAlias": data.payeeAlias,
+        "payerAlias": data.payerAlias,
+        "amount": float(data.amount),
+        "currency": data.currency,
+        "message": data.message,
+        "status": "CREATED",
+        "dateCreated": datetime.now(timezone.utc).isoformat(),
+        "datePaid": None,
+        "_started_at": time.monotonic(),
+        "_declines": random.random() < DECLINE_RATE,
+    }
+    return Response(status_code=201, headers={"Location": f"/swish-cpcapi/api/v1/paymentrequests/{instruction_id}"})
+
+@app.get("/swish-cpcapi/api/v1/paymentrequests/{instruction_id}")
+async def get_payment_request(instruction_id: str):
+    payment = payment_requests.get(instruction_id)
+    if payment is None:
+        raise HTTPException(status_code=404, detail=[{"errorCode": "RP04", "errorMessage": "No such payment request"}])
+    if payment['status'] == "CREATED" and time.monotonic() - payment['_started_at'] >= PAY_SECONDS:
+        if payment['_declines']:
+            payment['status'] = "DECLINED"
+        else:
+            payment.update(status="PAID", datePaid=datetime.now(timezone.utc).isoformat())
+    return {key: value for key, value in payment.items() if not key.startswith("_")}
@@ -1,38 +1,60 @@
-from fastapi import FastAPI, APIRouter, HTTPException
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, APIRouter, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse, Response, JSONResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from starlette.routing import compile_path, get_route_path
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
+from bson import ObjectId
+from gridfs.errors import FileExists
+from pymongo import UpdateOne, ReplaceOne, ReturnDocument, CursorType, monitoring
+import pymongo.database
+from pymongo.errors import PyMongoError, BulkWriteError, OperationFailure, DuplicateKeyError, CollectionInvalid
 import os
+import socket
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field, field_validator
+from pydantic import BaseModel, Field, field_validator, ValidationError
 from typing import Optional, List
+from collections import defaultdict
 import uuid
-from datetime import datetime, timezone
+from datetime import datetime, timezone, timedelta
 from enum import Enum
 import io
+import base64
+import re
+import unicodedata
+import json
+import csv
+import hashlib
+import copy
+import multiprocessing
+import zipfile
+import tempfile
+import smtplib
+from email.message import EmailMessage
+from xml.sax.saxutils import escape
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from reportlab.lib import colors
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import mm
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, Flowable
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 import asyncio
 import random
+import httpx
+import time
+import math
+import threading
+import contextvars
+from contextlib import asynccontextmanager
+from bisect import bisect_left
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
-
-app = FastAPI()
-api_router = APIRouter(prefix="/api")
-
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -41,31 +63,935 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # =====================
-# MOCK EMAIL SERVICE
+# METRICS
 # =====================
-async def send_mock_email(to_email: str, subject: str, body: str):
-    """Mock email service - logs to console instead of sending real emails"""
-    logger.info("=" * 60)
-    logger.info("📧 MOCK EMAIL NOTIFICATION")
-    logger.info("=" * 60)
-    logger.info(f"To: {to_email}")
-    logger.info(f"Subject: {subject}")
-    logger.info("-" * 40)
-    logger.info(f"Body:\n{body}")
-    logger.info("=" * 60)
-    
-    # Store in database for admin panel
-    await db.email_logs.insert_one({
-        "to": to_email,
-        "subject": subject,
-        "body": body,
-        "sent_at": datetime.now(timezone.utc).isoformat(),
-        "status": "sent (mocked)"
-    })
-    
-    return True
+SLOW_REQUEST_SECONDS = float(os.environ.get('SLOW_REQUEST_SECONDS', '1'))
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Every metric registers itself here, in the order it is exported
+registered_metrics = []
+
+def format_metric_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+def format_metric_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = []
+    for name, value in zip(names, values):
+        escaped = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{escaped}"')
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, description: str, labels: tuple = ()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self._values = defaultdict(float)
+        self._lock = threading.Lock()
+        registered_metrics.append(self)
+
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self._values[label_values] += amount
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for label_values, value in values:
+            yield f"{self.name}{format_metric_labels(self.labels, label_values)} {format_metric_value(value)}"
+
+class Histogram:
+    """Cumulative-bucket histogram; safe to observe from Motor's executor threads"""
+    kind = "histogram"
+
+    def __init__(self, name: str, description: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = buckets
+        # label values -> (per-bucket counts with a trailing +Inf slot, [sum])
+        self._series = {}
+        self._lock = threading.Lock()
+        registered_metrics.append(self)
+
+    def observe(self, value: float, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = ([0] * (len(self.buckets) + 1), [0.0])
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1][0] += value
+
+    def samples(self):
+        with self._lock:
+            series = sorted((values, (list(counts), total[0])) for values, (counts, total) in self._series.items())
+        for label_values, (counts, total) in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                yield f"{self.name}_bucket{format_metric_labels(self.labels, label_values, le)} {cumulative}"
+            labels = format_metric_labels(self.labels, label_values)
+            yield f"{self.name}_sum{labels} {format_metric_value(total)}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+class Gauge:
+    """Read from a callback when metrics are scraped"""
+    kind = "gauge"
+
+    def __init__(self, name: str, description: str, read):
+        self.name = name
+        self.description = description
+        self.read = read
+        registered_metrics.append(self)
+
+    def samples(self):
+        yield f"{self.name} {format_metric_value(self.read())}"
+
+def render_metrics() -> str:
+    """All registered metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in registered_metrics:
+        lines.append(f"# HELP {metric.name} {metric.description}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.samples())
+    return "\n".join(lines) + "\n"
+
+http_request_duration = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template",
+    ("method", "route", "status"),
+)
+mongo_command_duration = Histogram(
+    "mongodb_command_duration_seconds", "MongoDB command latency by collection and command",
+    ("collection", "command", "outcome"),
+)
+pdf_render_duration = Histogram("pdf_render_duration_seconds", "Agreement PDF render time in the worker pool")
+pdf_cache_lookups = Counter("pdf_cache_lookups_total", "Agreement PDF lookups by result", ("result",))
+email_send_duration = Histogram(
+    "email_send_duration_seconds", "Email transport call latency",
+    ("transport", "outcome"),
+)
+
+# Time spent per dependency while serving the current request: kind -> [seconds, calls]
+request_timings = contextvars.ContextVar("request_timings", default=None)
+
+def record_timing(kind: str, seconds: float):
+    timings = request_timings.get()
+    if timings is not None:
+        timings[kind][0] += seconds
+        timings[kind][1] += 1
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Times every command Motor sends, by collection and command name.
+
+    Motor runs pymongo on executor threads with a copy of the caller's
+    context, so commands are also attributed to the request that issued them.
+    """
+
+    def __init__(self):
+        self._collections = {}
+
+    def started(self, event):
+        target = event.command.get(event.command_name)
+        collection = target if isinstance(target, str) else event.command.get("collection", "-")
+        self._collections[(event.connection_id, event.request_id)] = collection
+
+    def _finished(self, event, outcome: str):
+        collection = self._collections.pop((event.connection_id, event.request_id), "-")
+        seconds = event.duration_micros / 1_000_000
+        mongo_command_duration.observe(seconds, collection, event.command_name, outcome)
+        record_timing("mongo", seconds)
+
+    def succeeded(self, event):
+        self._finished(event, "ok")
+
+    def failed(self, event):
+        self._finished(event, "failed")
+
+class RequestMetricsMiddleware:
+    """Records request latency under the matched route template and logs slow
+    requests with a breakdown of where the time went.
+
+    Event streams stay open for as long as the client listens, so they are
+    left out of the latency histogram.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        response = {"status": 500, "event_stream": False}
+        timings = defaultdict(lambda: [0.0, 0])
+        token = request_timings.set(timings)
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                content_type = dict(message.get("headers", [])).get(b"content-type", b"")
+                response["event_stream"] = content_type.startswith(b"text/event-stream")
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            request_timings.reset(token)
+            if not response["event_stream"]:
+                elapsed = time.perf_counter() - start
+                route = scope.get("route")
+                template = route.path if route is not None else "unmatched"
+                http_request_duration.observe(elapsed, scope["method"], template, response["status"])
+                if elapsed >= SLOW_REQUEST_SECONDS:
+                    log_slow_request(scope, template, response["status"], elapsed, timings)
+
+def log_slow_request(scope, template: str, status: int, elapsed: float, timings: dict):
+    parts = [f"{kind} {seconds * 1000:.1f} ms/{calls}" for kind, (seconds, calls) in sorted(timings.items())]
+    other = elapsed - sum(seconds for seconds, _ in timings.values())
+    parts.append(f"other {max(other, 0) * 1000:.1f} ms")
+    logger.warning(
+        f"Slow request {scope['method']} {scope['path']} ({template}) -> {status} "
+        f"took {elapsed * 1000:.1f} ms: {', '.join(parts)}"
+    )
+
+# =====================
+# DATABASE
+# =====================
+# Client options read from the environment; unset ones keep the URL's or
+# pymongo's defaults: (env var, client option, parser)
+MONGO_CLIENT_SETTINGS = (
+    ('MONGO_MAX_POOL_SIZE', 'maxPoolSize', int),
+    ('MONGO_MIN_POOL_SIZE', 'minPoolSize', int),
+    ('MONGO_MAX_IDLE_TIME_MS', 'maxIdleTimeMS', int),
+    ('MONGO_WAIT_QUEUE_TIMEOUT_MS', 'waitQueueTimeoutMS', int),
+    ('MONGO_CONNECT_TIMEOUT_MS', 'connectTimeoutMS', int),
+    ('MONGO_SOCKET_TIMEOUT_MS', 'socketTimeoutMS', int),
+    ('MONGO_SERVER_SELECTION_TIMEOUT_MS', 'serverSelectionTimeoutMS', int),
+    ('MONGO_READ_PREFERENCE', 'readPreference', str),
+    ('MONGO_WRITE_CONCERN', 'w', lambda value: int(value) if value.isdigit() else value),
+    ('MONGO_WRITE_CONCERN_TIMEOUT_MS', 'wTimeoutMS', int),
+    ('MONGO_JOURNAL', 'journal', lambda value: value.lower() in ('1', 'true', 'yes')),
+)
+MONGO_PING_TIMEOUT = float(os.environ.get('MONGO_PING_TIMEOUT', '2'))
+
+def mongo_client_options() -> dict:
+    options = {}
+    for env_name, option, parse in MONGO_CLIENT_SETTINGS:
+        value = os.environ.get(env_name)
+        if value:
+            options[option] = parse(value)
+    return options
+
+class MongoPoolMetrics(monitoring.ConnectionPoolListener):
+    """Tracks connection pool usage across all servers the client talks to"""
+
+    def __init__(self):
+        self.open = 0
+        self.checked_out = 0
+        self.waiting = 0
+        self._lock = threading.Lock()
+
+    def _add(self, field: str, amount: int):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + amount)
+
+    def connection_created(self, event):
+        self._add("open", 1)
+
+    def connection_closed(self, event):
+        self._add("open", -1)
+
+    def connection_check_out_started(self, event):
+        self._add("waiting", 1)
+
+    def connection_checked_out(self, event):
+        with self._lock:
+            self.waiting -= 1
+            self.checked_out += 1
+
+    def connection_check_out_failed(self, event):
+        self._add("waiting", -1)
+
+    def connection_checked_in(self, event):
+        self._add("checked_out", -1)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+mongo_command_metrics = MongoCommandMetrics()
+mongo_pool_metrics = MongoPoolMetrics()
+
+# MongoDB connection, opened by the app's lifespan (scripts call open_database)
+client: Optional[AsyncIOMotorClient] = None
+db = None
+database_state = {"indexes_ready": False}
+
+def open_database():
+    """Create the client; no I/O happens until the first command.
+
+    Keeps a client that is already set, such as the benchmark's stand-in.
+    """
+    global client, db
+    if client is not None:
+        return
+    client = AsyncIOMotorClient(
+        os.environ['MONGO_URL'],
+        event_listeners=[mongo_command_metrics, mongo_pool_metrics],
+        **mongo_client_options()
+    )
+    db = client[os.environ['DB_NAME']]
+
+def close_database():
+    global client, db
+    if client is not None:
+        client.close()
+    client = db = None
+    database_state["indexes_ready"] = False
+
+def mongo_pool_status() -> dict:
+    max_size = client.options.pool_options.max_pool_size
+    return {
+        "max_size": max_size,
+        "open": mongo_pool_metrics.open,
+        "checked_out": mongo_pool_metrics.checked_out,
+        "waiting": mongo_pool_metrics.waiting,
+        "saturation": round(mongo_pool_metrics.checked_out / max_size, 3) if max_size else 0,
+    }
+
+async def ping_database() -> float:
+    """Round trip of a ping command in seconds; raises when the server does not answer in time"""
+    start = time.perf_counter()
+    await asyncio.wait_for(db.command("ping"), timeout=MONGO_PING_TIMEOUT)
+    return time.perf_counter() - start
+
+Gauge("mongodb_pool_connections", "Open MongoDB connections", lambda: mongo_pool_metrics.open)
+Gauge("mongodb_pool_checked_out", "MongoDB connections in use", lambda: mongo_pool_metrics.checked_out)
+Gauge("mongodb_pool_waiting", "Operations waiting for a MongoDB connection", lambda: mongo_pool_metrics.waiting)
+
+# Timestamps are stored as BSON dates, which keep milliseconds and come
+# back naive (UTC); the API serves them as ISO 8601 strings with an offset
+def utcnow() -> datetime:
+    """Current UTC time at the precision MongoDB stores, so written and read values compare equal"""
+    now = datetime.now(timezone.utc)
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+def parse_timestamp(value: str) -> datetime:
+    parsed = datetime.fromisoformat(value)
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+def iso_timestamp(value):
+    """ISO string for a stored date; anything else (None, a not yet migrated string) as is"""
+    if isinstance(value, datetime):
+        return (value if value.tzinfo else value.replace(tzinfo=timezone.utc)).isoformat()
+    return value
+
+def serialize_timestamps(doc: dict, fields) -> dict:
+    for field in fields:
+        if field in doc:
+            doc[field] = iso_timestamp(doc[field])
+    return doc
+
+api_router = APIRouter(prefix="/api")
+
+# =====================
+# STATUS EVENTS
+# =====================
+SSE_HEARTBEAT_SECONDS = 15
+SUBSCRIBER_QUEUE_SIZE = 100
+EVENT_LOG_BYTES = int(os.environ.get('EVENT_LOG_BYTES', str(16 * 1024 * 1024)))
+EVENT_LOG_RETRY_SECONDS = 0.5
+
+class EventBus:
+    """In-process pub/sub of status events, keyed by agreement ID.
+
+    When MongoDB change streams are available the bus is fed by the change
+    stream watcher, so events written by any worker reach every subscriber.
+    Multi-worker deployments without them append events to a capped
+    collection that every worker tails. Otherwise handlers publish directly
+    to the subscribers in this process.
+    """
+
+    def __init__(self):
+        self._subscribers = defaultdict(set)
+        self.change_streams = False
+        self.event_log = False
+
+    def subscribe(self, agreement_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self._subscribers[agreement_id].add(queue)
+        return queue
+
+    def unsubscribe(self, agreement_id: str, queue: asyncio.Queue):
+        queues = self._subscribers.get(agreement_id)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self._subscribers[agreement_id]
+
+    def dispatch(self, agreement_id: str, event: dict):
+        for queue in self._subscribers.get(agreement_id, ()):
+            if queue.full():
+                # Slow consumer - drop its oldest event rather than block
+                queue.get_nowait()
+            queue.put_nowait(event)
+
+    def publish(self, agreement_id: str, event: dict):
+        # With change streams the watcher dispatches the same write
+        if self.change_streams:
+            return
+        if self.event_log:
+            spawn(append_event_log(agreement_id, event))
+        else:
+            self.dispatch(agreement_id, event)
+
+event_bus = EventBus()
+
+# Background tasks must be referenced until they finish
+background_tasks = set()
+
+def spawn(coro):
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+def agreement_event(agreement: dict) -> dict:
+    return {
+        "type": "agreement",
+        "status": agreement.get('status'),
+        "updated_at": iso_timestamp(agreement.get('updated_at')),
+    }
+
+def session_event(kind: str, session: dict) -> dict:
+    ref_field = "order_ref" if kind == "bankid" else "payment_ref"
+    return {
+        "type": kind,
+        ref_field: session.get(ref_field),
+        "status": session.get('status'),
+    }
+
+# Sessions replayed to a (re)connecting client per session kind
+SNAPSHOT_SESSIONS = 5
+
+async def session_snapshot(agreement_id: str) -> List[dict]:
+    """Latest BankID/Swish sessions of an agreement, so a client that
+    reconnects learns about completions it missed while disconnected"""
+    events = []
+    for collection, kind in WATCHED_COLLECTIONS.items():
+        if kind == "agreement":
+            continue
+        ref_field = "order_ref" if kind == "bankid" else "payment_ref"
+        cursor = db[collection].find(
+            {"agreement_id": agreement_id}, {"_id": 0, ref_field: 1, "status": 1}
+        ).sort("created_at", -1).limit(SNAPSHOT_SESSIONS)
+        async for session in cursor:
+            events.append(session_event(kind, session))
+    return events
+
+def format_sse(event: dict) -> str:
+    return f"data: {json.dumps(event, default=str)}\n\n"
+
+# Standalone servers answer a change stream with this code
+CHANGE_STREAMS_UNSUPPORTED = 40573
+# ChangeStreamFatalError, ChangeStreamHistoryLost: the resume token is unusable
+CHANGE_STREAM_HISTORY_LOST = (280, 286)
+CHANGE_STREAM_RETRY_SECONDS = float(os.environ.get('CHANGE_STREAM_RETRY_SECONDS', '1'))
+CHANGE_STREAM_MAX_RETRY_SECONDS = 30
+WATCHED_COLLECTIONS = {"agreements": "agreement", "bankid_sessions": "bankid", "swish_sessions": "swish"}
+
+async def watch_change_streams():
+    """Feed the event bus from MongoDB change streams (replica sets only)"""
+    pipeline = [
+        {"$match": {
+            "operationType": {"$in": ["update", "replace"]},
+            "ns.coll": {"$in": list(WATCHED_COLLECTIONS)},
+        }},
+        {"$project": {
+            "ns": 1,
+            "fullDocument.id": 1,
+            "fullDocument.agreement_id": 1,
+            "fullDocument.status": 1,
+            "fullDocument.updated_at": 1,
+            "fullDocument.order_ref": 1,
+            "fullDocument.payment_ref": 1,
+        }},
+    ]
+    resume_token = None
+    delay = CHANGE_STREAM_RETRY_SECONDS
+    try:
+        while True:
+            try:
+                async with db.watch(pipeline, full_document="updateLookup", resume_after=resume_token) as stream:
+                    if not event_bus.change_streams:
+                        event_bus.change_streams = True
+                        logger.info("Status events fed by MongoDB change streams")
+                    delay = CHANGE_STREAM_RETRY_SECONDS
+                    async for change in stream:
+                        resume_token = stream.resume_token
+                        doc = change.get('fullDocument')
+                        if not doc:
+                            continue
+                        kind = WATCHED_COLLECTIONS[change['ns']['coll']]
+                        if kind == "agreement":
+                            # The write may come from another worker
+                            agreement_cache.forget(doc['id'])
+                            event_bus.dispatch(doc['id'], agreement_event(doc))
+                        else:
+                            event_bus.dispatch(doc['agreement_id'], session_event(kind, doc))
+            except OperationFailure as e:
+                if e.code in CHANGE_STREAM_HISTORY_LOST:
+                    # The oplog no longer reaches back to the token; start from now
+                    resume_token = None
+                logger.warning(f"Change stream failed, reopening in {delay:.0f} s: {e}")
+            except PyMongoError as e:
+                logger.warning(f"Change stream failed, reopening in {delay:.0f} s: {e}")
+            # Events written meanwhile are replayed from the resume token
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, CHANGE_STREAM_MAX_RETRY_SECONDS)
+    finally:
+        event_bus.change_streams = False
+
+def database_is_motor() -> bool:
+    """False under test stand-ins such as mongomock-motor, which lack change streams and GridFS"""
+    # The stand-ins pass for Motor classes; the wrapped database tells them apart
+    return isinstance(getattr(db, 'delegate', None), pymongo.database.Database)
+
+async def change_streams_supported() -> bool:
+    """Decided once at startup. Later stream errors are retried, never a
+    reason to leave change streams, since other workers keep using them."""
+    if not database_is_motor():
+        return False
+    delay = CHANGE_STREAM_RETRY_SECONDS
+    while True:
+        try:
+            async with db.watch([{"$match": {"operationType": "invalidate"}}]):
+                return True
+        except OperationFailure as e:
+            if e.code == CHANGE_STREAMS_UNSUPPORTED:
+                logger.info("Change streams unavailable (not a replica set)")
+                return False
+            logger.warning(f"Checking for change streams failed, retrying in {delay:.0f} s: {e}")
+        except PyMongoError as e:
+            logger.warning(f"Checking for change streams failed, retrying in {delay:.0f} s: {e}")
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, CHANGE_STREAM_MAX_RETRY_SECONDS)
+
+async def append_event_log(agreement_id: str, event: dict):
+    try:
+        await db.status_events.insert_one({"agreement_id": agreement_id, "event": event})
+    except PyMongoError as e:
+        logger.warning(f"Appending {event['type']} event for {agreement_id} failed: {e}")
+
+async def tail_event_log():
+    """Feed the event bus from the status_events capped collection.
+
+    Every worker appends its events and tails the collection, so a
+    subscriber sees writes made by any worker. The tail starts at the
+    newest entry and a cursor that dies is reopened after the last entry seen.
+    """
+    try:
+        await db.create_collection("status_events", capped=True, size=EVENT_LOG_BYTES)
+    except CollectionInvalid:
+        pass  # already created by another worker
+    # The tail starts from the newest entry, so there has to be one
+    await db.status_events.insert_one({"agreement_id": None})
+    newest = await db.status_events.find_one({}, {"_id": 1}, sort=[("$natural", -1)])
+    last_id = newest['_id']
+    event_bus.event_log = True
+    logger.info("Status events shared through the status_events collection")
+    try:
+        while True:
+            # Matching the last entry seen keeps the cursor open; a tailable
+            # cursor whose first batch is empty is closed straight away
+            cursor = db.status_events.find({"_id": {"$gte": last_id}}, cursor_type=CursorType.TAILABLE_AWAIT)
+            try:
+                # Iteration ends whenever a getMore comes back empty
+                while cursor.alive:
+                    async for entry in cursor:
+                        if entry['_id'] == last_id:
+                            continue
+                        last_id = entry['_id']
+                        agreement_id = entry.get('agreement_id')
+                        if agreement_id is None:
+                            continue
+                        if entry['event']['type'] == "agreement":
+                            # The write may come from another worker
+                            agreement_cache.forget(agreement_id)
+                        event_bus.dispatch(agreement_id, entry['event'])
+            except PyMongoError as e:
+                logger.warning(f"Status event log cursor failed: {e}")
+            await asyncio.sleep(EVENT_LOG_RETRY_SECONDS)
+    finally:
+        event_bus.event_log = False
+
+async def feed_event_bus():
+    if await change_streams_supported():
+        await watch_change_streams()
+        return
+    if WEB_CONCURRENCY > 1:
+        try:
+            await tail_event_log()
+        except Exception as e:
+            logger.warning(f"Status event log unavailable ({e}), events stay within each worker")
+            return
+    logger.info("Using in-memory event bus")
+
+# =====================
+# WORKER COORDINATION
+# =====================
+# uvicorn and gunicorn both take their worker count from WEB_CONCURRENCY
+WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', '1'))
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+LEADER_LEASE_SECONDS = float(os.environ.get('LEADER_LEASE_SECONDS', '30'))
+# A leader job that raises is restarted after this delay, doubling up to the maximum
+LEADER_RESTART_SECONDS = float(os.environ.get('LEADER_RESTART_SECONDS', '1'))
+LEADER_MAX_RESTART_SECONDS = 300
+
+async def acquire_lease(name: str, ttl: float) -> bool:
+    """Take or renew the named lease in db.leases; True while this worker holds it"""
+    now = datetime.now(timezone.utc)
+    try:
+        lease = await db.leases.find_one_and_update(
+            {"_id": name, "done": {"$ne": True}, "$or": [{"owner": WORKER_ID}, {"expires_at": {"$lte": now}}]},
+            {"$set": {"owner": WORKER_ID, "expires_at": now + timedelta(seconds=ttl)}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+    except DuplicateKeyError:
+        # Another worker holds it; the upsert collided with its document
+        return False
+    return lease is not None
+
+async def release_lease(name: str):
+    await db.leases.delete_one({"_id": name, "owner": WORKER_ID})
+
+async def finish_lease(name: str):
+    """Keep the lease document as a record that the job has run to completion"""
+    await db.leases.update_one(
+        {"_id": name, "owner": WORKER_ID},
+        {"$set": {"done": True, "done_at": utcnow()}, "$unset": {"expires_at": ""}},
+    )
+
+async def lease_done(name: str) -> bool:
+    return bool(await db.leases.count_documents({"_id": name, "done": True}, limit=1))
+
+async def run_as_leader(name: str, job):
+    """Run job() in one worker at a time across all processes and hosts.
+
+    The leader renews its lease every third of LEADER_LEASE_SECONDS. If it
+    dies, another worker takes over once the lease has expired; a leader
+    that fails to renew in time stops its job. A job that raises is
+    restarted with backoff. A job that returns is done for good: its lease
+    is marked done and no worker runs it again (delete the document from
+    db.leases to run it once more).
+    """
+    loop = asyncio.get_running_loop()
+    task = None
+    started_at = restart_at = 0.0
+    failures = 0
+    try:
+        while True:
+            try:
+                leading = await acquire_lease(name, LEADER_LEASE_SECONDS)
+                if not leading and task is None and await lease_done(name):
+                    return
+            except PyMongoError as e:
+                logger.warning(f"Renewing the {name} lease failed: {e}")
+                leading = False
+            if leading and task is None and loop.time() >= restart_at:
+                logger.info(f"Worker {WORKER_ID} runs {name}")
+                task = spawn(job())
+                started_at = loop.time()
+            elif not leading and task is not None:
+                logger.warning(f"Worker {WORKER_ID} lost the {name} lease, stopping it")
+                task.cancel()
+                task = None
+            interval = LEADER_LEASE_SECONDS / 3
+            if task is None:
+                await asyncio.sleep(min(interval, max(restart_at - loop.time(), 0)) or interval)
+                continue
+            await asyncio.wait({task}, timeout=interval)
+            if not task.done():
+                continue
+            error = task.exception()
+            task = None
+            if error is None:
+                try:
+                    await finish_lease(name)
+                except PyMongoError as e:
+                    logger.warning(f"Recording that {name} is done failed: {e}")
+                return
+            # A job that ran for a while before failing starts over with a short delay
+            failures = 1 if loop.time() - started_at > LEADER_MAX_RESTART_SECONDS else failures + 1
+            delay = min(LEADER_RESTART_SECONDS * 2 ** (failures - 1), LEADER_MAX_RESTART_SECONDS)
+            logger.error(f"{name} failed, restarting in {delay:.0f} s", exc_info=error)
+            restart_at = loop.time() + delay
+    finally:
+        if task is not None:
+            task.cancel()
+            try:
+                await release_lease(name)
+            except PyMongoError:
+                pass  # expires on its own
+
+# =====================
+# EMAIL OUTBOX
+# =====================
+OUTBOX_BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE', '50'))
+OUTBOX_FLUSH_INTERVAL = float(os.environ.get('OUTBOX_FLUSH_INTERVAL', '0.5'))
+OUTBOX_CONCURRENCY = int(os.environ.get('OUTBOX_CONCURRENCY', '8'))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', '5'))
+OUTBOX_RETRY_BASE_DELAY = float(os.environ.get('OUTBOX_RETRY_BASE_DELAY', '1'))
+# A stored message belongs to the worker delivering it until its lease runs
+# out; must outlast all retries of one message
+OUTBOX_LEASE_SECONDS = float(os.environ.get('OUTBOX_LEASE_SECONDS', '300'))
+OUTBOX_RECOVER_INTERVAL = float(os.environ.get('OUTBOX_RECOVER_INTERVAL', '60'))
+
+class LogTransport:
+    """Mock transport - logs to console instead of sending real emails"""
+    delivered_status = "sent (mocked)"
+
+    async def send(self, message: dict):
+        logger.info(
+            f"📧 MOCK EMAIL NOTIFICATION\nTo: {message['to']}\nSubject: {message['subject']}\n"
+            f"{'-' * 40}\n{message['body']}"
+        )
+
+class SmtpTransport:
+    """Plain SMTP, e.g. a local stand-in such as `python -m aiosmtpd -n -l localhost:1025`"""
+    delivered_status = "sent"
+
+    def __init__(self, host: str, port: int, sender: str):
+        self.host = host
+        self.port = port
+        self.sender = sender
 
-async def notify_tenant_new_agreement(tenant_email: str, landlord_name: str, property_address: str, agreement_id: str):
+    def _send(self, message: dict):
+        email = EmailMessage()
+        email["From"] = self.sender
+        email["To"] = message['to']
+        email["Subject"] = message['subject']
+        email.set_content(message['body'])
+        with smtplib.SMTP(self.host, self.port, timeout=10) as smtp:
+            smtp.send_message(email)
+
+    async def send(self, message: dict):
+        await asyncio.to_thread(self._send, message)
+
+def create_email_transport():
+    if os.environ.get('EMAIL_TRANSPORT', 'log') == 'smtp':
+        return SmtpTransport(
+            host=os.environ.get('SMTP_HOST', 'localhost'),
+            port=int(os.environ.get('SMTP_PORT', '1025')),
+            sender=os.environ.get('SMTP_SENDER', 'noreply@securebooking.se'),
+        )
+    return LogTransport()
+
+class EmailOutbox:
+    """Queue of outgoing email, persisted to email_logs in batches and
+    delivered by a background worker.
+
+    Handlers only enqueue; every database write and transport call happens
+    in the worker. Messages are stored with status "queued" and a delivery
+    lease before delivery; anything still queued once its lease has run out
+    (the worker died) is picked up again by the recovery job.
+    """
+
+    def __init__(self, transport):
+        self.transport = transport
+        self._queue = asyncio.Queue()
+        self._send_slots = asyncio.Semaphore(OUTBOX_CONCURRENCY)
+
+    def enqueue(self, to_email: str, subject: str, body: str, agreement_id: Optional[str] = None):
+        self._queue.put_nowait({
+            "id": str(uuid.uuid4()),
+            "to": to_email,
+            "subject": subject,
+            "body": body,
+            "agreement_id": agreement_id,
+            "queued_at": datetime.now(timezone.utc),
+            "status": "queued",
+            "attempts": 0,
+        })
+
+    async def _next_batch(self) -> list:
+        batch = [await self._queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + OUTBOX_FLUSH_INTERVAL
+        while len(batch) < OUTBOX_BATCH_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    @property
+    def queued(self) -> int:
+        return self._queue.qsize()
+
+    async def _send(self, message: dict):
+        transport = type(self.transport).__name__
+        async with self._send_slots:
+            start = time.perf_counter()
+            try:
+                await self.transport.send(message)
+            except Exception:
+                email_send_duration.observe(time.perf_counter() - start, transport, "failed")
+                raise
+            email_send_duration.observe(time.perf_counter() - start, transport, "sent")
+
+    async def _deliver(self, message: dict) -> UpdateOne:
+        attempts = message.get('attempts', 0)
+        error = None
+        while attempts < OUTBOX_MAX_ATTEMPTS:
+            attempts += 1
+            try:
+                await self._send(message)
+                return UpdateOne({"id": message['id']}, {"$set": {
+                    "status": self.transport.delivered_status,
+                    "sent_at": datetime.now(timezone.utc),
+                    "attempts": attempts,
+                }})
+            except Exception as e:
+                error = str(e)
+                logger.warning(f"Email {message['id']} attempt {attempts} failed: {e}")
+                if attempts < OUTBOX_MAX_ATTEMPTS:
+                    await asyncio.sleep(OUTBOX_RETRY_BASE_DELAY * 2 ** (attempts - 1))
+        return UpdateOne({"id": message['id']}, {"$set": {
+            "status": "failed",
+            "attempts": attempts,
+            "last_error": error,
+        }})
+
+    async def _deliver_batch(self, batch: list):
+        results = await asyncio.gather(*(self._deliver(message) for message in batch))
+        try:
+            await db.email_logs.bulk_write(list(results), ordered=False)
+        except PyMongoError:
+            logger.exception(f"Recording delivery of {len(batch)} emails failed")
+
+    async def _persist(self, batch: list):
+        lease_until = datetime.now(timezone.utc) + timedelta(seconds=OUTBOX_LEASE_SECONDS)
+        try:
+            await db.email_logs.insert_many(
+                [{**message, "lease_until": lease_until} for message in batch], ordered=False
+            )
+        except BulkWriteError as e:
+            # A retried batch may already be partly stored; those rows are fine as they are
+            if any(error['code'] != 11000 for error in e.details.get('writeErrors', [])) \
+                    or e.details.get('writeConcernErrors'):
+                raise
+
+    async def recover(self) -> int:
+        """Claim and redeliver one batch of messages whose delivery lease ran out"""
+        now = datetime.now(timezone.utc)
+        claimed = []
+        while len(claimed) < OUTBOX_BATCH_SIZE:
+            message = await db.email_logs.find_one_and_update(
+                {"status": "queued", "$or": [{"lease_until": {"$lte": now}}, {"lease_until": {"$exists": False}}]},
+                {"$set": {"lease_until": now + timedelta(seconds=OUTBOX_LEASE_SECONDS)}},
+                projection={"_id": 0},
+            )
+            if message is None:
+                break
+            claimed.append(message)
+        if claimed:
+            logger.info(f"Redelivering {len(claimed)} queued emails")
+            await self._deliver_batch(claimed)
+        return len(claimed)
+
+    async def run_recovery(self):
+        """Leader job: redeliver mail left behind by workers that died"""
+        while True:
+            try:
+                while await self.recover() == OUTBOX_BATCH_SIZE:
+                    pass
+            except PyMongoError:
+                logger.exception("Recovering queued emails failed")
+            await asyncio.sleep(OUTBOX_RECOVER_INTERVAL)
+
+    async def run(self):
+        while True:
+            batch = await self._next_batch()
+            try:
+                await self._persist(batch)
+            except PyMongoError:
+                logger.exception(f"Persisting {len(batch)} emails failed, retrying")
+                for message in batch:
+                    self._queue.put_nowait(message)
+                await asyncio.sleep(OUTBOX_RETRY_BASE_DELAY)
+                continue
+            # Retries back off independently, so one slow batch never stalls the queue
+            spawn(self._deliver_batch(batch))
+
+    async def drain(self):
+        """Flush whatever is still queued (used at shutdown)"""
+        batch = []
+        while not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        if batch:
+            await self._persist(batch)
+            await self._deliver_batch(batch)
+
+email_outbox = EmailOutbox(create_email_transport())
+Gauge("email_outbox_queued", "Emails waiting to be persisted and delivered", lambda: email_outbox.queued)
+
+# Email log
+EMAIL_LOGS_PAGE_SIZE = 50
+EMAIL_LOGS_MAX_PAGE_SIZE = 200
+# Logs older than this are removed by a TTL index on queued_at; 0 keeps them forever
+EMAIL_LOG_RETENTION_DAYS = int(os.environ.get('EMAIL_LOG_RETENTION_DAYS', '180'))
+EMAIL_LOG_TIMESTAMP_FIELDS = ("queued_at", "sent_at")
+# The outbox's delivery lease is bookkeeping, not part of the log
+EMAIL_LOG_PROJECTION = {"_id": 0, "lease_until": 0}
+
+def email_log_projection(include_body: bool) -> dict:
+    return EMAIL_LOG_PROJECTION if include_body else {**EMAIL_LOG_PROJECTION, "body": 0}
+
+def serialize_email_log(log: dict) -> dict:
+    return serialize_timestamps(log, EMAIL_LOG_TIMESTAMP_FIELDS)
+
+def encode_email_log_cursor(log: dict) -> str:
+    """Encode the keyset position (queued_at, id) of the last log on a page"""
+    raw = json.dumps([serialize_email_log(dict(log))['queued_at'], log['id']]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+def decode_email_log_cursor(cursor: str) -> dict:
+    """Keyset filter selecting logs older than the cursor position"""
+    try:
+        queued_at, log_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        queued_at = parse_timestamp(queued_at)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Ogiltig cursor")
+    return {"$or": [
+        {"queued_at": {"$lt": queued_at}},
+        {"queued_at": queued_at, "id": {"$lt": str(log_id)}},
+    ]}
+
+def notify_tenant_new_agreement(tenant_email: str, landlord_name: str, property_address: str, agreement_id: str):
     """Notify tenant that they have received a new agreement to sign"""
     subject = f"Du har fått ett hyresavtal från {landlord_name}"
     body = f"""Hej!
@@ -81,9 +1007,9 @@ Avtals-ID: {agreement_id[:8]}
 Med vänliga hälsningar,
 Securebooking
 """
-    await send_mock_email(tenant_email, subject, body)
+    email_outbox.enqueue(tenant_email, subject, body, agreement_id)
 
-async def notify_landlord_tenant_signed(landlord_email: str, landlord_name: str, tenant_name: str, property_address: str, agreement_id: str):
+def notify_landlord_tenant_signed(landlord_email: str, landlord_name: str, tenant_name: str, property_address: str, agreement_id: str):
     """Notify landlord that tenant has signed the agreement"""
     subject = f"Hyresgästen har signerat avtalet - Din tur att signera"
     body = f"""Hej {landlord_name}!
@@ -104,9 +1030,9 @@ Avtals-ID: {agreement_id[:8]}
 Med vänliga hälsningar,
 Securebooking
 """
-    await send_mock_email(landlord_email, subject, body)
+    email_outbox.enqueue(landlord_email, subject, body, agreement_id)
 
-async def notify_both_agreement_completed(landlord_email: str, tenant_email: str, landlord_name: str, tenant_name: str, property_address: str, agreement_id: str):
+def notify_both_agreement_completed(landlord_email: str, tenant_email: str, landlord_name: str, tenant_name: str, property_address: str, agreement_id: str):
     """Notify both parties that the agreement is complete"""
     subject = "Hyresavtalet är nu klart!"
     
@@ -123,7 +1049,7 @@ Avtals-ID: {agreement_id[:8]}
 Med vänliga hälsningar,
 Securebooking
 """
-    await send_mock_email(landlord_email, subject, landlord_body)
+    email_outbox.enqueue(landlord_email, subject, landlord_body, agreement_id)
     
     # Tenant email
     tenant_body = f"""Hej {tenant_name}!
@@ -138,7 +1064,7 @@ Avtals-ID: {agreement_id[:8]}
 Med vänliga hälsningar,
 Securebooking
 """
-    await send_mock_email(tenant_email, subject, tenant_body)
+    email_outbox.enqueue(tenant_email, subject, tenant_body, agreement_id)
 
 # Enums
 class AgreementStatus(str, Enum):
@@ -227,11 +1153,11 @@ class Agreement(BaseModel):
     payment: PaymentInfo
     other: Optional[OtherInfo] = None
     status: AgreementStatus = AgreementStatus.DRAFT
-    tenant_signed_at: Optional[str] = None
-    landlord_signed_at: Optional[str] = None
-    payment_completed_at: Optional[str] = None
-    created_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
-    updated_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
+    tenant_signed_at: Optional[datetime] = None
+    landlord_signed_at: Optional[datetime] = None
+    payment_completed_at: Optional[datetime] = None
+    created_at: datetime = Field(default_factory=utcnow)
+    updated_at: datetime = Field(default_factory=utcnow)
 
 class BankIDSignRequest(BaseModel):
     personnummer: str
@@ -251,323 +1177,1840 @@ class SwishPaymentResponse(BaseModel):
     message: str
     payment_ref: Optional[str] = None
 
-# Helper functions
-def generate_pdf(agreement: dict) -> io.BytesIO:
-    """Generate a PDF for the agreement"""
-    buffer = io.BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4, rightMargin=20*mm, leftMargin=20*mm, topMargin=20*mm, bottomMargin=20*mm)
-    
-    styles = getSampleStyleSheet()
-    title_style = ParagraphStyle('Title', parent=styles['Heading1'], fontSize=24, spaceAfter=20, textColor=colors.HexColor('#1A3C34'))
-    heading_style = ParagraphStyle('Heading', parent=styles['Heading2'], fontSize=14, spaceAfter=10, textColor=colors.HexColor('#1A3C34'))
-    normal_style = ParagraphStyle('Normal', parent=styles['Normal'], fontSize=10, spaceAfter=5)
-    
-    story = []
-    
-    # Title
-    story.append(Paragraph("HYRESAVTAL", title_style))
-    story.append(Paragraph(f"Avtal ID: {agreement['id'][:8]}", normal_style))
-    story.append(Paragraph(f"Skapat: {agreement['created_at'][:10]}", normal_style))
-    story.append(Spacer(1, 20))
-    
-    # Landlord
-    story.append(Paragraph("HYRESVÄRD", heading_style))
-    landlord = agreement['landlord']
-    story.append(Paragraph(f"Namn: {landlord['name']}", normal_style))
-    story.append(Paragraph(f"Personnummer: {landlord['personnummer']}", normal_style))
-    story.append(Paragraph(f"Adress: {landlord['address']}, {landlord.get('postal_code', '')} {landlord.get('city', '')}", normal_style))
-    story.append(Paragraph(f"E-post: {landlord.get('email', '-')}", normal_style))
-    story.append(Paragraph(f"Telefon: {landlord.get('phone', '-')}", normal_style))
-    story.append(Spacer(1, 15))
-    
-    # Tenant
-    story.append(Paragraph("HYRESGÄST", heading_style))
-    tenant = agreement['tenant']
-    story.append(Paragraph(f"Namn: {tenant['name']}", normal_style))
-    story.append(Paragraph(f"Personnummer: {tenant['personnummer']}", normal_style))
-    story.append(Paragraph(f"Adress: {tenant['address']}, {tenant.get('postal_code', '')} {tenant.get('city', '')}", normal_style))
-    story.append(Paragraph(f"E-post: {tenant.get('email', '-')}", normal_style))
-    story.append(Paragraph(f"Telefon: {tenant.get('phone', '-')}", normal_style))
-    story.append(Spacer(1, 15))
-    
-    # Property
-    story.append(Paragraph("HYRESOBJEKT", heading_style))
-    prop = agreement['property']
-    story.append(Paragraph(f"Adress: {prop['address']}, {prop.get('postal_code', '')} {prop.get('city', '')}", normal_style))
-    story.append(Paragraph(f"Typ: {prop.get('property_type', '-')}", normal_style))
-    story.append(Spacer(1, 15))
-    
-    # Period
-    story.append(Paragraph("HYRESPERIOD", heading_style))
-    period = agreement['rental_period']
-    story.append(Paragraph(f"Från: {period['from_date']}", normal_style))
-    story.append(Paragraph(f"Till: {period['to_date']}", normal_style))
-    story.append(Paragraph(f"Antal personer: {period.get('person_count', 1)}", normal_style))
-    story.append(Spacer(1, 15))
-    
-    # Payment
-    story.append(Paragraph("HYRA & BETALNING", heading_style))
-    payment = agreement['payment']
-    payment_methods = {"bank": "Banköverföring", "swish": "Swish", "annat": "Annat"}
-    story.append(Paragraph(f"Hyresbelopp: {payment['rent_amount']} SEK", normal_style))
-    story.append(Paragraph(f"Betalningssätt: {payment_methods.get(payment['payment_method'], payment['payment_method'])}", normal_style))
-    if payment.get('security_type'):
-        security_types = {"deposition": "Deposition", "forskott": "Förskottsbetalning", "ingen": "Ingen säkerhet"}
-        story.append(Paragraph(f"Säkerhet: {security_types.get(payment['security_type'], payment['security_type'])}", normal_style))
-    story.append(Spacer(1, 15))
-    
-    # Signatures
-    story.append(Paragraph("SIGNATURER", heading_style))
-    if agreement.get('tenant_signed_at'):
-        story.append(Paragraph(f"✓ Hyresgäst signerad med BankID: {agreement['tenant_signed_at'][:19].replace('T', ' ')}", normal_style))
-    if agreement.get('landlord_signed_at'):
-        story.append(Paragraph(f"✓ Hyresvärd signerad med BankID: {agreement['landlord_signed_at'][:19].replace('T', ' ')}", normal_style))
-    if agreement.get('payment_completed_at'):
-        story.append(Paragraph(f"✓ Betalning genomförd: {agreement['payment_completed_at'][:19].replace('T', ' ')}", normal_style))
-    story.append(Spacer(1, 20))
-    
-    # Terms
-    story.append(Paragraph("AVTALSVILLKOR", heading_style))
-    terms = [
-        "1. Säkerhet (deposition): Hyresgästen ska erlägga säkerhet som garanti för avtalets fullgörande.",
-        "2. Andrahandsuthyrning: Ej tillåten utan hyresvärdens skriftliga godkännande.",
-        "3. Avbokning: Ska ske skriftligen efter överenskommelse mellan parterna.",
-        "4. Kontraktsbrott: Vid väsentligt brott kan hyresvärden säga upp avtalet.",
-        "5. Städning: Hyresgästen ansvarar för att bostaden är välstädad vid avflyttning.",
-        "6. Skador: Hyresgästen ansvarar för skador genom oaktsamhet.",
-        "7. Tillämplig lag: Detta avtal regleras enligt svensk lag."
-    ]
-    for term in terms:
-        story.append(Paragraph(term, ParagraphStyle('Term', parent=normal_style, fontSize=9)))
-    
-    story.append(Spacer(1, 30))
-    story.append(Paragraph("Detta avtal är digitalt signerat med BankID och är juridiskt bindande.", 
-                          ParagraphStyle('Footer', parent=normal_style, fontSize=8, textColor=colors.gray)))
-    
-    doc.build(story)
-    buffer.seek(0)
-    return buffer
+class AgreementExportRequest(BaseModel):
+    ids: Optional[List[str]] = None
+    status: Optional[AgreementStatus] = None
+    created_from: Optional[str] = None
+    created_to: Optional[str] = None
 
+# Agreement reads never need the internal search index fields
+AGREEMENT_PROJECTION = {"_id": 0, "search_terms": 0, "search_words": 0}
+AGREEMENT_TIMESTAMP_FIELDS = (
+    "created_at", "updated_at", "content_updated_at", "tenant_signed_at", "landlord_signed_at", "payment_completed_at",
+)
 
-# API Routes
+def serialize_agreement(agreement: dict) -> dict:
+    """Agreement as the API serves it, from a full or projected document"""
+    return serialize_timestamps(agreement, AGREEMENT_TIMESTAMP_FIELDS)
 
-@api_router.get("/")
-async def root():
-    return {"message": "Securebooking API", "version": "1.0.0"}
+# =====================
+# AGREEMENT CACHE
+# =====================
+AGREEMENT_CACHE_TTL = float(os.environ.get('AGREEMENT_CACHE_TTL', '5'))
+AGREEMENT_CACHE_SIZE = int(os.environ.get('AGREEMENT_CACHE_SIZE', '10000'))
 
-# Create Agreement
-@api_router.post("/agreements", response_model=dict)
-async def create_agreement(data: AgreementCreate):
-    agreement = Agreement(
-        landlord=data.landlord.model_dump(),
-        tenant=data.tenant.model_dump(),  # Convert to dict
-        property=data.property,
-        rental_period=data.rental_period,
-        payment=data.payment,
-        other=data.other,
-        status=AgreementStatus.PENDING_TENANT_SIGNATURE
-    )
-    
-    doc = agreement.model_dump()
-    await db.agreements.insert_one(doc)
-    
-    # Send email notification to tenant
-    await notify_tenant_new_agreement(
-        tenant_email=data.tenant.email,
-        landlord_name=data.landlord.name,
-        property_address=data.property.address,
-        agreement_id=agreement.id
-    )
-    
-    return {"id": agreement.id, "status": agreement.status, "message": "Avtal skapat framgångsrikt"}
+agreement_cache_lookups = Counter("agreement_cache_lookups_total", "Agreement cache lookups by result", ("result",))
 
-# Get Agreement
-@api_router.get("/agreements/{agreement_id}")
-async def get_agreement(agreement_id: str):
-    agreement = await db.agreements.find_one({"id": agreement_id}, {"_id": 0})
-    if not agreement:
-        raise HTTPException(status_code=404, detail="Avtal hittades inte")
-    return agreement
+class MemoryAgreementStore:
+    """In-process stand-in for the shared tier, for tests and single-worker runs"""
 
-# List Agreements
-@api_router.get("/agreements")
-async def list_agreements():
-    agreements = await db.agreements.find({}, {"_id": 0}).to_list(100)
-    return agreements
+    def __init__(self):
+        self._entries = {}
 
-# Update Tenant Info
-@api_router.put("/agreements/{agreement_id}/tenant")
-async def update_tenant_info(agreement_id: str, data: TenantUpdateRequest):
-    agreement = await db.agreements.find_one({"id": agreement_id}, {"_id": 0})
-    if not agreement:
-        raise HTTPException(status_code=404, detail="Avtal hittades inte")
-    
-    if agreement['status'] != AgreementStatus.PENDING_TENANT_SIGNATURE:
-        raise HTTPException(status_code=400, detail="Avtalet kan inte längre ändras")
-    
-    now = datetime.now(timezone.utc).isoformat()
-    
-    await db.agreements.update_one(
-        {"id": agreement_id},
-        {"$set": {
-            "tenant": {
-                "name": data.name,
-                "personnummer": data.personnummer,
-                "address": data.address,
-                "postal_code": data.postal_code,
-                "city": data.city,
-                "phone": data.phone,
-                "email": data.email or agreement['tenant'].get('email', ''),
-            },
-            "updated_at": now
-        }}
-    )
-    
-    return {"message": "Hyresgästens uppgifter uppdaterade"}
+    async def get(self, agreement_id: str) -> Optional[dict]:
+        entry = self._entries.get(agreement_id)
+        if entry is None or entry[0] <= time.monotonic():
+            return None
+        return json.loads(entry[1])
 
-# Mock BankID - Start Signing
-@api_router.post("/agreements/{agreement_id}/bankid/start")
-async def start_bankid_signing(agreement_id: str, data: BankIDSignRequest):
-    agreement = await db.agreements.find_one({"id": agreement_id}, {"_id": 0})
-    if not agreement:
-        raise HTTPException(status_code=404, detail="Avtal hittades inte")
-    
-    # Generate mock order reference
-    order_ref = f"bankid-{uuid.uuid4().hex[:12]}"
-    
-    # Store the pending signature
-    await db.bankid_sessions.insert_one({
-        "order_ref": order_ref,
-        "agreement_id": agreement_id,
-        "personnummer": data.personnummer,
-        "signer_type": data.signer_type,
-        "status": "pending",
-        "created_at": datetime.now(timezone.utc).isoformat()
-    })
-    
-    return {
-        "order_ref": order_ref,
-        "status": "pending",
-        "message": "Öppna BankID-appen och skriv in din säkerhetskod"
-    }
+    async def set(self, agreement_id: str, agreement: dict, ttl: float):
+        self._entries[agreement_id] = (time.monotonic() + ttl, json.dumps(agreement, default=str))
 
-# Mock BankID - Check Status
-@api_router.get("/agreements/{agreement_id}/bankid/status/{order_ref}")
-async def check_bankid_status(agreement_id: str, order_ref: str):
-    session = await db.bankid_sessions.find_one({"order_ref": order_ref})
-    if not session:
-        raise HTTPException(status_code=404, detail="BankID-session hittades inte")
-    
-    # Simulate BankID completion after a few checks (mock behavior)
-    # In real implementation, this would check with BankID API
-    check_count = await db.bankid_checks.count_documents({"order_ref": order_ref})
-    await db.bankid_checks.insert_one({"order_ref": order_ref, "checked_at": datetime.now(timezone.utc).isoformat()})
-    
-    if check_count >= 2:  # Complete after 2 checks (simulating user signing)
-        # Update agreement with signature
-        now = datetime.now(timezone.utc).isoformat()
-        
-        # Get agreement for email notifications
-        agreement = await db.agreements.find_one({"id": agreement_id}, {"_id": 0})
-        
-        if session['signer_type'] == 'tenant':
-            await db.agreements.update_one(
-                {"id": agreement_id},
-                {"$set": {
-                    "tenant_signed_at": now,
-                    "status": AgreementStatus.PENDING_LANDLORD_SIGNATURE,
-                    "updated_at": now
-                }}
-            )
-            
-            # Send email to landlord that tenant has signed
-            if agreement:
-                await notify_landlord_tenant_signed(
-                    landlord_email=agreement['landlord'].get('email', ''),
-                    landlord_name=agreement['landlord'].get('name', ''),
-                    tenant_name=agreement['tenant'].get('name', ''),
-                    property_address=agreement['property'].get('address', ''),
-                    agreement_id=agreement_id
-                )
-        else:  # landlord
-            await db.agreements.update_one(
-                {"id": agreement_id},
-                {"$set": {
-                    "landlord_signed_at": now,
-                    "status": AgreementStatus.PENDING_PAYMENT,
-                    "updated_at": now
-                }}
-            )
+    async def delete(self, agreement_id: str):
+        self._entries.pop(agreement_id, None)
+
+    async def close(self):
+        self._entries.clear()
+
+class RedisAgreementStore:
+    """Shared tier in Redis (or anything speaking its protocol) for multi-worker deployments.
+
+    Errors are logged and treated as misses; MongoDB stays the source of truth.
+    """
+
+    def __init__(self, url: str):
+        import redis.asyncio as redis
+
+        self._errors = redis.RedisError
+        self._redis = redis.from_url(url)
+
+    def _key(self, agreement_id: str) -> str:
+        return f"agreement:{agreement_id}"
+
+    async def get(self, agreement_id: str) -> Optional[dict]:
+        try:
+            raw = await self._redis.get(self._key(agreement_id))
+        except self._errors as e:
+            logger.warning(f"Agreement cache read failed: {e}")
+            return None
+        return json.loads(raw) if raw is not None else None
+
+    async def set(self, agreement_id: str, agreement: dict, ttl: float):
+        try:
+            await self._redis.set(self._key(agreement_id), json.dumps(agreement, default=str), px=int(ttl * 1000))
+        except self._errors as e:
+            logger.warning(f"Agreement cache write failed: {e}")
+
+    async def delete(self, agreement_id: str):
+        try:
+            await self._redis.delete(self._key(agreement_id))
+        except self._errors as e:
+            logger.warning(f"Agreement cache invalidation failed: {e}")
+
+    async def close(self):
+        await self._redis.aclose()
+
+def create_shared_agreement_store():
+    url = os.environ.get('AGREEMENT_CACHE_URL')
+    if not url:
+        return None
+    if url == "memory://":
+        return MemoryAgreementStore()
+    return RedisAgreementStore(url)
+
+class AgreementCache:
+    """Read-through cache of agreement documents (AGREEMENT_PROJECTION) by ID.
+
+    A TTL- and size-bounded LRU in this process sits in front of an optional
+    shared store and MongoDB. Concurrent misses for the same ID share one
+    fetch. Writes invalidate both tiers; other workers drop their copy when a
+    change stream reports the write, and otherwise after at most ttl seconds.
+    """
+
+    def __init__(self, ttl: float, max_entries: int, shared=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.shared = shared
+        self._entries = OrderedDict()
+        self._loading = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _remember(self, agreement_id: str, agreement: dict):
+        self._entries[agreement_id] = (time.monotonic() + self.ttl, agreement)
+        self._entries.move_to_end(agreement_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def _load(self, agreement_id: str, loading: asyncio.Future) -> Optional[dict]:
+        agreement = None
+        if self.shared is not None:
+            agreement = await self.shared.get(agreement_id)
+        if agreement is None:
+            agreement = await db.agreements.find_one({"id": agreement_id}, AGREEMENT_PROJECTION)
+            if agreement is not None:
+                serialize_agreement(agreement)
+            # Invalidated while loading - this copy may predate the write
+            if agreement is not None and self.shared is not None and self._loading.get(agreement_id) is loading:
+                await self.shared.set(agreement_id, agreement, self.ttl)
+        if agreement is not None and self._loading.get(agreement_id) is loading:
+            self._remember(agreement_id, agreement)
+        return agreement
+
+    async def get(self, agreement_id: str) -> Optional[dict]:
+        """The agreement, or None if it does not exist. Callers get their own copy."""
+        entry = self._entries.get(agreement_id)
+        if entry is not None:
+            expires_at, agreement = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(agreement_id)
+                agreement_cache_lookups.inc("hit")
+                return copy.deepcopy(agreement)
+            del self._entries[agreement_id]
         
-        await db.bankid_sessions.update_one({"order_ref": order_ref}, {"$set": {"status": "complete"}})
+        pending = self._loading.get(agreement_id)
+        while pending is not None:
+            agreement_cache_lookups.inc("coalesced")
+            try:
+                # Waiting callers going away must not cancel the shared result
+                agreement = await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                if not pending.cancelled() or asyncio.current_task().cancelling():
+                    raise
+                # The loading caller failed or went away; load again ourselves
+                pending = self._loading.get(agreement_id)
+                continue
+            return copy.deepcopy(agreement)
         
-        return {
-            "status": "complete",
-            "message": "Signering genomförd!",
-            "signed_at": now
-        }
-    
-    return {
-        "status": "pending",
-        "message": "Väntar på signering i BankID-appen..."
-    }
+        # The first caller fetches inline; a spawned task would cost a trip
+        # through the event loop queue on every miss
+        agreement_cache_lookups.inc("miss")
+        loading = asyncio.get_running_loop().create_future()
+        self._loading[agreement_id] = loading
+        try:
+            agreement = await self._load(agreement_id, loading)
+        except BaseException:
+            loading.cancel()
+            raise
+        finally:
+            if self._loading.get(agreement_id) is loading:
+                del self._loading[agreement_id]
+        loading.set_result(agreement)
+        return copy.deepcopy(agreement)
 
-# Mock Swish - Start Payment
-@api_router.post("/agreements/{agreement_id}/swish/start")
-async def start_swish_payment(agreement_id: str, data: SwishPaymentRequest):
-    agreement = await db.agreements.find_one({"id": agreement_id}, {"_id": 0})
-    if not agreement:
-        raise HTTPException(status_code=404, detail="Avtal hittades inte")
-    
-    # Generate mock payment reference
-    payment_ref = f"swish-{uuid.uuid4().hex[:12]}"
+    def forget(self, agreement_id: str):
+        """Drop the local copy (and any fetch in progress) for this process only"""
+        self._entries.pop(agreement_id, None)
+        self._loading.pop(agreement_id, None)
+
+    async def invalidate(self, agreement_id: str):
+        self.forget(agreement_id)
+        if self.shared is not None:
+            await self.shared.delete(agreement_id)
+
+    async def close(self):
+        if self.shared is not None:
+            await self.shared.close()
+
+agreement_cache = AgreementCache(AGREEMENT_CACHE_TTL, AGREEMENT_CACHE_SIZE, create_shared_agreement_store())
+Gauge("agreement_cache_entries", "Agreements held in this process's cache", lambda: len(agreement_cache))
+
+# =====================
+# AGREEMENT STATE MACHINE
+# =====================
+AGREEMENT_TRANSITIONS = {
+    AgreementStatus.DRAFT: {AgreementStatus.PENDING_TENANT_SIGNATURE, AgreementStatus.CANCELLED},
+    AgreementStatus.PENDING_TENANT_SIGNATURE: {AgreementStatus.PENDING_LANDLORD_SIGNATURE, AgreementStatus.CANCELLED},
+    AgreementStatus.PENDING_LANDLORD_SIGNATURE: {AgreementStatus.PENDING_PAYMENT, AgreementStatus.CANCELLED},
+    AgreementStatus.PENDING_PAYMENT: {AgreementStatus.COMPLETED, AgreementStatus.CANCELLED},
+    AgreementStatus.COMPLETED: set(),
+    AgreementStatus.CANCELLED: set(),
+}
+# The signing flow in order; a cancelled agreement is not on it
+AGREEMENT_PROGRESS = [
+    AgreementStatus.DRAFT,
+    AgreementStatus.PENDING_TENANT_SIGNATURE,
+    AgreementStatus.PENDING_LANDLORD_SIGNATURE,
+    AgreementStatus.PENDING_PAYMENT,
+    AgreementStatus.COMPLETED,
+]
+
+# BankID signer -> (expected status, next status, timestamp field)
+SIGNING_TRANSITIONS = {
+    "tenant": (AgreementStatus.PENDING_TENANT_SIGNATURE, AgreementStatus.PENDING_LANDLORD_SIGNATURE, "tenant_signed_at"),
+    "landlord": (AgreementStatus.PENDING_LANDLORD_SIGNATURE, AgreementStatus.PENDING_PAYMENT, "landlord_signed_at"),
+}
+
+async def update_agreement_in_status(agreement_id: str, expected_status: AgreementStatus, fields: dict, content_changed: bool = False) -> Optional[dict]:
+    """Apply an update only if the agreement is still in expected_status.
+
+    The status check and the write are one find_one_and_update, so concurrent
+    callers (other tabs, other workers) cannot both succeed. Returns the
+    updated agreement, or None if it was missing or in another status.
+    Pass content_changed for writes beyond status progress, so delta reads
+    (GET ?since=) know to send the full document.
+    """
+    now = utcnow()
+    stamps = {"updated_at": now, "content_updated_at": now} if content_changed else {"updated_at": now}
+    agreement = await db.agreements.find_one_and_update(
+        {"id": agreement_id, "status": expected_status},
+        {"$set": {**fields, **stamps}},
+        projection=AGREEMENT_PROJECTION,
+        return_document=ReturnDocument.AFTER,
+    )
+    if agreement:
+        serialize_agreement(agreement)
+        await agreement_cache.invalidate(agreement_id)
+        event_bus.publish(agreement_id, agreement_event(agreement))
+    return agreement
+
+async def transition_agreement(agreement_id: str, from_status: AgreementStatus, to_status: AgreementStatus, fields: Optional[dict] = None) -> Optional[dict]:
+    """Move an agreement from from_status to to_status atomically.
+
+    Returns the post-image, or None if another request got there first.
+    """
+    if to_status not in AGREEMENT_TRANSITIONS[from_status]:
+        raise ValueError(f"Invalid transition {from_status.value} -> {to_status.value}")
+    agreement = await update_agreement_in_status(agreement_id, from_status, {**(fields or {}), "status": to_status})
+    if agreement:
+        await record_transition_stats(from_status, to_status)
+    return agreement
+
+async def agreement_reached(agreement_id: str, status: AgreementStatus) -> bool:
+    """Whether the agreement is at status or further along the signing flow"""
+    agreement = await db.agreements.find_one({"id": agreement_id}, {"_id": 0, "status": 1})
+    current = agreement and agreement.get('status')
+    return current in AGREEMENT_PROGRESS and AGREEMENT_PROGRESS.index(current) >= AGREEMENT_PROGRESS.index(status)
+
+async def agreement_update_error(agreement_id: str) -> HTTPException:
+    """Explain why a conditional update matched nothing"""
+    if await db.agreements.count_documents({"id": agreement_id}, limit=1):
+        return HTTPException(status_code=400, detail="Avtalet kan inte längre ändras")
+    return HTTPException(status_code=404, detail="Avtal hittades inte")
+
+# =====================
+# SEARCH
+# =====================
+SEARCH_MIN_PREFIX = 2
+SEARCH_MAX_PREFIX = 24
+SEARCH_MAX_CANDIDATES = int(os.environ.get('SEARCH_MAX_CANDIDATES', '2000'))
+
+def normalize_search_text(text: str) -> str:
+    """Lowercase and fold diacritics, so "Åström" and "astrom" match"""
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+def search_tokens(text: str) -> List[str]:
+    return [
+        token[:SEARCH_MAX_PREFIX]
+        for token in re.split(r"[^0-9a-z]+", normalize_search_text(text))
+        if len(token) >= SEARCH_MIN_PREFIX
+    ]
+
+def agreement_search_fields(agreement: dict) -> dict:
+    """Index fields for an agreement: whole words for ranking and every
+    prefix of them for matching. search_terms carries a multikey index."""
+    def part(name: str) -> dict:
+        value = agreement.get(name) or {}
+        return value if isinstance(value, dict) else {}
     
-    await db.swish_sessions.insert_one({
-        "payment_ref": payment_ref,
-        "agreement_id": agreement_id,
-        "phone_number": data.phone_number,
-        "amount": data.amount,
-        "status": "pending",
-        "created_at": datetime.now(timezone.utc).isoformat()
-    })
+    landlord, tenant, prop = part('landlord'), part('tenant'), part('property')
+    texts = [
+        agreement.get('id', ''),
+        landlord.get('name'), landlord.get('email'),
+        tenant.get('name'), tenant.get('email'),
+        prop.get('address'), prop.get('city'),
+    ]
+    words = set()
+    for text in texts:
+        if text:
+            words.update(search_tokens(str(text)))
+    terms = {word[:length] for word in words for length in range(SEARCH_MIN_PREFIX, len(word) + 1)}
+    return {"search_terms": sorted(terms), "search_words": sorted(words)}
+
+async def backfill_search_fields(batch_size: int = 500):
+    """Index agreements written before search existed"""
+    cursor = db.agreements.find({"search_terms": {"$exists": False}}, AGREEMENT_PROJECTION).batch_size(batch_size)
+    batch = []
+    async for agreement in cursor:
+        batch.append(UpdateOne({"id": agreement['id']}, {"$set": agreement_search_fields(agreement)}))
+        if len(batch) >= batch_size:
+            await db.agreements.bulk_write(batch, ordered=False)
+            batch = []
+    if batch:
+        await db.agreements.bulk_write(batch, ordered=False)
+
+# =====================
+# ADMIN STATISTICS
+# =====================
+SERVICE_FEE_SEK = 100
+STATS_RECONCILE_INTERVAL = float(os.environ.get('STATS_RECONCILE_INTERVAL', '3600'))
+STATS_COUNTERS_ID = "agreements"
+# Recounts of the totals that may lose to concurrent updates before waiting for the next run
+STATS_RECONCILE_ATTEMPTS = 3
+PENDING_STATUSES = (
+    AgreementStatus.PENDING_TENANT_SIGNATURE,
+    AgreementStatus.PENDING_LANDLORD_SIGNATURE,
+    AgreementStatus.PENDING_PAYMENT,
+)
+
+# Counters live in db.stats: one totals document plus one bucket per day
+# ({"_id": "day:YYYY-MM-DD", "created": n, "completed": n, "revenue": n}).
+# Every update of the totals also increments their "version" (see reconcile_stats).
+def day_bucket_id(timestamp: datetime) -> str:
+    return f"day:{timestamp.date().isoformat()}"
+
+async def record_created_stats(agreements: List[dict]):
+    by_status = defaultdict(int)
+    by_day = defaultdict(int)
+    for agreement in agreements:
+        by_status[f"by_status.{AgreementStatus(agreement['status']).value}"] += 1
+        by_day[day_bucket_id(agreement['created_at'])] += 1
+    await db.stats.update_one(
+        {"_id": STATS_COUNTERS_ID},
+        {"$inc": {"total": len(agreements), "version": 1, **by_status}},
+        upsert=True,
+    )
+    await db.stats.bulk_write([
+        UpdateOne({"_id": day}, {"$inc": {"created": count}}, upsert=True)
+        for day, count in by_day.items()
+    ], ordered=False)
+
+async def record_transition_stats(from_status: AgreementStatus, to_status: AgreementStatus):
+    inc = {f"by_status.{from_status.value}": -1, f"by_status.{to_status.value}": 1, "version": 1}
+    if to_status == AgreementStatus.COMPLETED:
+        inc["revenue"] = SERVICE_FEE_SEK
+    await db.stats.update_one({"_id": STATS_COUNTERS_ID}, {"$inc": inc}, upsert=True)
+    if to_status == AgreementStatus.COMPLETED:
+        await db.stats.update_one(
+            {"_id": day_bucket_id(utcnow())},
+            {"$inc": {"completed": 1, "revenue": SERVICE_FEE_SEK}},
+            upsert=True,
+        )
+
+async def reconcile_totals() -> Optional[dict]:
+    """Recount the totals document; None if it kept changing underneath"""
+    for _ in range(STATS_RECONCILE_ATTEMPTS):
+        current = await db.stats.find_one({"_id": STATS_COUNTERS_ID}, {"version": 1})
+        version = current.get('version') if current else None
+        by_status = {}
+        async for row in db.agreements.aggregate([
+            {"$group": {"_id": "$status", "count": {"$sum": 1}}},
+        ]):
+            by_status[row['_id']] = row['count']
+        counters = {
+            "total": sum(by_status.values()),
+            "by_status": by_status,
+            "revenue": by_status.get(AgreementStatus.COMPLETED.value, 0) * SERVICE_FEE_SEK,
+            "reconciled_at": utcnow(),
+            "version": (version or 0) + 1,
+        }
+        # Only if no $inc landed since we read the version; else recount
+        try:
+            result = await db.stats.replace_one(
+                {"_id": STATS_COUNTERS_ID, "version": version}, counters, upsert=True
+            )
+        except DuplicateKeyError:
+            continue  # the upsert collided with a document that has a newer version
+        if result.matched_count or result.upserted_id is not None:
+            return counters
+    return None
+
+async def reconcile_stats() -> Optional[dict]:
+    """Re-derive all counters from the agreements collection.
+
+    The totals are written with compare-and-set on their version, so
+    updates made while they are recounted are never overwritten; if the
+    totals keep changing they are left to the next run and None is
+    returned. Day buckets are replaced as they are: an event counted into
+    a bucket while it is rewritten may be lost or counted twice until the
+    next run.
+    """
+    counters = await reconcile_totals()
+    if counters is None:
+        logger.warning(f"Agreement totals changed during {STATS_RECONCILE_ATTEMPTS} recounts, left for the next run")
+        return None
+    
+    days = defaultdict(lambda: {"created": 0, "completed": 0, "revenue": 0})
+    # Timestamps not yet migrated from ISO strings are left out until they are
+    async for row in db.agreements.aggregate([
+        {"$match": {"created_at": {"$type": "date"}}},
+        {"$group": {"_id": {"$dateToString": {"format": "%Y-%m-%d", "date": "$created_at"}}, "count": {"$sum": 1}}},
+    ]):
+        days[f"day:{row['_id']}"]["created"] = row['count']
+    async for row in db.agreements.aggregate([
+        {"$match": {"status": AgreementStatus.COMPLETED.value, "payment_completed_at": {"$type": "date"}}},
+        {"$group": {"_id": {"$dateToString": {"format": "%Y-%m-%d", "date": "$payment_completed_at"}}, "count": {"$sum": 1}}},
+    ]):
+        days[f"day:{row['_id']}"]["completed"] = row['count']
+        days[f"day:{row['_id']}"]["revenue"] = row['count'] * SERVICE_FEE_SEK
+    
+    if days:
+        await db.stats.bulk_write([
+            ReplaceOne({"_id": day}, bucket, upsert=True) for day, bucket in days.items()
+        ], ordered=False)
+    await db.stats.delete_many({"_id": {"$gte": "day:", "$lt": "day;", "$nin": list(days)}})
+    return counters
+
+async def run_stats_reconciliation():
+    delay = STATS_RECONCILE_INTERVAL
+    try:
+        # Counters never derived from the collection yet (new deployment or upgrade)
+        if not await db.stats.count_documents({"_id": STATS_COUNTERS_ID, "reconciled_at": {"$exists": True}}, limit=1):
+            delay = 0
+    except PyMongoError:
+        logger.exception("Reading agreement statistics failed")
+        delay = 0
+    while True:
+        await asyncio.sleep(delay)
+        delay = STATS_RECONCILE_INTERVAL
+        try:
+            await reconcile_stats()
+        except PyMongoError:
+            logger.exception("Reconciling agreement statistics failed")
+
+# =====================
+# SWEEPER
+# =====================
+SWEEP_INTERVAL = float(os.environ.get('SWEEP_INTERVAL', '300'))
+SWEEP_BATCH_SIZE = int(os.environ.get('SWEEP_BATCH_SIZE', '500'))
+# Pending signing/payment sessions fail as expired after this long
+SESSION_PENDING_MINUTES = float(os.environ.get('SESSION_PENDING_MINUTES', '15'))
+# Agreements untouched this long before the tenant signs are cancelled; 0 keeps them
+ABANDONED_AGREEMENT_DAYS = float(os.environ.get('ABANDONED_AGREEMENT_DAYS', '30'))
+ABANDONABLE_STATUSES = (AgreementStatus.DRAFT, AgreementStatus.PENDING_TENANT_SIGNATURE)
+# Status checks used to be logged one document each; they are now counted on the session
+LEGACY_CHECK_COLLECTIONS = ("bankid_checks", "swish_checks")
+
+sweeper_items = Counter("sweeper_items_total", "Documents the sweeper expired, cancelled or dropped", ("action",))
+sweeper_run_duration = Histogram("sweeper_run_duration_seconds", "Time per sweeper run")
+sweeper_state = {"last_run": 0.0}
+Gauge("sweeper_last_run_timestamp_seconds", "Unix time the last sweeper run finished", lambda: sweeper_state['last_run'])
+
+async def expire_pending_sessions(collection, kind: str, ref_field: str) -> int:
+    cutoff = utcnow() - timedelta(minutes=SESSION_PENDING_MINUTES)
+    expired = 0
+    while True:
+        sessions = await collection.find(
+            {"status": "pending", "created_at": {"$lt": cutoff}},
+            {"_id": 0, ref_field: 1, "agreement_id": 1},
+        ).limit(SWEEP_BATCH_SIZE).to_list(SWEEP_BATCH_SIZE)
+        if not sessions:
+            return expired
+        refs = [session[ref_field] for session in sessions]
+        now = utcnow()
+        # A session completed in the meantime keeps its status
+        result = await collection.update_many(
+            {ref_field: {"$in": refs}, "status": "pending"},
+            {"$set": {"status": "failed", "hint": "expired", "finished_at": now}},
+        )
+        expired += result.modified_count
+        async for session in collection.find(
+            {ref_field: {"$in": refs}, "status": "failed", "finished_at": now},
+            {"_id": 0, ref_field: 1, "agreement_id": 1, "status": 1},
+        ):
+            event_bus.publish(session['agreement_id'], session_event(kind, session))
+        if len(sessions) < SWEEP_BATCH_SIZE:
+            return expired
+
+async def cancel_abandoned_agreements() -> int:
+    cutoff = utcnow() - timedelta(days=ABANDONED_AGREEMENT_DAYS)
+    cancelled = 0
+    for status in ABANDONABLE_STATUSES:
+        while True:
+            stale = await db.agreements.find(
+                {"status": status, "updated_at": {"$lt": cutoff}}, {"_id": 0, "id": 1}
+            ).limit(SWEEP_BATCH_SIZE).to_list(SWEEP_BATCH_SIZE)
+            if not stale:
+                break
+            ids = [agreement['id'] for agreement in stale]
+            now = utcnow()
+            # Same guard as update_agreement_in_status: only if still in that status
+            result = await db.agreements.update_many(
+                {"id": {"$in": ids}, "status": status},
+                {"$set": {"status": AgreementStatus.CANCELLED, "updated_at": now}},
+            )
+            if result.modified_count:
+                cancelled += result.modified_count
+                await db.stats.update_one({"_id": STATS_COUNTERS_ID}, {"$inc": {
+                    f"by_status.{status.value}": -result.modified_count,
+                    f"by_status.{AgreementStatus.CANCELLED.value}": result.modified_count,
+                    "version": 1,
+                }}, upsert=True)
+                async for agreement in db.agreements.find(
+                    {"id": {"$in": ids}, "status": AgreementStatus.CANCELLED, "updated_at": now},
+                    {"_id": 0, "id": 1, "status": 1, "updated_at": 1},
+                ):
+                    await agreement_cache.invalidate(agreement['id'])
+                    event_bus.publish(agreement['id'], agreement_event(agreement))
+            if len(stale) < SWEEP_BATCH_SIZE:
+                break
+    return cancelled
+
+async def drop_legacy_check_collections() -> int:
+    existing = set(await db.list_collection_names())
+    dropped = 0
+    for name in LEGACY_CHECK_COLLECTIONS:
+        if name in existing:
+            await db.drop_collection(name)
+            logger.info(f"Dropped legacy collection {name}")
+            dropped += 1
+    return dropped
+
+async def sweep() -> dict:
+    """One pass over everything that only ever grows"""
+    start = time.perf_counter()
+    report = {
+        "bankid_sessions_expired": await expire_pending_sessions(db.bankid_sessions, "bankid", "order_ref"),
+        "swish_sessions_expired": await expire_pending_sessions(db.swish_sessions, "swish", "payment_ref"),
+        "agreements_cancelled": await cancel_abandoned_agreements() if ABANDONED_AGREEMENT_DAYS > 0 else 0,
+        "collections_dropped": await drop_legacy_check_collections(),
+    }
+    for action, count in report.items():
+        if count:
+            sweeper_items.inc(action, amount=count)
+    sweeper_run_duration.observe(time.perf_counter() - start)
+    sweeper_state['last_run'] = time.time()
+    if any(report.values()):
+        logger.info(f"Sweeper: {', '.join(f'{action} {count}' for action, count in report.items() if count)}")
+    return report
+
+async def run_sweeper():
+    """Leader job: sweep every SWEEP_INTERVAL seconds"""
+    while True:
+        try:
+            await sweep()
+        except PyMongoError:
+            logger.exception("Sweeper run failed")
+        await asyncio.sleep(SWEEP_INTERVAL)
+
+# =====================
+# PDF TEMPLATE
+# =====================
+PDF_FONT_CANDIDATES = (
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/TTF/DejaVuSans.ttf",
+)
+
+def find_pdf_font() -> Optional[str]:
+    """A TTF covering ✓ and names outside Latin-1; PDF_FONT_PATH wins over system fonts"""
+    configured = os.environ.get('PDF_FONT_PATH')
+    if configured:
+        return configured
+    return next((path for path in PDF_FONT_CANDIDATES if os.path.exists(path)), None)
+
+PDF_FONT_PATH = find_pdf_font()
+
+class PreparedBlock(Flowable):
+    """Static flowables laid out once per frame width and redrawn as-is.
+
+    Keeps together on one page, which suits short fixed sections.
+    """
+
+    def __init__(self, flowables: list):
+        super().__init__()
+        self.flowables = flowables
+        self._layout_width = None
+        self._placements = []
+        self._height = 0
+
+    def wrap(self, availWidth, availHeight):
+        if availWidth != self._layout_width:
+            placements = []
+            y = 0
+            previous_after = 0
+            for index, flowable in enumerate(self.flowables):
+                _, height = flowable.wrap(availWidth, availHeight)
+                if index:
+                    y += max(previous_after, flowable.getSpaceBefore())
+                placements.append((flowable, y, height))
+                y += height
+                previous_after = flowable.getSpaceAfter()
+            self._layout_width = availWidth
+            self._placements = placements
+            self._height = y
+        return availWidth, self._height
+
+    def getSpaceBefore(self):
+        return self.flowables[0].getSpaceBefore()
+
+    def getSpaceAfter(self):
+        return self.flowables[-1].getSpaceAfter()
+
+    def draw(self):
+        for flowable, y, height in self._placements:
+            flowable.drawOn(self.canv, 0, self._height - y - height)
+
+def pdf_text(value) -> str:
+    """Agreement data is user input; keep it out of Paragraph markup"""
+    return escape(str(value))
+
+def pdf_timestamp(value: str) -> str:
+    return pdf_text(value[:19].replace('T', ' '))
+
+class PdfFace:
+    """Styles and static sections of the agreement PDF in one font family"""
+
+    TERMS = (
+        "1. Säkerhet (deposition): Hyresgästen ska erlägga säkerhet som garanti för avtalets fullgörande.",
+        "2. Andrahandsuthyrning: Ej tillåten utan hyresvärdens skriftliga godkännande.",
+        "3. Avbokning: Ska ske skriftligen efter överenskommelse mellan parterna.",
+        "4. Kontraktsbrott: Vid väsentligt brott kan hyresvärden säga upp avtalet.",
+        "5. Städning: Hyresgästen ansvarar för att bostaden är välstädad vid avflyttning.",
+        "6. Skador: Hyresgästen ansvarar för skador genom oaktsamhet.",
+        "7. Tillämplig lag: Detta avtal regleras enligt svensk lag.",
+    )
+    HEADINGS = ("HYRESVÄRD", "HYRESGÄST", "HYRESOBJEKT", "HYRESPERIOD", "HYRA & BETALNING", "SIGNATURER")
+
+    def __init__(self, font: str, bold_font: str, check: str):
+        self.check = check
+        styles = getSampleStyleSheet()
+        self.title_style = ParagraphStyle('Title', parent=styles['Heading1'], fontName=bold_font, fontSize=24, spaceAfter=20, textColor=colors.HexColor('#1A3C34'))
+        self.heading_style = ParagraphStyle('Heading', parent=styles['Heading2'], fontName=bold_font, fontSize=14, spaceAfter=10, textColor=colors.HexColor('#1A3C34'))
+        self.normal_style = ParagraphStyle('Normal', parent=styles['Normal'], fontName=font, fontSize=10, spaceAfter=5)
+        term_style = ParagraphStyle('Term', parent=self.normal_style, fontSize=9)
+        footer_style = ParagraphStyle('Footer', parent=self.normal_style, fontSize=8, textColor=colors.gray)
+        
+        self.title = PreparedBlock([Paragraph("HYRESAVTAL", self.title_style)])
+        self.headings = {name: PreparedBlock([Paragraph(escape(name), self.heading_style)]) for name in self.HEADINGS}
+        self.closing = PreparedBlock(
+            [Paragraph("AVTALSVILLKOR", self.heading_style)]
+            + [Paragraph(term, term_style) for term in self.TERMS]
+            + [Spacer(1, 30), Paragraph("Detta avtal är digitalt signerat med BankID och är juridiskt bindande.", footer_style)]
+        )
+
+    def line(self, text: str) -> Paragraph:
+        return Paragraph(text, self.normal_style)
+
+class AgreementPdfTemplate:
+    """Fonts, styles and static sections of the agreement PDF, built once per
+    process; render() only lays out the agreement-specific fields.
+
+    Documents use the standard PDF fonts, which need no embedding, with the
+    check mark taken from ZapfDingbats. Agreements containing text outside
+    what those fonts encode switch to the TTF at font_path, when there is one.
+
+    Each layout is a versioned class registered in PDF_TEMPLATES. The version
+    is part of the PDF cache key, so a layout change never serves documents
+    rendered with another layout.
+    """
+    version = "2"
+
+    PAYMENT_METHODS = {"bank": "Banköverföring", "swish": "Swish", "annat": "Annat"}
+    SECURITY_TYPES = {"deposition": "Deposition", "forskott": "Förskottsbetalning", "ingen": "Ingen säkerhet"}
+
+    def __init__(self, font_path: Optional[str] = PDF_FONT_PATH):
+        self.standard = PdfFace("Helvetica", "Helvetica-Bold", '<font name="ZapfDingbats">✓</font>')
+        self.unicode = None
+        if font_path:
+            bold_path = font_path.replace(".ttf", "-Bold.ttf")
+            pdfmetrics.registerFont(TTFont("AgreementSans", font_path))
+            pdfmetrics.registerFont(TTFont("AgreementSans-Bold", bold_path if os.path.exists(bold_path) else font_path))
+            self.unicode = PdfFace("AgreementSans", "AgreementSans-Bold", "✓")
+
+    def face_for(self, agreement: dict) -> PdfFace:
+        if self.unicode is None:
+            return self.standard
+        text = json.dumps([agreement.get(field) for field in PDF_FIELDS], ensure_ascii=False, default=str)
+        try:
+            # The standard fonts are WinAnsi encoded
+            text.encode("cp1252")
+        except UnicodeEncodeError:
+            return self.unicode
+        return self.standard
+
+    def person(self, face: PdfFace, heading: str, person: dict) -> list:
+        line = face.line
+        return [
+            face.headings[heading],
+            line(f"Namn: {pdf_text(person['name'])}"),
+            line(f"Personnummer: {pdf_text(person['personnummer'])}"),
+            line(f"Adress: {pdf_text(person['address'])}, {pdf_text(person.get('postal_code', ''))} {pdf_text(person.get('city', ''))}"),
+            line(f"E-post: {pdf_text(person.get('email', '-'))}"),
+            line(f"Telefon: {pdf_text(person.get('phone', '-'))}"),
+            Spacer(1, 15),
+        ]
+
+    def story(self, agreement: dict) -> list:
+        face = self.face_for(agreement)
+        line = face.line
+        story = [
+            face.title,
+            line(f"Avtal ID: {pdf_text(agreement['id'][:8])}"),
+            line(f"Skapat: {pdf_text(agreement['created_at'][:10])}"),
+            Spacer(1, 20),
+        ]
+        story += self.person(face, "HYRESVÄRD", agreement['landlord'])
+        story += self.person(face, "HYRESGÄST", agreement['tenant'])
+        
+        prop = agreement['property']
+        story += [
+            face.headings["HYRESOBJEKT"],
+            line(f"Adress: {pdf_text(prop['address'])}, {pdf_text(prop.get('postal_code', ''))} {pdf_text(prop.get('city', ''))}"),
+            line(f"Typ: {pdf_text(prop.get('property_type', '-'))}"),
+            Spacer(1, 15),
+        ]
+        
+        period = agreement['rental_period']
+        story += [
+            face.headings["HYRESPERIOD"],
+            line(f"Från: {pdf_text(period['from_date'])}"),
+            line(f"Till: {pdf_text(period['to_date'])}"),
+            line(f"Antal personer: {pdf_text(period.get('person_count', 1))}"),
+            Spacer(1, 15),
+        ]
+        
+        payment = agreement['payment']
+        method = self.PAYMENT_METHODS.get(payment['payment_method'], payment['payment_method'])
+        story += [
+            face.headings["HYRA & BETALNING"],
+            line(f"Hyresbelopp: {pdf_text(payment['rent_amount'])} SEK"),
+            line(f"Betalningssätt: {pdf_text(method)}"),
+        ]
+        if payment.get('security_type'):
+            security = self.SECURITY_TYPES.get(payment['security_type'], payment['security_type'])
+            story.append(line(f"Säkerhet: {pdf_text(security)}"))
+        story.append(Spacer(1, 15))
+        
+        story.append(face.headings["SIGNATURER"])
+        if agreement.get('tenant_signed_at'):
+            story.append(line(f"{face.check} Hyresgäst signerad med BankID: {pdf_timestamp(agreement['tenant_signed_at'])}"))
+        if agreement.get('landlord_signed_at'):
+            story.append(line(f"{face.check} Hyresvärd signerad med BankID: {pdf_timestamp(agreement['landlord_signed_at'])}"))
+        if agreement.get('payment_completed_at'):
+            story.append(line(f"{face.check} Betalning genomförd: {pdf_timestamp(agreement['payment_completed_at'])}"))
+        story.append(Spacer(1, 20))
+        
+        story.append(face.closing)
+        return story
+
+    def render(self, agreement: dict) -> bytes:
+        buffer = io.BytesIO()
+        doc = SimpleDocTemplate(buffer, pagesize=A4, rightMargin=20*mm, leftMargin=20*mm, topMargin=20*mm, bottomMargin=20*mm)
+        doc.build(self.story(agreement))
+        return buffer.getvalue()
+
+PDF_TEMPLATES = {AgreementPdfTemplate.version: AgreementPdfTemplate}
+PDF_TEMPLATE_VERSION = os.environ.get('PDF_TEMPLATE_VERSION', AgreementPdfTemplate.version)
+if PDF_TEMPLATE_VERSION not in PDF_TEMPLATES:
+    raise RuntimeError(f"Unknown PDF_TEMPLATE_VERSION {PDF_TEMPLATE_VERSION}")
+
+pdf_template = None
+
+def load_pdf_template() -> AgreementPdfTemplate:
+    """Build the active template once per process (pool workers call this at start)"""
+    global pdf_template
+    if pdf_template is None:
+        pdf_template = PDF_TEMPLATES[PDF_TEMPLATE_VERSION]()
+    return pdf_template
+
+def generate_pdf(agreement: dict) -> io.BytesIO:
+    """Generate a PDF for the agreement"""
+    return io.BytesIO(load_pdf_template().render(agreement))
+
+def render_pdf_bytes(agreement: dict) -> bytes:
+    """Process pool entry point - returns the finished PDF as bytes"""
+    return load_pdf_template().render(agreement)
+
+
+# =====================
+# PDF RENDERING & CACHE
+# =====================
+PDF_RENDER_WORKERS = int(os.environ.get('PDF_RENDER_WORKERS', '2'))
+PDF_CACHE_MEMORY_BYTES = int(os.environ.get('PDF_CACHE_MEMORY_BYTES', str(32 * 1024 * 1024)))
+PDF_CACHE_DISK_BYTES = int(os.environ.get('PDF_CACHE_DISK_BYTES', str(256 * 1024 * 1024)))
+PDF_CACHE_DIR = Path(os.environ.get('PDF_CACHE_DIR', str(ROOT_DIR / '.cache' / 'pdf')))
+
+
+# Agreement fields that end up in the rendered document
+PDF_FIELDS = (
+    "id", "created_at", "updated_at", "landlord", "tenant", "property", "rental_period", "payment",
+    "tenant_signed_at", "landlord_signed_at", "payment_completed_at",
+)
+
+def pdf_cache_key(agreement: dict) -> str:
+    """Content hash of everything that affects the PDF, including updated_at"""
+    content = {field: agreement.get(field) for field in PDF_FIELDS}
+    raw = json.dumps([PDF_TEMPLATE_VERSION, PDF_FONT_PATH, content], sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+class PdfCache:
+    """Two-tier LRU of rendered PDFs: a byte-bounded memory tier in front of a
+    byte-bounded directory on disk. Disk recency is tracked through file mtime.
+
+    The disk tier is indexed in memory (size per key, least recently used
+    first), seeded from the directory at startup. Only when the running total
+    passes the limit is the directory rescanned, which also picks up files
+    other workers wrote, and pruned below the limit.
+    """
+    # Prune to this share of disk_bytes, so the next rescan is a while off
+    DISK_LOW_WATER = 0.9
+
+    def __init__(self, directory: Path, memory_bytes: int, disk_bytes: int):
+        self.directory = directory
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self._disk = OrderedDict()
+        self._disk_size = 0
+        self._pruning = False
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.pdf"
+
+    def _remember(self, key: str, pdf: bytes):
+        if len(pdf) > self.memory_bytes:
+            return
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return
+        self._memory[key] = pdf
+        self._memory_size += len(pdf)
+        while self._memory_size > self.memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted)
+
+    def _read_disk(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            pdf = path.read_bytes()
+            os.utime(path)
+            return pdf
+        except OSError:
+            return None
+
+    def _write_disk(self, key: str, pdf: bytes):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp = self.directory / f".{key}.{uuid.uuid4().hex}.tmp"
+        tmp.write_bytes(pdf)
+        os.replace(tmp, self._path(key))
+
+    def _scan_disk(self) -> List[tuple]:
+        """(key, size) of every cached file, least recently used first"""
+        entries = []
+        for path in self.directory.glob("*.pdf"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, path.stem, stat.st_size))
+        return [(key, size) for _, key, size in sorted(entries)]
+
+    def _unlink(self, keys: List[str]):
+        for key in keys:
+            self._path(key).unlink(missing_ok=True)
+
+    def _index(self, entries: List[tuple]):
+        self._disk = OrderedDict(entries)
+        self._disk_size = sum(self._disk.values())
+
+    def _track(self, key: str, size: int):
+        self._disk_size += size - self._disk.get(key, 0)
+        self._disk[key] = size
+        self._disk.move_to_end(key)
+
+    async def load(self):
+        """Seed the disk index; once at startup"""
+        self._index(await asyncio.to_thread(self._scan_disk))
+
+    async def _prune(self):
+        self._pruning = True
+        try:
+            self._index(await asyncio.to_thread(self._scan_disk))
+            evicted = []
+            while self._disk and self._disk_size > self.disk_bytes * self.DISK_LOW_WATER:
+                key, size = self._disk.popitem(last=False)
+                self._disk_size -= size
+                evicted.append(key)
+            await asyncio.to_thread(self._unlink, evicted)
+        finally:
+            self._pruning = False
+
+    async def get(self, key: str) -> Optional[bytes]:
+        pdf = self._memory.get(key)
+        if pdf is not None:
+            self._memory.move_to_end(key)
+            return pdf
+        pdf = await asyncio.to_thread(self._read_disk, key)
+        if pdf is not None:
+            self._remember(key, pdf)
+            self._track(key, len(pdf))
+        return pdf
+
+    async def put(self, key: str, pdf: bytes):
+        self._remember(key, pdf)
+        try:
+            await asyncio.to_thread(self._write_disk, key, pdf)
+            self._track(key, len(pdf))
+            if self._disk_size > self.disk_bytes and not self._pruning:
+                await self._prune()
+        except OSError as e:
+            logger.warning(f"Could not write PDF cache entry {key}: {e}")
+
+pdf_cache = PdfCache(PDF_CACHE_DIR, PDF_CACHE_MEMORY_BYTES, PDF_CACHE_DISK_BYTES)
+pdf_executor = None
+# Bounds renders queued on the pool; callers wait here instead
+pdf_render_slots = asyncio.Semaphore(PDF_RENDER_WORKERS * 2)
+pdf_renders_in_flight = {}
+Gauge("pdf_renders_in_flight", "Distinct PDFs currently being rendered", lambda: len(pdf_renders_in_flight))
+
+def start_pdf_executor():
+    global pdf_executor
+    # spawn, not fork - the parent has Motor's threads running
+    pdf_executor = ProcessPoolExecutor(
+        max_workers=PDF_RENDER_WORKERS,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=load_pdf_template,
+    )
+
+def stop_pdf_executor():
+    if pdf_executor is not None:
+        pdf_executor.shutdown(wait=False, cancel_futures=True)
+
+async def render_pdf(agreement: dict) -> bytes:
+    """Render off the event loop in the process pool"""
+    async with pdf_render_slots:
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        pdf = await loop.run_in_executor(pdf_executor, render_pdf_bytes, agreement)
+        elapsed = time.perf_counter() - start
+        pdf_render_duration.observe(elapsed)
+        record_timing("pdf", elapsed)
+        return pdf
+
+async def render_and_cache_pdf(agreement: dict, key: str) -> bytes:
+    try:
+        pdf = await render_pdf(agreement)
+        await pdf_cache.put(key, pdf)
+        return pdf
+    finally:
+        pdf_renders_in_flight.pop(key, None)
+
+async def get_or_render_pdf(agreement: dict, key: Optional[str] = None) -> bytes:
+    """Serve from cache, coalescing concurrent renders of the same content"""
+    key = key or pdf_cache_key(agreement)
+    pdf = await pdf_cache.get(key)
+    if pdf is not None:
+        pdf_cache_lookups.inc("hit")
+        return pdf
+    
+    pending = pdf_renders_in_flight.get(key)
+    if pending is None:
+        pdf_cache_lookups.inc("miss")
+        pending = spawn(render_and_cache_pdf(agreement, key))
+        pdf_renders_in_flight[key] = pending
+    else:
+        pdf_cache_lookups.inc("coalesced")
+    # A disconnecting client must not cancel a render others are waiting on
+    return await asyncio.shield(pending)
+
+# Batch export
+EXPORT_MAX_AGREEMENTS = int(os.environ.get('EXPORT_MAX_AGREEMENTS', '5000'))
+EXPORT_BATCH_SIZE = 100
+
+class ZipChunkStream:
+    """Write-only, unseekable sink for zipfile; output is drained in chunks.
+
+    Because it cannot seek, zipfile writes sizes in data descriptors after
+    each entry, so nothing already drained ever has to be rewritten.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def export_query(data: AgreementExportRequest) -> dict:
+    query = {}
+    if data.ids:
+        query["id"] = {"$in": data.ids}
+    if data.status:
+        query["status"] = data.status
+    created = {}
+    try:
+        if data.created_from:
+            created["$gte"] = parse_timestamp(data.created_from)
+        if data.created_to:
+            created["$lt"] = parse_timestamp(data.created_to)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Ogiltigt datum")
+    if created:
+        query["created_at"] = created
+    return query
+
+async def render_export_entry(agreement: dict):
+    try:
+        if agreement['status'] == AgreementStatus.COMPLETED:
+            signed = await get_signed_pdf(agreement)
+            if signed is not None:
+                return agreement['id'], await read_signed_pdf(signed)
+        return agreement['id'], await get_or_render_pdf(agreement)
+    except Exception as e:
+        logger.exception(f"Export of agreement {agreement['id']} failed")
+        return agreement['id'], e
+
+async def stream_agreements_zip(query: dict, requested_ids: Optional[List[str]] = None):
+    """Yield a ZIP archive entry by entry while PDFs render in the process pool"""
+    sink = ZipChunkStream()
+    concurrency = PDF_RENDER_WORKERS * 2
+    pending = set()
+    seen = set()
+    failed = []
+    
+    def add_finished(tasks):
+        for task in tasks:
+            agreement_id, result = task.result()
+            if isinstance(result, Exception):
+                failed.append(f"{agreement_id}: {result}")
+                continue
+            archive.writestr(f"hyresavtal-{agreement_id}.pdf", result)
+    
+    try:
+        with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_STORED) as archive:
+            cursor = db.agreements.find(query, AGREEMENT_PROJECTION) \
+                .sort("created_at", 1) \
+                .limit(EXPORT_MAX_AGREEMENTS) \
+                .batch_size(EXPORT_BATCH_SIZE)
+            async for agreement in cursor:
+                seen.add(agreement['id'])
+                pending.add(asyncio.ensure_future(render_export_entry(serialize_agreement(agreement))))
+                if len(pending) >= concurrency:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    add_finished(done)
+                    yield sink.drain()
+            
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                add_finished(done)
+                yield sink.drain()
+            
+            failed.extend(f"{agreement_id}: hittades inte"
+                          for agreement_id in requested_ids or [] if agreement_id not in seen)
+            if failed:
+                archive.writestr("fel.txt", "\n".join(failed) + "\n")
+        # Closing the archive writes the central directory
+        yield sink.drain()
+    finally:
+        for task in pending:
+            task.cancel()
+
+# Row exports (CSV / NDJSON)
+EXPORT_ROW_BATCH_SIZE = int(os.environ.get('EXPORT_ROW_BATCH_SIZE', '500'))
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+AGREEMENT_EXPORT_BASE_COLUMNS = (
+    "id", "status", "created_at", "updated_at", "tenant_signed_at", "landlord_signed_at", "payment_completed_at",
+)
+# Selectable nested groups; CSV flattens them to group.field, the same
+# column names the bulk import reads
+AGREEMENT_EXPORT_GROUPS = {
+    "landlord": PersonInfo,
+    "tenant": TenantInfo,
+    "property": PropertyInfo,
+    "rental_period": RentalPeriod,
+    "payment": PaymentInfo,
+    "other": OtherInfo,
+}
+EMAIL_LOG_EXPORT_COLUMNS = ("id", "agreement_id", "to", "subject", "status", "attempts", "queued_at", "sent_at", "last_error")
+
+def parse_export_groups(columns: Optional[str]) -> List[str]:
+    if not columns:
+        return list(AGREEMENT_EXPORT_GROUPS)
+    groups = [group.strip() for group in columns.split(",") if group.strip()]
+    unknown = [group for group in groups if group not in AGREEMENT_EXPORT_GROUPS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Okänd kolumngrupp: {', '.join(unknown)}")
+    return groups
+
+def agreement_export_columns(groups: List[str]) -> List[str]:
+    return list(AGREEMENT_EXPORT_BASE_COLUMNS) + [
+        f"{group}.{field}" for group in groups for field in AGREEMENT_EXPORT_GROUPS[group].model_fields
+    ]
+
+def flatten_row(doc: dict, columns: List[str]) -> list:
+    row = []
+    for column in columns:
+        value = doc
+        for part in column.split("."):
+            value = value.get(part) if isinstance(value, dict) else None
+        row.append("" if value is None else value)
+    return row
+
+async def stream_rows(cursor, export_format: str, columns: List[str]):
+    """Serialize a cursor in ~64 KiB chunks; memory stays flat whatever the row count"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if export_format == "csv":
+        writer.writerow(columns)
+    async for doc in cursor:
+        if export_format == "csv":
+            writer.writerow(flatten_row(doc, columns))
+        else:
+            buffer.write(json.dumps(doc, ensure_ascii=False, default=str))
+            buffer.write("\n")
+        if buffer.tell() >= EXPORT_CHUNK_BYTES:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode()
+
+def export_rows_response(cursor, export_format: str, columns: List[str], name: str) -> StreamingResponse:
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")
+    media_type = "text/csv; charset=utf-8" if export_format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        stream_rows(cursor, export_format, columns),
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename={name}-{stamp}.{export_format}"}
+    )
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+# Conditional agreement reads
+# What a waiting signer needs when only the status has moved on
+AGREEMENT_PROGRESS_FIELDS = (
+    "id", "status", "created_at", "updated_at", "tenant_signed_at", "landlord_signed_at", "payment_completed_at",
+)
+AGREEMENT_FIELDS = set(Agreement.model_fields)
+# Stored for delta reads, never sent to clients
+AGREEMENT_INTERNAL_FIELDS = ("content_updated_at",)
+
+def parse_agreement_fields(fields: Optional[str]) -> Optional[List[str]]:
+    if not fields:
+        return None
+    selected = sorted({field.strip() for field in fields.split(",") if field.strip()} | {"id"})
+    unknown = [field for field in selected if field not in AGREEMENT_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Okänt fält: {', '.join(unknown)}")
+    return selected
+
+def content_unchanged_since(agreement: dict, since: datetime) -> bool:
+    """True if only status and signing timestamps can have changed after since.
+
+    Agreements written before content_updated_at existed fall back to
+    updated_at, which can only over-report changes.
+    """
+    changed_at = agreement.get('content_updated_at') or agreement.get('updated_at')
+    return bool(changed_at) and parse_timestamp(changed_at) <= since
+
+def agreement_etag(agreement: dict, variant: str) -> str:
+    """Every agreement write sets updated_at, so it versions each representation"""
+    raw = f"{agreement['id']}|{agreement.get('updated_at')}|{variant}"
+    return f'"{hashlib.sha256(raw.encode()).hexdigest()[:32]}"'
+
+
+# Pagination helpers
+AGREEMENTS_PAGE_SIZE = 50
+AGREEMENTS_MAX_PAGE_SIZE = 200
+
+# Only the fields the admin list needs
+AGREEMENT_SUMMARY_PROJECTION = {
+    "_id": 0,
+    "id": 1,
+    "status": 1,
+    "created_at": 1,
+    "updated_at": 1,
+    "landlord.name": 1,
+    "landlord.email": 1,
+    "tenant.name": 1,
+    "tenant.email": 1,
+    "property.address": 1,
+    "property.city": 1,
+    "payment.rent_amount": 1,
+}
+
+def encode_cursor(agreement: dict) -> str:
+    """Encode the keyset position (created_at, id) of the last row on a page"""
+    raw = json.dumps([agreement['created_at'], agreement['id']]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        created_at, agreement_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return parse_timestamp(created_at), str(agreement_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Ogiltig cursor")
+
+def cursor_filter(position: tuple, order: str) -> dict:
+    """Keyset filter selecting rows strictly after the cursor position"""
+    created_at, agreement_id = position
+    op = "$lt" if order == "desc" else "$gt"
+    return {"$or": [
+        {"created_at": {op: created_at}},
+        {"created_at": created_at, "id": {op: agreement_id}},
+    ]}
+
+
+# =====================
+# SIGNED PDF ARCHIVE
+# =====================
+# Completed agreements are rendered once and kept, immutable, in GridFS;
+# downloads stream the stored file instead of rendering
+SIGNED_PDF_BUCKET = "signed_pdfs"
+SIGNED_PDF_CHUNK_BYTES = int(os.environ.get('SIGNED_PDF_CHUNK_BYTES', str(255 * 1024)))
+SIGNED_PDF_BACKFILL_BATCH_SIZE = 100
+
+signed_pdfs_archived = Counter("signed_pdfs_archived_total", "Signed agreement PDFs stored in GridFS")
+signed_pdf_archives_in_flight = {}
+Gauge("signed_pdf_archives_in_flight", "Signed PDFs currently being rendered for the archive", lambda: len(signed_pdf_archives_in_flight))
+signed_pdf_archive_disabled_logged = False
+
+def signed_pdf_bucket() -> Optional[AsyncIOMotorGridFSBucket]:
+    """None when the database cannot hold GridFS files (test stand-ins);
+    signed PDFs are then rendered on every download"""
+    global signed_pdf_archive_disabled_logged
+    try:
+        return AsyncIOMotorGridFSBucket(db, bucket_name=SIGNED_PDF_BUCKET, chunk_size_bytes=SIGNED_PDF_CHUNK_BYTES)
+    except TypeError:
+        if not signed_pdf_archive_disabled_logged:
+            signed_pdf_archive_disabled_logged = True
+            logger.info("Signed PDF archive disabled: the database does not support GridFS")
+        return None
+
+async def find_signed_pdf(agreement_id: str) -> Optional[dict]:
+    return await db[f"{SIGNED_PDF_BUCKET}.files"].find_one({"metadata.agreement_id": agreement_id})
+
+async def store_signed_pdf(agreement: dict) -> Optional[dict]:
+    """Render a completed agreement into the archive; returns its GridFS file
+    document, or None without an archive"""
+    bucket = signed_pdf_bucket()
+    if bucket is None:
+        return None
+    existing = await find_signed_pdf(agreement['id'])
+    if existing is not None:
+        return existing
+    
+    pdf = await get_or_render_pdf(agreement)
+    file_id = ObjectId()
+    metadata = {
+        "agreement_id": agreement['id'],
+        "sha256": hashlib.sha256(pdf).hexdigest(),
+        "template_version": PDF_TEMPLATE_VERSION,
+    }
+    try:
+        await bucket.upload_from_stream_with_id(
+            file_id, f"hyresavtal-{agreement['id']}.pdf", pdf, metadata=metadata
+        )
+    except FileExists:
+        # Another worker archived it first (unique metadata.agreement_id); its file stays, our chunks go
+        await db[f"{SIGNED_PDF_BUCKET}.chunks"].delete_many({"files_id": file_id})
+        return await find_signed_pdf(agreement['id'])
+    signed_pdfs_archived.inc()
+    logger.info(f"Archived signed PDF of agreement {agreement['id']} ({len(pdf)} bytes)")
+    return await db[f"{SIGNED_PDF_BUCKET}.files"].find_one({"_id": file_id})
+
+def signed_pdf_task(agreement: dict) -> asyncio.Task:
+    """Archiving of this agreement, shared by everyone asking for it at the same time"""
+    agreement_id = agreement['id']
+    task = signed_pdf_archives_in_flight.get(agreement_id)
+    if task is None:
+        task = spawn(store_signed_pdf(agreement))
+        signed_pdf_archives_in_flight[agreement_id] = task
+        task.add_done_callback(lambda _: signed_pdf_archives_in_flight.pop(agreement_id, None))
+    return task
+
+async def archive_signed_pdf(agreement: dict):
+    """Background job at completion; a failure is retried by the next download or backfill"""
+    try:
+        await signed_pdf_task(agreement)
+    except Exception:
+        logger.exception(f"Archiving the signed PDF of agreement {agreement['id']} failed")
+
+async def get_signed_pdf(agreement: dict) -> Optional[dict]:
+    """Archived file of a completed agreement, archiving it now if that never happened"""
+    if signed_pdf_bucket() is None:
+        return None
+    signed = await find_signed_pdf(agreement['id'])
+    if signed is not None:
+        return signed
+    try:
+        # A disconnecting client must not cancel an archive others wait on
+        return await asyncio.shield(signed_pdf_task(agreement))
+    except Exception:
+        logger.exception(f"Archiving the signed PDF of agreement {agreement['id']} failed")
+        return None
+
+async def read_signed_pdf(signed: dict) -> bytes:
+    grid_out = await signed_pdf_bucket().open_download_stream(signed['_id'])
+    return await grid_out.read()
+
+async def stream_signed_pdf(signed: dict, start: int, end: int):
+    """Yield bytes start..end (inclusive) one GridFS chunk at a time"""
+    grid_out = await signed_pdf_bucket().open_download_stream(signed['_id'])
+    grid_out.seek(start)
+    remaining = end - start + 1
+    while remaining > 0:
+        data = await grid_out.read(min(signed['chunkSize'], remaining))
+        if not data:
+            break
+        remaining -= len(data)
+        yield data
+
+BYTE_RANGE_PATTERN = re.compile(r"bytes=([0-9]*)-([0-9]*)")
+
+def parse_byte_range(header: Optional[str], length: int) -> Optional[tuple]:
+    """(first, last) byte of a single "bytes=" range, or None to send the whole file.
+
+    Malformed, reversed and multi-range headers are ignored, as RFC 9110
+    allows; a valid range starting past the end is answered with 416.
+    """
+    match = BYTE_RANGE_PATTERN.fullmatch(header.strip()) if header else None
+    if match is None:
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = int(last) if last else length - 1
+        if last and end < start:
+            return None
+    elif last:
+        # Suffix range: the final n bytes
+        start = max(length - int(last), 0) if int(last) else length
+        end = length - 1
+    else:
+        return None
+    if start >= length:
+        raise HTTPException(
+            status_code=416,
+            detail="Ogiltigt byteintervall",
+            headers={"Content-Range": f"bytes */{length}"},
+        )
+    return start, min(end, length - 1)
+
+def signed_pdf_response(request: Request, signed: dict, agreement_id: str) -> Response:
+    length = signed['length']
+    etag = f'"{signed["metadata"]["sha256"]}"'
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "private, no-cache",
+        "Content-Disposition": f"attachment; filename=hyresavtal-{agreement_id[:8]}.pdf",
+    }
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    
+    byte_range = None
+    # If-Range: only resume a download of this very file
+    if_range = request.headers.get("if-range")
+    if if_range is None or if_range.strip() == etag:
+        byte_range = parse_byte_range(request.headers.get("range"), length)
+    if byte_range is None:
+        start, end, status_code = 0, length - 1, 200
+    else:
+        (start, end), status_code = byte_range, 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{length}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(
+        stream_signed_pdf(signed, start, end),
+        status_code=status_code,
+        media_type="application/pdf",
+        headers=headers,
+    )
+
+async def backfill_signed_pdfs():
+    """Archive agreements completed before the archive existed, or whose archiving failed"""
+    if signed_pdf_bucket() is None:
+        return
+    cursor = db.agreements.find({"status": AgreementStatus.COMPLETED}, AGREEMENT_PROJECTION) \
+        .batch_size(SIGNED_PDF_BACKFILL_BATCH_SIZE)
+    batch = []
+    
+    async def archive_missing():
+        ids = [agreement['id'] for agreement in batch]
+        archived = {
+            signed['metadata']['agreement_id']
+            async for signed in db[f"{SIGNED_PDF_BUCKET}.files"].find(
+                {"metadata.agreement_id": {"$in": ids}}, {"metadata.agreement_id": 1}
+            )
+        }
+        for agreement in batch:
+            if agreement['id'] not in archived:
+                await archive_signed_pdf(serialize_agreement(agreement))
+    
+    async for agreement in cursor:
+        batch.append(agreement)
+        if len(batch) >= SIGNED_PDF_BACKFILL_BATCH_SIZE:
+            await archive_missing()
+            batch = []
+    if batch:
+        await archive_missing()
+
+
+# =====================
+# SIGNING & PAYMENT PROVIDERS
+# =====================
+PROVIDER_TIMEOUT = float(os.environ.get('PROVIDER_TIMEOUT', '10'))
+PROVIDER_CONNECT_TIMEOUT = float(os.environ.get('PROVIDER_CONNECT_TIMEOUT', '3'))
+PROVIDER_MAX_CONNECTIONS = int(os.environ.get('PROVIDER_MAX_CONNECTIONS', '100'))
+PROVIDER_KEEPALIVE_SECONDS = float(os.environ.get('PROVIDER_KEEPALIVE_SECONDS', '30'))
+# Client certificate (PEM with key) and CA bundle for the providers' mutual TLS
+PROVIDER_CLIENT_CERT = os.environ.get('PROVIDER_CLIENT_CERT')
+PROVIDER_CA_BUNDLE = os.environ.get('PROVIDER_CA_BUNDLE')
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get('CIRCUIT_FAILURE_THRESHOLD', '5'))
+CIRCUIT_RESET_SECONDS = float(os.environ.get('CIRCUIT_RESET_SECONDS', '30'))
+
+provider_request_duration = Histogram(
+    "provider_request_duration_seconds", "Signing and payment provider call latency",
+    ("provider", "operation", "outcome"),
+)
+
+# Pending messages for BankID hint codes; unknown ones get the generic text
+# Failed sessions whose provider order completed after the agreement moved on
+SESSION_CONFLICT_HINT = "agreementStatusChanged"
+BANKID_FAILURES = {SESSION_CONFLICT_HINT: "Signeringen kunde inte registreras eftersom avtalet inte väntar på din underskrift"}
+SWISH_FAILURES = {SESSION_CONFLICT_HINT: "Betalningen kunde inte registreras eftersom avtalet inte väntar på betalning"}
+
+BANKID_HINTS = {
+    "outstandingTransaction": "Starta BankID-appen",
+    "noClient": "Starta BankID-appen",
+    "started": "Söker efter BankID, det kan ta en liten stund...",
+    "userSign": "Skriv in din säkerhetskod i BankID-appen och välj Identifiera eller Skriv under",
+}
+
+class ProviderUnavailable(Exception):
+    """The provider could not be reached or its circuit is open"""
+
+class ProviderResult(BaseModel):
+    status: str  # "pending", "complete" or "failed"
+    hint: Optional[str] = None
+
+class CircuitBreaker:
+    """Stops calling a failing provider for a while instead of queueing requests behind timeouts.
+
+    After failure_threshold consecutive failures the circuit opens and calls
+    fail at once. Once reset_seconds have passed a single trial call is let
+    through; its outcome closes the circuit or opens it again.
+    """
+
+    def __init__(self, name: str, failure_threshold: int, reset_seconds: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        Gauge(f"{name}_circuit_open", f"1 while calls to {name} are being refused", lambda: int(self.opened_at is not None))
+
+    def before_call(self) -> bool:
+        """Raises while the circuit is open; True if the caller makes the trial call"""
+        if self.opened_at is None:
+            return False
+        if self._trial or time.monotonic() - self.opened_at < self.reset_seconds:
+            raise ProviderUnavailable(f"{self.name} circuit open")
+        self._trial = True
+        return True
+
+    def end_trial(self):
+        """A cancelled trial call records nothing; let the next call try instead"""
+        self._trial = False
+
+    def record_success(self):
+        if self.opened_at is not None:
+            logger.info(f"{self.name} circuit closed")
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._trial or self.failures >= self.failure_threshold:
+            if self.opened_at is None or self._trial:
+                logger.warning(f"{self.name} circuit opened after {self.failures} failures")
+            self.opened_at = time.monotonic()
+        self._trial = False
+
+# One pooled keep-alive client for all provider calls, created at startup
+provider_http = None
+
+def start_provider_http():
+    global provider_http
+    provider_http = httpx.AsyncClient(
+        timeout=httpx.Timeout(PROVIDER_TIMEOUT, connect=PROVIDER_CONNECT_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=PROVIDER_MAX_CONNECTIONS,
+            max_keepalive_connections=PROVIDER_MAX_CONNECTIONS,
+            keepalive_expiry=PROVIDER_KEEPALIVE_SECONDS,
+        ),
+        cert=PROVIDER_CLIENT_CERT,
+        verify=PROVIDER_CA_BUNDLE or True,
+    )
+
+async def stop_provider_http():
+    if provider_http is not None:
+        await provider_http.aclose()
+
+class HttpProvider:
+    """Base for providers reached over HTTP through the shared client"""
+    name = "provider"
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url.rstrip("/")
+        self.breaker = CircuitBreaker(self.name, CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_SECONDS)
+
+    async def request(self, operation: str, method: str, path: str, **kwargs) -> httpx.Response:
+        """Client errors (4xx) are returned; timeouts, transport errors and 5xx count against the circuit"""
+        trial = self.breaker.before_call()
+        start = time.perf_counter()
+        outcome = "failed"
+        try:
+            response = await provider_http.request(method, f"{self.base_url}{path}", **kwargs)
+            if response.status_code >= 500:
+                raise ProviderUnavailable(f"{self.name} {operation}: HTTP {response.status_code}")
+            outcome = "ok"
+            self.breaker.record_success()
+            return response
+        except httpx.HTTPError as e:
+            self.breaker.record_failure()
+            raise ProviderUnavailable(f"{self.name} {operation}: {e!r}") from e
+        except ProviderUnavailable:
+            self.breaker.record_failure()
+            raise
+        finally:
+            if trial:
+                self.breaker.end_trial()
+            elapsed = time.perf_counter() - start
+            provider_request_duration.observe(elapsed, self.name, operation, outcome)
+            record_timing("provider", elapsed)
+
+    def json_body(self, operation: str, response: httpx.Response, *fields: str) -> dict:
+        """The JSON object of a successful response with the given fields.
+        Any other answer means the provider cannot be used right now."""
+        if response.status_code >= 400:
+            raise ProviderUnavailable(f"{self.name} {operation}: HTTP {response.status_code}")
+        try:
+            body = response.json()
+        except ValueError as e:
+            raise ProviderUnavailable(f"{self.name} {operation}: invalid JSON") from e
+        if not isinstance(body, dict) or any(field not in body for field in fields):
+            raise ProviderUnavailable(f"{self.name} {operation}: unexpected response {body!r:.200}")
+        return body
+
+    def error_code(self, response: httpx.Response) -> Optional[str]:
+        """errorCode of a rejected request, if the body has one"""
+        try:
+            body = response.json()
+        except ValueError:
+            return None
+        return body.get('errorCode') if isinstance(body, dict) else None
+
+class MockBankIDProvider:
+    """Completes an order on the third status check, as if the user signed at once"""
+
+    async def start(self, session: dict) -> str:
+        return f"bankid-{uuid.uuid4().hex[:12]}"
+
+    async def collect(self, order_ref: str, session: dict) -> ProviderResult:
+        if session.get('poll_count', 0) >= 2:
+            return ProviderResult(status="complete")
+        return ProviderResult(status="pending")
+
+class HttpBankIDProvider(HttpProvider):
+    """BankID relying party API (auth + collect), or the local simulator"""
+    name = "bankid"
+
+    async def start(self, session: dict) -> str:
+        response = await self.request("auth", "POST", "/rp/v6.0/auth", json={
+            "endUserIp": session.get('end_user_ip') or "127.0.0.1",
+            "requirement": {"personalNumber": session['personnummer']},
+        })
+        if response.status_code == 400:
+            raise HTTPException(status_code=400, detail=f"BankID avvisade begäran ({self.error_code(response)})")
+        return self.json_body("auth", response, "orderRef")['orderRef']
+
+    async def collect(self, order_ref: str, session: dict) -> ProviderResult:
+        response = await self.request("collect", "POST", "/rp/v6.0/collect", json={"orderRef": order_ref})
+        if response.status_code == 400:
+            # BankID forgets orders a while after they finish
+            return ProviderResult(status="failed", hint=self.error_code(response))
+        body = self.json_body("collect", response, "status")
+        return ProviderResult(status=body['status'], hint=body.get('hintCode'))
+
+class MockSwishProvider:
+    """Marks a payment paid on the third status check"""
+
+    async def start(self, session: dict) -> str:
+        return f"swish-{uuid.uuid4().hex[:12]}"
+
+    async def collect(self, payment_ref: str, session: dict) -> ProviderResult:
+        if session.get('poll_count', 0) >= 2:
+            return ProviderResult(status="complete")
+        return ProviderResult(status="pending")
+
+class HttpSwishProvider(HttpProvider):
+    """Swish commerce API payment requests, or the local simulator"""
+    name = "swish"
+    # Swish payment request status -> session status
+    STATUSES = {"CREATED": "pending", "PAID": "complete"}
+
+    def __init__(self, base_url: str, payee_alias: str):
+        super().__init__(base_url)
+        self.payee_alias = payee_alias
+
+    async def start(self, session: dict) -> str:
+        # The merchant picks the ID, so a retried create is harmless
+        instruction_id = uuid.uuid4().hex.upper()
+        response = await self.request(
+            "create", "PUT", f"/swish-cpcapi/api/v2/paymentrequests/{instruction_id}",
+            json={
+                "payeePaymentReference": session['agreement_id'][:35],
+                "payeeAlias": self.payee_alias,
+                "payerAlias": session['phone_number'],
+                "amount": f"{session['amount']:.2f}",
+                "currency": "SEK",
+                "message": "Securebooking hyresavtal",
+            },
+        )
+        if response.status_code in (400, 422):
+            raise HTTPException(status_code=400, detail="Swish avvisade betalningsförfrågan")
+        if response.status_code >= 400:
+            raise ProviderUnavailable(f"{self.name} create: HTTP {response.status_code}")
+        return instruction_id
+
+    async def collect(self, payment_ref: str, session: dict) -> ProviderResult:
+        response = await self.request("status", "GET", f"/swish-cpcapi/api/v1/paymentrequests/{payment_ref}")
+        if response.status_code == 404:
+            return ProviderResult(status="failed", hint="notFound")
+        status = self.json_body("status", response, "status")['status']
+        return ProviderResult(status=self.STATUSES.get(status, "failed"), hint=status)
+
+def create_bankid_provider():
+    if os.environ.get('BANKID_PROVIDER', 'mock') == 'http':
+        return HttpBankIDProvider(os.environ.get('BANKID_API_URL', 'http://localhost:8010'))
+    return MockBankIDProvider()
+
+def create_swish_provider():
+    if os.environ.get('SWISH_PROVIDER', 'mock') == 'http':
+        return HttpSwishProvider(
+            os.environ.get('SWISH_API_URL', 'http://localhost:8010'),
+            payee_alias=os.environ.get('SWISH_PAYEE_ALIAS', '1234679304'),
+        )
+    return MockSwishProvider()
+
+bankid_provider = create_bankid_provider()
+swish_provider = create_swish_provider()
+
+def provider_unavailable(name: str) -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail=f"{name} svarar inte just nu, försök igen om en stund",
+        headers={"Retry-After": str(int(CIRCUIT_RESET_SECONDS))},
+    )
+
+# Signing sessions
+SESSION_COLLECT_INTERVAL = float(os.environ.get('SESSION_COLLECT_INTERVAL', '2'))
+SESSION_COLLECT_TIMEOUT = float(os.environ.get('SESSION_COLLECT_TIMEOUT', '180'))
+# Sessions are removed by a TTL index on expires_at
+SESSION_TTL_HOURS = float(os.environ.get('SESSION_TTL_HOURS', '24'))
+SESSION_TIMESTAMP_FIELDS = ("created_at", "completed_at", "finished_at", "last_polled_at")
+
+def session_expiry() -> datetime:
+    return datetime.now(timezone.utc) + timedelta(hours=SESSION_TTL_HOURS)
+
+async def record_session_poll(collection, ref_field: str, ref: str, agreement_id: str) -> Optional[dict]:
+    """Count a status check on the session itself in one round trip.
+
+    Returns the session as it was before this check, so poll_count is the
+    number of earlier checks.
+    """
+    return await collection.find_one_and_update(
+        {ref_field: ref, "agreement_id": agreement_id},
+        {
+            "$inc": {"poll_count": 1},
+            "$set": {"last_polled_at": utcnow()},
+        },
+        projection={"_id": 0},
+        return_document=ReturnDocument.BEFORE,
+    )
+
+async def collect_session(poll, agreement_id: str, ref: str):
+    """Drive a pending session to completion server-side, like a provider collect loop"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + SESSION_COLLECT_TIMEOUT
+    while loop.time() < deadline:
+        await asyncio.sleep(SESSION_COLLECT_INTERVAL)
+        try:
+            result = await poll(agreement_id, ref)
+        except HTTPException as e:
+            if e.status_code == 503:
+                continue  # provider unreachable; keep collecting until the deadline
+            return
+        except Exception:
+            logger.exception(f"Collecting session {ref} failed")
+            continue
+        if result['status'] != "pending":
+            return
+
+async def finish_session(collection, kind: str, ref_field: str, ref: str, agreement_id: str, status: str, fields: dict):
+    """Move a pending session to complete or failed; only the first caller publishes the event"""
+    result = await collection.update_one(
+        {ref_field: ref, "status": "pending"},
+        {"$set": {"status": status, **fields}},
+    )
+    if result.modified_count:
+        event_bus.publish(agreement_id, session_event(kind, {ref_field: ref, "status": status}))
+
+async def poll_bankid_session(agreement_id: str, order_ref: str) -> dict:
+    session = await record_session_poll(db.bankid_sessions, "order_ref", order_ref, agreement_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="BankID-session hittades inte")
+    
+    if session['status'] == "complete":
+        return {
+            "status": "complete",
+            "message": "Signering genomförd!",
+            "signed_at": iso_timestamp(session.get('completed_at'))
+        }
+    if session['status'] == "failed":
+        return {"status": "failed", "message": BANKID_FAILURES.get(session.get('hint'), "Signeringen avbröts")}
+    
+    try:
+        result = await bankid_provider.collect(order_ref, session)
+    except ProviderUnavailable as e:
+        logger.warning(f"BankID collect for {order_ref} failed: {e}")
+        raise provider_unavailable("BankID")
+    
+    if result.status == "complete":
+        now = utcnow()
+        signer = 'tenant' if session['signer_type'] == 'tenant' else 'landlord'
+        from_status, to_status, signed_field = SIGNING_TRANSITIONS[signer]
+        
+        # Only the request that wins the transition sends notifications
+        agreement = await transition_agreement(agreement_id, from_status, to_status, {signed_field: now})
+        if not agreement and not await agreement_reached(agreement_id, to_status):
+            # Signed in BankID, but the agreement no longer waits for this signature
+            logger.warning(f"BankID order {order_ref} completed for agreement {agreement_id} not in {from_status.value}")
+            await finish_session(db.bankid_sessions, "bankid", "order_ref", order_ref, agreement_id, "failed", {"hint": SESSION_CONFLICT_HINT})
+            return {"status": "failed", "message": BANKID_FAILURES[SESSION_CONFLICT_HINT]}
+        await finish_session(db.bankid_sessions, "bankid", "order_ref", order_ref, agreement_id, "complete", {"completed_at": now})
+        
+        if agreement and signer == 'tenant':
+            # Send email to landlord that tenant has signed
+            notify_landlord_tenant_signed(
+                landlord_email=agreement['landlord'].get('email', ''),
+                landlord_name=agreement['landlord'].get('name', ''),
+                tenant_name=agreement['tenant'].get('name', ''),
+                property_address=agreement['property'].get('address', ''),
+                agreement_id=agreement_id
+            )
+        
+        return {
+            "status": "complete",
+            "message": "Signering genomförd!",
+            "signed_at": iso_timestamp(now)
+        }
+    
+    if result.status == "failed":
+        await finish_session(db.bankid_sessions, "bankid", "order_ref", order_ref, agreement_id, "failed", {"hint": result.hint})
+        return {"status": "failed", "message": "Signeringen avbröts"}
     
     return {
-        "payment_ref": payment_ref,
         "status": "pending",
-        "message": f"Öppna Swish-appen och godkänn betalningen på {data.amount} SEK"
+        "message": BANKID_HINTS.get(result.hint, "Väntar på signering i BankID-appen...")
     }
 
-# Mock Swish - Check Status
-@api_router.get("/agreements/{agreement_id}/swish/status/{payment_ref}")
-async def check_swish_status(agreement_id: str, payment_ref: str):
-    session = await db.swish_sessions.find_one({"payment_ref": payment_ref})
+async def poll_swish_session(agreement_id: str, payment_ref: str) -> dict:
+    session = await record_session_poll(db.swish_sessions, "payment_ref", payment_ref, agreement_id)
     if not session:
         raise HTTPException(status_code=404, detail="Swish-betalning hittades inte")
     
-    # Simulate Swish completion after a few checks
-    check_count = await db.swish_checks.count_documents({"payment_ref": payment_ref})
-    await db.swish_checks.insert_one({"payment_ref": payment_ref, "checked_at": datetime.now(timezone.utc).isoformat()})
+    if session['status'] == "complete":
+        return {
+            "status": "complete",
+            "message": "Betalning genomförd!",
+            "paid_at": iso_timestamp(session.get('completed_at'))
+        }
+    if session['status'] == "failed":
+        return {"status": "failed", "message": SWISH_FAILURES.get(session.get('hint'), "Betalningen genomfördes inte")}
+    
+    try:
+        result = await swish_provider.collect(payment_ref, session)
+    except ProviderUnavailable as e:
+        logger.warning(f"Swish status for {payment_ref} failed: {e}")
+        raise provider_unavailable("Swish")
     
-    if check_count >= 2:  # Complete after 2 checks
-        now = datetime.now(timezone.utc).isoformat()
-        
-        # Get agreement for email notification
-        agreement = await db.agreements.find_one({"id": agreement_id}, {"_id": 0})
+    if result.status == "complete":
+        now = utcnow()
         
-        await db.agreements.update_one(
-            {"id": agreement_id},
-            {"$set": {
-                "payment_completed_at": now,
-                "status": AgreementStatus.COMPLETED,
-                "updated_at": now
-            }}
+        agreement = await transition_agreement(
+            agreement_id, AgreementStatus.PENDING_PAYMENT, AgreementStatus.COMPLETED,
+            {"payment_completed_at": now}
         )
-        
-        await db.swish_sessions.update_one({"payment_ref": payment_ref}, {"$set": {"status": "complete"}})
+        if not agreement and not await agreement_reached(agreement_id, AgreementStatus.COMPLETED):
+            logger.warning(f"Swish payment {payment_ref} completed for agreement {agreement_id} not awaiting payment")
+            await finish_session(db.swish_sessions, "swish", "payment_ref", payment_ref, agreement_id, "failed", {"hint": SESSION_CONFLICT_HINT})
+            return {"status": "failed", "message": SWISH_FAILURES[SESSION_CONFLICT_HINT]}
+        await finish_session(db.swish_sessions, "swish", "payment_ref", payment_ref, agreement_id, "complete", {"completed_at": now})
         
         # Send completion emails to both parties
         if agreement:
-            await notify_both_agreement_completed(
+            spawn(archive_signed_pdf(agreement))
+            notify_both_agreement_completed(
                 landlord_email=agreement['landlord'].get('email', ''),
                 tenant_email=agreement['tenant'].get('email', ''),
                 landlord_name=agreement['landlord'].get('name', ''),
@@ -579,48 +3022,1235 @@ async def check_swish_status(agreement_id: str, payment_ref: str):
         return {
             "status": "complete",
             "message": "Betalning genomförd!",
-            "paid_at": now
+            "paid_at": iso_timestamp(now)
         }
     
+    if result.status == "failed":
+        await finish_session(db.swish_sessions, "swish", "payment_ref", payment_ref, agreement_id, "failed", {"hint": result.hint})
+        return {"status": "failed", "message": "Betalningen genomfördes inte"}
+    
     return {
         "status": "pending",
         "message": "Väntar på betalning i Swish-appen..."
     }
 
+# =====================
+# BULK IMPORT
+# =====================
+BULK_IMPORT_BATCH_SIZE = int(os.environ.get('BULK_IMPORT_BATCH_SIZE', '500'))
+BULK_IMPORT_MAX_ROWS = int(os.environ.get('BULK_IMPORT_MAX_ROWS', '50000'))
+# Results are sent once the whole upload is read: many clients send the body
+# before reading anything, and results streamed back while the upload is
+# still arriving would stall them. Meanwhile they are spooled, in memory up
+# to this size (about 100 bytes per row) and in a temporary file beyond it.
+BULK_IMPORT_RESULTS_MEMORY_BYTES = int(os.environ.get('BULK_IMPORT_RESULTS_MEMORY_BYTES', str(1024 * 1024)))
+BULK_IMPORT_MAX_LINE_BYTES = 64 * 1024
+NDJSON_CONTENT_TYPES = {"application/x-ndjson", "application/ndjson", "application/jsonl"}
+
+class BulkImportAborted(Exception):
+    pass
+
+def new_agreement_document(data: AgreementCreate) -> dict:
+    agreement = Agreement(
+        landlord=data.landlord.model_dump(),
+        tenant=data.tenant.model_dump(),  # Convert to dict
+        property=data.property,
+        rental_period=data.rental_period,
+        payment=data.payment,
+        other=data.other,
+        status=AgreementStatus.PENDING_TENANT_SIGNATURE
+    )
+    doc = agreement.model_dump()
+    doc["content_updated_at"] = doc["created_at"]
+    doc.update(agreement_search_fields(doc))
+    return doc
+
+async def read_body_lines(request: Request):
+    """Request body split into lines as it arrives, never holding the whole upload"""
+    pending = b""
+    async for chunk in request.stream():
+        pending += chunk
+        if b"\n" in chunk:
+            *lines, pending = pending.split(b"\n")
+            for line in lines:
+                yield line
+        if len(pending) > BULK_IMPORT_MAX_LINE_BYTES:
+            raise BulkImportAborted(f"Raden är längre än {BULK_IMPORT_MAX_LINE_BYTES} byte")
+    if pending:
+        yield pending
+
+# Row sources yield (row number, data, error); rows are numbered from 1,
+# counting data records only (not blank lines or the CSV header)
+async def ndjson_rows(lines):
+    row = 0
+    async for line in lines:
+        if not line.strip():
+            continue
+        row += 1
+        try:
+            yield row, json.loads(line), None
+        except ValueError as e:
+            yield row, None, [{"field": None, "message": f"Ogiltig JSON: {e}"}]
+
+def unflatten_columns(record: dict) -> dict:
+    """{"landlord.name": "Erik"} -> {"landlord": {"name": "Erik"}}; empty cells are left out"""
+    data = {}
+    for column, value in record.items():
+        if value == "":
+            continue
+        *parents, field = column.strip().split(".")
+        target = data
+        for parent in parents:
+            target = target.setdefault(parent, {})
+        target[field] = value
+    return data
+
+async def csv_rows(lines):
+    """CSV with dotted column names (landlord.name, payment.rent_amount, ...).
+
+    Comma or semicolon separated, as detected from the header. Quoted
+    fields may span lines.
+    """
+    header = None
+    delimiter = ","
+    record = ""
+    row = 0
+    async for line in lines:
+        try:
+            text = line.decode("utf-8-sig").rstrip("\r")
+        except UnicodeDecodeError:
+            raise BulkImportAborted("CSV-filen måste vara UTF-8")
+        record = f"{record}\n{text}" if record else text
+        # An odd number of quotes means a quoted field continues on the next line
+        if record.count('"') % 2:
+            continue
+        if header is None:
+            delimiter = ";" if record.count(";") > record.count(",") else ","
+            header = next(csv.reader([record], delimiter=delimiter))
+            record = ""
+            continue
+        if not record.strip():
+            record = ""
+            continue
+        values = next(csv.reader([record], delimiter=delimiter))
+        record = ""
+        row += 1
+        if len(values) != len(header):
+            yield row, None, [{"field": None, "message": f"Raden har {len(values)} kolumner, rubrikraden {len(header)}"}]
+            continue
+        yield row, unflatten_columns(dict(zip(header, values))), None
+    if record:
+        raise BulkImportAborted("Ett citerat fält avslutas aldrig")
+
+def validate_import_row(data) -> tuple:
+    """(agreement document, None) or (None, errors)"""
+    try:
+        agreement = AgreementCreate.model_validate(data)
+    except ValidationError as e:
+        return None, [
+            {"field": ".".join(str(part) for part in error['loc']) or None, "message": error['msg']}
+            for error in e.errors()
+        ]
+    return new_agreement_document(agreement), None
+
+async def insert_agreement_batch(batch: list, notify: bool) -> list:
+    """insert_many one batch of (row, document) pairs; returns a result per row"""
+    docs = [doc for _, doc in batch]
+    failed = {}
+    try:
+        await db.agreements.insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        failed = {error['index']: error.get('errmsg') for error in e.details.get('writeErrors', [])}
+    except PyMongoError:
+        logger.exception(f"Importing a batch of {len(docs)} agreements failed")
+        failed = {index: None for index in range(len(docs))}
+    
+    inserted = [doc for index, doc in enumerate(docs) if index not in failed]
+    if inserted:
+        await record_created_stats(inserted)
+    
+    results = []
+    for index, (row, doc) in enumerate(batch):
+        if index in failed:
+            results.append({"row": row, "status": "error", "errors": [{"field": None, "message": "Avtalet kunde inte sparas"}]})
+            continue
+        results.append({"row": row, "status": "created", "id": doc['id']})
+        if notify:
+            notify_tenant_new_agreement(
+                tenant_email=doc['tenant']['email'],
+                landlord_name=doc['landlord']['name'],
+                property_address=doc['property']['address'],
+                agreement_id=doc['id']
+            )
+    return results
+
+async def import_agreement_rows(rows, notify: bool):
+    """Validate rows as they arrive and insert them in batches.
+
+    Returns a spooled file of NDJSON result lines in row order, one per
+    row, ending with a summary line; the caller closes it.
+    """
+    results = tempfile.SpooledTemporaryFile(max_size=BULK_IMPORT_RESULTS_MEMORY_BYTES)
+    window = []  # results for rows since the last flush
+    batch = []
+    summary = {"created": 0, "failed": 0}
+    
+    async def flush():
+        if batch:
+            window.extend(await insert_agreement_batch(batch, notify))
+            batch.clear()
+        lines = []
+        for result in sorted(window, key=lambda result: result['row']):
+            summary["created" if result['status'] == "created" else "failed"] += 1
+            lines.append(json.dumps(result, ensure_ascii=False).encode() + b"\n")
+        results.write(b"".join(lines))
+        window.clear()
+    
+    try:
+        try:
+            async for row, data, errors in rows:
+                if row > BULK_IMPORT_MAX_ROWS:
+                    raise BulkImportAborted(f"Högst {BULK_IMPORT_MAX_ROWS} rader per import, dela upp filen")
+                doc = None
+                if errors is None:
+                    doc, errors = validate_import_row(data)
+                if errors:
+                    window.append({"row": row, "status": "error", "errors": errors})
+                else:
+                    batch.append((row, doc))
+                if len(batch) >= BULK_IMPORT_BATCH_SIZE:
+                    await flush()
+        except BulkImportAborted as e:
+            summary["aborted"] = str(e)
+        await flush()
+        results.write(json.dumps({"summary": summary}, ensure_ascii=False).encode() + b"\n")
+        results.seek(0)
+    except BaseException:
+        results.close()
+        raise
+    return results
+
+def spooled_lines(results):
+    """Lines of a spooled result file, closing it once sent (or abandoned)"""
+    with results:
+        yield from results
+
+# =====================
+# TIMESTAMP MIGRATION
+# =====================
+# Fields earlier versions wrote as ISO strings, per collection
+TIMESTAMP_MIGRATIONS = {
+    "agreements": AGREEMENT_TIMESTAMP_FIELDS,
+    "bankid_sessions": SESSION_TIMESTAMP_FIELDS,
+    "swish_sessions": SESSION_TIMESTAMP_FIELDS,
+    "email_logs": EMAIL_LOG_TIMESTAMP_FIELDS,
+}
+TIMESTAMP_MIGRATION_BATCH_SIZE = int(os.environ.get('TIMESTAMP_MIGRATION_BATCH_SIZE', '500'))
+# Pause between batches, to leave the database room for live traffic
+TIMESTAMP_MIGRATION_PAUSE = float(os.environ.get('TIMESTAMP_MIGRATION_PAUSE', '0'))
+
+timestamps_migrated = Counter("timestamp_migration_documents_total", "Documents whose ISO string timestamps were rewritten as dates", ("collection",))
+
+def timestamp_migration_update(doc: dict, fields) -> Optional[UpdateOne]:
+    """Rewrite of the fields still holding strings, or None if there are none.
+
+    The filter repeats the strings read, so a document written in between
+    is left for the catch-up pass instead of being set back.
+    """
+    dates = {}
+    for field in fields:
+        value = doc.get(field)
+        if not isinstance(value, str):
+            continue
+        try:
+            dates[field] = parse_timestamp(value)
+        except ValueError:
+            logger.warning(f"Document {doc['_id']} has an unreadable {field}: {value!r}")
+    if not dates:
+        return None
+    return UpdateOne({"_id": doc['_id'], **{field: doc[field] for field in dates}}, {"$set": dates})
+
+async def migrate_timestamp_batch(name: str, docs: List[dict], fields) -> int:
+    updates = [update for update in (timestamp_migration_update(doc, fields) for doc in docs) if update]
+    if not updates:
+        return 0
+    result = await db[name].bulk_write(updates, ordered=False)
+    timestamps_migrated.inc(name, amount=result.modified_count)
+    return result.modified_count
+
+async def migrate_collection_timestamps(name: str, fields, batch_size: int, pause: float = 0) -> int:
+    """Rewrite one collection in _id order, checkpointing after each batch.
+
+    The checkpoint in db.migrations lets an interrupted run resume where it
+    stopped. Documents an older version still wrote during the pass are
+    picked up by one query for leftover strings before the collection is
+    marked done.
+    """
+    checkpoint_id = f"timestamps:{name}"
+    checkpoint = await db.migrations.find_one({"_id": checkpoint_id}) or {}
+    if checkpoint.get('done'):
+        return 0
+    
+    last_id = checkpoint.get('last_id')
+    projection = {field: 1 for field in fields}
+    converted = 0
+    while True:
+        query = {"_id": {"$gt": last_id}} if last_id is not None else {}
+        docs = await db[name].find(query, projection).sort("_id", 1).limit(batch_size).to_list(batch_size)
+        if not docs:
+            break
+        count = await migrate_timestamp_batch(name, docs, fields)
+        converted += count
+        last_id = docs[-1]['_id']
+        await db.migrations.update_one(
+            {"_id": checkpoint_id},
+            {"$set": {"last_id": last_id, "updated_at": utcnow()}, "$inc": {"converted": count}},
+            upsert=True,
+        )
+        if len(docs) < batch_size:
+            break
+        if pause:
+            await asyncio.sleep(pause)
+    
+    leftovers = {"$or": [{field: {"$type": "string"}} for field in fields]}
+    caught_up = 0
+    while True:
+        docs = await db[name].find(leftovers, projection).limit(batch_size).to_list(batch_size)
+        count = await migrate_timestamp_batch(name, docs, fields) if docs else 0
+        caught_up += count
+        if not count:
+            break  # none left, or only unreadable values
+    
+    await db.migrations.update_one(
+        {"_id": checkpoint_id},
+        {"$set": {"done": True, "updated_at": utcnow()}, "$inc": {"converted": caught_up}},
+        upsert=True,
+    )
+    return converted + caught_up
+
+async def migrate_timestamps(batch_size: int = TIMESTAMP_MIGRATION_BATCH_SIZE, pause: float = TIMESTAMP_MIGRATION_PAUSE,
+                             collections: Optional[List[str]] = None, restart: bool = False) -> dict:
+    """Rewrite ISO string timestamps as BSON dates in place; returns converted documents per collection.
+
+    Safe to run while the API serves traffic, and to run again: finished
+    collections are skipped unless restart is set.
+    """
+    names = collections or list(TIMESTAMP_MIGRATIONS)
+    if restart:
+        await db.migrations.delete_many({"_id": {"$in": [f"timestamps:{name}" for name in names]}})
+    report = {}
+    for name in names:
+        report[name] = await migrate_collection_timestamps(name, TIMESTAMP_MIGRATIONS[name], batch_size, pause)
+        if report[name]:
+            logger.info(f"Rewrote timestamps of {report[name]} {name} documents as dates")
+    return report
+
+# =====================
+# IDEMPOTENCY
+# =====================
+# Responses are kept this long for retries to replay
+IDEMPOTENCY_KEY_TTL_HOURS = float(os.environ.get('IDEMPOTENCY_KEY_TTL_HOURS', '24'))
+# A key whose first request neither finished nor failed within this time
+# (the worker died) may be taken over by a retry
+IDEMPOTENCY_LOCK_SECONDS = float(os.environ.get('IDEMPOTENCY_LOCK_SECONDS', '30'))
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+def request_fingerprint(request: Request, payload: BaseModel) -> str:
+    body = json.dumps(payload.model_dump(mode="json"), sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(f"{request.method} {request.url.path}\n{body}".encode()).hexdigest()
+
+async def claim_idempotency_key(key: str, path: str, fingerprint: str) -> Optional[dict]:
+    """Claim the key for this request, or return the record of the request
+    that already holds it"""
+    now = datetime.now(timezone.utc)
+    record = {
+        "key": key,
+        "path": path,
+        "fingerprint": fingerprint,
+        "status": "in_progress",
+        "locked_until": now + timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS),
+        "created_at": now,
+        "expires_at": now + timedelta(hours=IDEMPOTENCY_KEY_TTL_HOURS),
+    }
+    while True:
+        try:
+            await db.idempotency_keys.insert_one(dict(record))
+            return None
+        except DuplicateKeyError:
+            pass
+        # Take over a first attempt that has been abandoned
+        taken = await db.idempotency_keys.find_one_and_update(
+            {"key": key, "path": path, "fingerprint": fingerprint, "status": "in_progress", "locked_until": {"$lte": now}},
+            {"$set": {"locked_until": record['locked_until']}},
+        )
+        if taken is not None:
+            return None
+        existing = await db.idempotency_keys.find_one({"key": key, "path": path}, {"_id": 0})
+        if existing is not None:
+            return existing
+        # The holder failed and released the key since our insert; claim it again
+
+async def idempotent(request: Request, response: Response, payload: BaseModel, handler) -> dict:
+    """Run handler() once per Idempotency-Key header value and path.
+
+    A retry with the same key and body gets the stored response, marked with
+    an Idempotent-Replayed header, without the handler running again. A
+    failed request releases its key so it can be retried. Requests without
+    the header run as usual.
+    """
+    key = request.headers.get("Idempotency-Key")
+    if key is None:
+        return await handler()
+    if not key or len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+        raise HTTPException(status_code=400, detail="Ogiltig Idempotency-Key")
+    
+    path = request.url.path
+    fingerprint = request_fingerprint(request, payload)
+    existing = await claim_idempotency_key(key, path, fingerprint)
+    if existing is not None:
+        if existing['fingerprint'] != fingerprint:
+            raise HTTPException(status_code=422, detail="Idempotency-Key har redan använts för en annan begäran")
+        if existing['status'] == "in_progress":
+            raise HTTPException(
+                status_code=409,
+                detail="En begäran med samma Idempotency-Key pågår redan",
+                headers={"Retry-After": "1"},
+            )
+        response.headers["Idempotent-Replayed"] = "true"
+        return existing['response']
+    
+    try:
+        result = await handler()
+    except BaseException:
+        try:
+            await db.idempotency_keys.delete_one({"key": key, "path": path, "status": "in_progress"})
+        except PyMongoError as e:
+            logger.warning(f"Releasing Idempotency-Key {key!r} failed, it unlocks on its own: {e}")
+        raise
+    await db.idempotency_keys.update_one(
+        {"key": key, "path": path},
+        {"$set": {"status": "done", "response": result}, "$unset": {"locked_until": ""}},
+    )
+    return result
+
+# =====================
+# ADMISSION CONTROL
+# =====================
+# (method, route) -> (requests per second, burst). Buckets are kept per
+# client IP, agreement and route, so one runaway tab only limits itself.
+RATE_LIMITS = {
+    ("GET", "/api/agreements/{agreement_id}/bankid/status/{order_ref}"): (1, 10),
+    ("GET", "/api/agreements/{agreement_id}/swish/status/{payment_ref}"): (1, 10),
+    ("POST", "/api/agreements/{agreement_id}/bankid/start"): (0.1, 5),
+    ("POST", "/api/agreements/{agreement_id}/swish/start"): (0.1, 5),
+    ("PUT", "/api/agreements/{agreement_id}/tenant"): (0.2, 10),
+    ("GET", "/api/agreements/{agreement_id}/pdf"): (0.5, 10),
+    ("POST", "/api/agreements"): (0.2, 10),
+    ("POST", "/api/agreements/bulk"): (0.02, 3),
+    ("POST", "/api/agreements/export"): (0.02, 3),
+}
+# Scales every budget; 0 turns rate limiting off
+RATE_LIMIT_FACTOR = float(os.environ.get('RATE_LIMIT_FACTOR', '1'))
+# Header the reverse proxies append client addresses to, and how many proxies
+# append to it: the entry that many from the end is the client. By default no
+# proxy is trusted and the connecting address is used, since a client that
+# connects directly can put anything in the header.
+RATE_LIMIT_CLIENT_HEADER = os.environ.get('RATE_LIMIT_CLIENT_HEADER', 'x-forwarded-for').lower().encode("latin-1")
+RATE_LIMIT_TRUSTED_PROXIES = int(os.environ.get('RATE_LIMIT_TRUSTED_PROXIES', '0'))
+RATE_LIMIT_MAX_BUCKETS = int(os.environ.get('RATE_LIMIT_MAX_BUCKETS', '100000'))
+
+# Routes that render PDFs or stream bulk data share one in-flight limit per
+# worker; everything else shares another. Excess requests are shed, not queued.
+EXPENSIVE_ROUTES = {
+    "/api/agreements/{agreement_id}/pdf",
+    "/api/agreements/export",
+    "/api/agreements/bulk",
+    "/api/exports/agreements",
+    "/api/exports/email-logs",
+}
+# Probes must answer under load; event streams are long-lived by design, and
+# a refused EventSource gives up for good
+ADMISSION_EXEMPT_ROUTES = {"/api/health", "/api/ready", "/api/metrics", "/api/agreements/{agreement_id}/events"}
+ADMISSION_MAX_EXPENSIVE = int(os.environ.get('ADMISSION_MAX_EXPENSIVE', str(PDF_RENDER_WORKERS * 4)))
+ADMISSION_MAX_IN_FLIGHT = int(os.environ.get('ADMISSION_MAX_IN_FLIGHT', '1000'))
+ADMISSION_RETRY_AFTER = int(os.environ.get('ADMISSION_RETRY_AFTER', '2'))
+
+admission_rejections = Counter("admission_rejections_total", "Requests refused by rate limits or load shedding", ("reason", "route"))
+
+RATE_LIMIT_SCRIPT = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local rate, burst = tonumber(ARGV[1]), tonumber(ARGV[2])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'at')
+local tokens = tonumber(bucket[1]) or burst
+local at = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - at) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'at', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000))
+return tostring(wait)
+"""
+
+class MemoryRateLimitStore:
+    """Token buckets in this process; with several workers each keeps its own"""
+
+    def __init__(self, max_buckets: int):
+        self.max_buckets = max_buckets
+        self._buckets = OrderedDict()
+
+    async def take(self, key: str, rate: float, burst: float) -> float:
+        """Take a token; returns 0, or the seconds until one is available"""
+        now = time.monotonic()
+        tokens, at = self._buckets.pop(key, (burst, now))
+        tokens = min(burst, tokens + (now - at) * rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / rate
+        # A bucket evicted here starts out full again, which only errs towards allowing
+        self._buckets[key] = (tokens, now)
+        while len(self._buckets) > self.max_buckets:
+            self._buckets.popitem(last=False)
+        return wait
+
+    async def close(self):
+        self._buckets.clear()
+
+class RedisRateLimitStore:
+    """Token buckets shared by all workers, updated atomically by a Lua script.
+
+    Errors are logged and the request is let through; the limiter must not
+    take the API down with it.
+    """
+
+    def __init__(self, url: str):
+        import redis.asyncio as redis
+
+        self._errors = redis.RedisError
+        self._redis = redis.from_url(url)
+        self._take = self._redis.register_script(RATE_LIMIT_SCRIPT)
+
+    async def take(self, key: str, rate: float, burst: float) -> float:
+        try:
+            return float(await self._take(keys=[f"ratelimit:{key}"], args=[rate, burst]))
+        except self._errors as e:
+            logger.warning(f"Rate limit check failed: {e}")
+            return 0.0
+
+    async def close(self):
+        await self._redis.aclose()
+
+def create_rate_limit_store():
+    url = os.environ.get('RATE_LIMIT_URL')
+    if url and url != "memory://":
+        return RedisRateLimitStore(url)
+    if WEB_CONCURRENCY > 1 and RATE_LIMIT_FACTOR > 0:
+        logger.info("Rate limits are kept per worker; set RATE_LIMIT_URL to share them")
+    return MemoryRateLimitStore(RATE_LIMIT_MAX_BUCKETS)
+
+rate_limit_store = create_rate_limit_store()
+
+class InFlightLimit:
+    """Counts requests in progress in this worker; 0 means no limit"""
+
+    def __init__(self, name: str, limit: int, description: str):
+        self.limit = limit
+        self.in_flight = 0
+        Gauge(f"admission_{name}_in_flight", description, lambda: self.in_flight)
+
+    def try_acquire(self) -> bool:
+        if self.limit and self.in_flight >= self.limit:
+            return False
+        self.in_flight += 1
+        return True
+
+    def release(self):
+        self.in_flight -= 1
+
+expensive_requests = InFlightLimit("expensive", ADMISSION_MAX_EXPENSIVE, "PDF and bulk requests in progress")
+other_requests = InFlightLimit("requests", ADMISSION_MAX_IN_FLIGHT, "Other requests in progress")
+
+# Only routes with an admission rule are told apart; everything else counts
+# as "other". Static paths first, so /api/agreements/export is not an id.
+ADMISSION_ROUTES = [
+    (compile_path(template)[0], template)
+    for template in sorted(
+        {template for _, template in RATE_LIMITS} | EXPENSIVE_ROUTES | ADMISSION_EXEMPT_ROUTES,
+        key=lambda template: ("{" in template, template),
+    )
+]
+
+def match_route(scope) -> tuple:
+    """(route template, path parameters) of a route with admission rules, or (None, {})"""
+    path = get_route_path(scope)
+    for pattern, template in ADMISSION_ROUTES:
+        match = pattern.match(path)
+        if match:
+            return template, match.groupdict()
+    return None, {}
+
+def client_address(scope) -> str:
+    if RATE_LIMIT_TRUSTED_PROXIES > 0:
+        forwarded = [
+            address.strip()
+            for name, value in scope.get("headers", [])
+            if name == RATE_LIMIT_CLIENT_HEADER
+            for address in value.decode("latin-1").split(",")
+        ]
+        if forwarded:
+            # Entries before the trusted proxies' are whatever the client sent
+            return forwarded[max(len(forwarded) - RATE_LIMIT_TRUSTED_PROXIES, 0)]
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+class AdmissionControlMiddleware:
+    """Per-client token-bucket rate limits (429) and per-worker in-flight
+    limits with load shedding (503), both answered with Retry-After.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        template, path_params = match_route(scope)
+        if await self.check_rate_limit(scope, receive, send, template, path_params):
+            return
+        if template in ADMISSION_EXEMPT_ROUTES:
+            await self.app(scope, receive, send)
+            return
+        
+        limit = expensive_requests if template in EXPENSIVE_ROUTES else other_requests
+        if not limit.try_acquire():
+            admission_rejections.inc("overloaded", template or "other")
+            await self.refuse(scope, receive, send, 503, "Tjänsten är hårt belastad, försök igen om en stund", ADMISSION_RETRY_AFTER)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limit.release()
+
+    async def check_rate_limit(self, scope, receive, send, template: Optional[str], path_params: dict) -> bool:
+        """Refuse the request if its bucket is empty; True if it was refused"""
+        budget = RATE_LIMITS.get((scope["method"], template))
+        if budget is None or RATE_LIMIT_FACTOR <= 0:
+            return False
+        rate, burst = budget
+        key = f"{scope['method']} {template}|{client_address(scope)}|{path_params.get('agreement_id', '')}"
+        wait = await rate_limit_store.take(key, rate * RATE_LIMIT_FACTOR, max(burst * RATE_LIMIT_FACTOR, 1))
+        if wait <= 0:
+            return False
+        admission_rejections.inc("rate_limited", template)
+        await self.refuse(scope, receive, send, 429, "För många förfrågningar, försök igen om en stund", math.ceil(wait))
+        return True
+
+    async def refuse(self, scope, receive, send, status_code: int, detail: str, retry_after: int):
+        response = JSONResponse({"detail": detail}, status_code=status_code, headers={"Retry-After": str(max(retry_after, 1))})
+        await response(scope, receive, send)
+
+# API Routes
+
+@api_router.get("/")
+async def root():
+    return {"message": "Securebooking API", "version": "1.0.0"}
+
+# Create Agreement
+@api_router.post("/agreements", response_model=dict)
+async def create_agreement(data: AgreementCreate, request: Request, response: Response):
+    async def create():
+        doc = new_agreement_document(data)
+        await db.agreements.insert_one(doc)
+        await record_created_stats([doc])
+        
+        # Send email notification to tenant
+        notify_tenant_new_agreement(
+            tenant_email=data.tenant.email,
+            landlord_name=data.landlord.name,
+            property_address=data.property.address,
+            agreement_id=doc['id']
+        )
+        
+        return {"id": doc['id'], "status": doc['status'], "message": "Avtal skapat framgångsrikt"}
+    
+    return await idempotent(request, response, data, create)
+
+# Bulk Import Agreements
+@api_router.post("/agreements/bulk")
+async def import_agreements(request: Request, notify: bool = True):
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type in NDJSON_CONTENT_TYPES:
+        rows = ndjson_rows(read_body_lines(request))
+    elif content_type == "text/csv":
+        rows = csv_rows(read_body_lines(request))
+    else:
+        raise HTTPException(status_code=415, detail="Skicka raderna som application/x-ndjson eller text/csv")
+    
+    results = await import_agreement_rows(rows, notify)
+    # A plain iterator, so Starlette reads the file in its thread pool
+    return StreamingResponse(spooled_lines(results), media_type="application/x-ndjson")
+
+# Search Agreements (registered before /agreements/{agreement_id})
+@api_router.get("/agreements/search")
+async def search_agreements(
+    q: str = Query(..., min_length=1, max_length=200),
+    status: Optional[AgreementStatus] = None,
+    page: int = Query(1, ge=1),
+    limit: int = Query(AGREEMENTS_PAGE_SIZE, ge=1, le=AGREEMENTS_MAX_PAGE_SIZE),
+):
+    tokens = list(dict.fromkeys(search_tokens(q)))
+    if not tokens:
+        return {"items": [], "page": page, "has_more": False, "truncated": False}
+    
+    match = {"search_terms": {"$all": tokens}}
+    if status:
+        match["status"] = status
+    
+    # Rank the newest candidates: whole-word hits first, then recency
+    pipeline = [
+        {"$match": match},
+        {"$sort": {"created_at": -1, "id": -1}},
+        {"$limit": SEARCH_MAX_CANDIDATES},
+        {"$addFields": {"score": {"$size": {"$filter": {
+            "input": tokens, "as": "token", "cond": {"$in": ["$$token", "$search_words"]},
+        }}}}},
+        {"$sort": {"score": -1, "created_at": -1, "id": -1}},
+        {"$skip": (page - 1) * limit},
+        {"$limit": limit + 1},
+        {"$project": AGREEMENT_SUMMARY_PROJECTION},
+    ]
+    agreements, candidates = await asyncio.gather(
+        db.agreements.aggregate(pipeline).to_list(limit + 1),
+        db.agreements.count_documents(match, limit=SEARCH_MAX_CANDIDATES + 1),
+    )
+    items = [serialize_agreement(agreement) for agreement in agreements[:limit]]
+    
+    # Older matches than the ranked ones are out of reach; truncated tells
+    # the client to narrow the query
+    return {
+        "items": items,
+        "page": page,
+        "has_more": len(agreements) > limit,
+        "truncated": candidates > SEARCH_MAX_CANDIDATES,
+    }
+
+# Get Agreement
+@api_router.get("/agreements/{agreement_id}")
+async def get_agreement(
+    agreement_id: str,
+    request: Request,
+    response: Response,
+    fields: Optional[str] = None,  # comma-separated top-level fields, e.g. status,updated_at
+    since: Optional[str] = None,  # updated_at of the copy the client already has
+):
+    selected = parse_agreement_fields(fields)
+    try:
+        since_time = parse_timestamp(since) if since else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Ogiltig tidpunkt i since")
+    
+    agreement = await agreement_cache.get(agreement_id)
+    if not agreement:
+        raise HTTPException(status_code=404, detail="Avtal hittades inte")
+    
+    if since_time is not None and content_unchanged_since(agreement, since_time):
+        # The client's copy only lacks status progress
+        body = {field: agreement.get(field) for field in AGREEMENT_PROGRESS_FIELDS}
+        body["delta"] = True
+        variant = "delta"
+    elif selected is not None:
+        body = {field: agreement.get(field) for field in selected}
+        variant = ",".join(selected)
+    else:
+        body = {field: value for field, value in agreement.items() if field not in AGREEMENT_INTERNAL_FIELDS}
+        variant = "full"
+    
+    etag = agreement_etag(agreement, variant)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return body
+
+# List Agreements
+@api_router.get("/agreements")
+async def list_agreements(
+    status: Optional[AgreementStatus] = None,
+    order: str = Query("desc", pattern="^(asc|desc)$"),
+    limit: int = Query(AGREEMENTS_PAGE_SIZE, ge=1, le=AGREEMENTS_MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+):
+    query = {}
+    if status:
+        query["status"] = status
+    if cursor:
+        query.update(cursor_filter(decode_cursor(cursor), order))
+    
+    direction = -1 if order == "desc" else 1
+    # Fetch one extra row to know whether there is a next page
+    agreements = await db.agreements.find(query, AGREEMENT_SUMMARY_PROJECTION) \
+        .sort([("created_at", direction), ("id", direction)]) \
+        .limit(limit + 1) \
+        .to_list(limit + 1)
+    
+    next_cursor = None
+    if len(agreements) > limit:
+        agreements = agreements[:limit]
+        next_cursor = encode_cursor(serialize_agreement(agreements[-1]))
+    
+    return {"items": [serialize_agreement(agreement) for agreement in agreements], "next_cursor": next_cursor}
+
+# Update Tenant Info
+@api_router.put("/agreements/{agreement_id}/tenant")
+async def update_tenant_info(agreement_id: str, data: TenantUpdateRequest):
+    fields = {
+        "tenant.name": data.name,
+        "tenant.personnummer": data.personnummer,
+        "tenant.address": data.address,
+        "tenant.postal_code": data.postal_code,
+        "tenant.city": data.city,
+        "tenant.phone": data.phone,
+    }
+    # Keep the invited email unless the tenant gives another one
+    if data.email:
+        fields["tenant.email"] = data.email
+    
+    # Tenant name and email are searchable; index them in the same write
+    current = await db.agreements.find_one({"id": agreement_id}, {"_id": 0, "id": 1, "landlord": 1, "tenant": 1, "property": 1})
+    if current:
+        tenant = {**(current.get('tenant') or {}), **{name[len("tenant."):]: value for name, value in fields.items()}}
+        fields.update(agreement_search_fields({**current, "tenant": tenant}))
+    
+    agreement = await update_agreement_in_status(
+        agreement_id, AgreementStatus.PENDING_TENANT_SIGNATURE, fields, content_changed=True
+    )
+    if not agreement:
+        raise await agreement_update_error(agreement_id)
+    
+    return {"message": "Hyresgästens uppgifter uppdaterade"}
+
+# BankID - Start Signing
+@api_router.post("/agreements/{agreement_id}/bankid/start")
+async def start_bankid_signing(agreement_id: str, data: BankIDSignRequest, request: Request, response: Response):
+    agreement = await agreement_cache.get(agreement_id)
+    if not agreement:
+        raise HTTPException(status_code=404, detail="Avtal hittades inte")
+    
+    async def start():
+        session = {
+            "agreement_id": agreement_id,
+            "personnummer": data.personnummer,
+            "signer_type": data.signer_type,
+            "status": "pending",
+            "poll_count": 0,
+            "created_at": utcnow(),
+            "expires_at": session_expiry()
+        }
+        try:
+            order_ref = await bankid_provider.start({**session, "end_user_ip": request.client.host if request.client else None})
+        except ProviderUnavailable as e:
+            logger.warning(f"BankID auth for {agreement_id} failed: {e}")
+            raise provider_unavailable("BankID")
+        
+        # Store the pending signature
+        await db.bankid_sessions.insert_one({"order_ref": order_ref, **session})
+        spawn(collect_session(poll_bankid_session, agreement_id, order_ref))
+        
+        return {
+            "order_ref": order_ref,
+            "status": "pending",
+            "message": "Öppna BankID-appen och skriv in din säkerhetskod"
+        }
+    
+    return await idempotent(request, response, data, start)
+
+# BankID - Check Status
+@api_router.get("/agreements/{agreement_id}/bankid/status/{order_ref}")
+async def check_bankid_status(agreement_id: str, order_ref: str):
+    return await poll_bankid_session(agreement_id, order_ref)
+
+# Swish - Start Payment
+@api_router.post("/agreements/{agreement_id}/swish/start")
+async def start_swish_payment(agreement_id: str, data: SwishPaymentRequest, request: Request, response: Response):
+    agreement = await agreement_cache.get(agreement_id)
+    if not agreement:
+        raise HTTPException(status_code=404, detail="Avtal hittades inte")
+    
+    async def start():
+        session = {
+            "agreement_id": agreement_id,
+            "phone_number": data.phone_number,
+            "amount": data.amount,
+            "status": "pending",
+            "poll_count": 0,
+            "created_at": utcnow(),
+            "expires_at": session_expiry()
+        }
+        try:
+            payment_ref = await swish_provider.start(session)
+        except ProviderUnavailable as e:
+            logger.warning(f"Swish payment request for {agreement_id} failed: {e}")
+            raise provider_unavailable("Swish")
+        
+        await db.swish_sessions.insert_one({"payment_ref": payment_ref, **session})
+        spawn(collect_session(poll_swish_session, agreement_id, payment_ref))
+        
+        return {
+            "payment_ref": payment_ref,
+            "status": "pending",
+            "message": f"Öppna Swish-appen och godkänn betalningen på {data.amount} SEK"
+        }
+    
+    return await idempotent(request, response, data, start)
+
+# Swish - Check Status
+@api_router.get("/agreements/{agreement_id}/swish/status/{payment_ref}")
+async def check_swish_status(agreement_id: str, payment_ref: str):
+    return await poll_swish_session(agreement_id, payment_ref)
+
+# Agreement Status Events
+@api_router.get("/agreements/{agreement_id}/events")
+async def stream_agreement_events(agreement_id: str, request: Request):
+    # Subscribe before reading the snapshot so no transition falls in between
+    queue = event_bus.subscribe(agreement_id)
+    agreement = await db.agreements.find_one({"id": agreement_id}, {"_id": 0, "status": 1, "updated_at": 1})
+    if not agreement:
+        event_bus.unsubscribe(agreement_id, queue)
+        raise HTTPException(status_code=404, detail="Avtal hittades inte")
+    sessions = await session_snapshot(agreement_id)
+    
+    async def event_stream():
+        try:
+            yield format_sse(agreement_event(agreement))
+            for event in sessions:
+                yield format_sse(event)
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=SSE_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": ping\n\n"
+                    continue
+                yield format_sse(event)
+        finally:
+            event_bus.unsubscribe(agreement_id, queue)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 # Generate PDF
 @api_router.get("/agreements/{agreement_id}/pdf")
-async def get_agreement_pdf(agreement_id: str):
-    agreement = await db.agreements.find_one({"id": agreement_id}, {"_id": 0})
+async def get_agreement_pdf(agreement_id: str, request: Request):
+    agreement = await agreement_cache.get(agreement_id)
     if not agreement:
         raise HTTPException(status_code=404, detail="Avtal hittades inte")
     
-    pdf_buffer = generate_pdf(agreement)
+    # The signed document is final; serve the archived copy
+    if agreement['status'] == AgreementStatus.COMPLETED:
+        signed = await get_signed_pdf(agreement)
+        if signed is not None:
+            return signed_pdf_response(request, signed, agreement_id)
+    
+    key = pdf_cache_key(agreement)
+    etag = f'"{key}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "private, no-cache",
+        "Content-Disposition": f"attachment; filename=hyresavtal-{agreement_id[:8]}.pdf"
+    }
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    
+    pdf = await get_or_render_pdf(agreement, key)
+    
+    return Response(content=pdf, media_type="application/pdf", headers=headers)
+
+# Batch PDF Export
+@api_router.post("/agreements/export")
+async def export_agreements(data: AgreementExportRequest):
+    if data.ids is not None and len(data.ids) > EXPORT_MAX_AGREEMENTS:
+        raise HTTPException(status_code=400, detail=f"Högst {EXPORT_MAX_AGREEMENTS} avtal per export")
+    query = export_query(data)
+    # A filter must not be cut short silently; counting stops just past the limit
+    if not data.ids and await db.agreements.count_documents(query, limit=EXPORT_MAX_AGREEMENTS + 1) > EXPORT_MAX_AGREEMENTS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Urvalet omfattar fler än {EXPORT_MAX_AGREEMENTS} avtal, begränsa det med status eller datum",
+        )
     
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")
     return StreamingResponse(
-        pdf_buffer,
-        media_type="application/pdf",
+        stream_agreements_zip(query, data.ids),
+        media_type="application/zip",
         headers={
-            "Content-Disposition": f"attachment; filename=hyresavtal-{agreement_id[:8]}.pdf"
+            "Content-Disposition": f"attachment; filename=hyresavtal-{stamp}.zip"
         }
     )
 
-# Get Email Logs (for admin panel)
+# Admin Statistics
+@api_router.get("/admin/stats")
+async def get_admin_stats(days: int = Query(30, ge=0, le=366)):
+    counters = await db.stats.find_one({"_id": STATS_COUNTERS_ID}, {"_id": 0}) or {}
+    by_status = {status: count for status, count in counters.get('by_status', {}).items() if count}
+    
+    since = (datetime.now(timezone.utc) - timedelta(days=days)).date().isoformat()
+    buckets = await db.stats.find(
+        {"_id": {"$gte": f"day:{since}", "$lt": "day;"}}
+    ).sort("_id", 1).to_list(days + 1)
+    
+    return {
+        "total": counters.get('total', 0),
+        "pending": sum(by_status.get(status.value, 0) for status in PENDING_STATUSES),
+        "completed": by_status.get(AgreementStatus.COMPLETED.value, 0),
+        "revenue": counters.get('revenue', 0),
+        "by_status": by_status,
+        "daily": [
+            {
+                "day": bucket['_id'][len("day:"):],
+                "created": bucket.get('created', 0),
+                "completed": bucket.get('completed', 0),
+                "revenue": bucket.get('revenue', 0),
+            }
+            for bucket in buckets
+        ],
+        "reconciled_at": iso_timestamp(counters.get('reconciled_at')),
+    }
+
+@api_router.post("/admin/stats/reconcile")
+async def reconcile_admin_stats():
+    counters = await reconcile_stats()
+    if counters is None:
+        raise HTTPException(status_code=409, detail="Statistiken ändras just nu, försök igen")
+    return {"message": "Statistik omräknad", "reconciled_at": iso_timestamp(counters['reconciled_at'])}
+
+# Export Agreements as rows
+@api_router.get("/exports/agreements")
+async def export_agreement_rows(
+    export_format: str = Query("csv", alias="format", pattern="^(csv|ndjson)$"),
+    columns: Optional[str] = None,  # comma-separated groups, e.g. landlord,payment
+    status: Optional[AgreementStatus] = None,
+    created_from: Optional[str] = None,
+    created_to: Optional[str] = None,
+):
+    groups = parse_export_groups(columns)
+    query = export_query(AgreementExportRequest(status=status, created_from=created_from, created_to=created_to))
+    projection = {"_id": 0, **{column: 1 for column in AGREEMENT_EXPORT_BASE_COLUMNS}, **{group: 1 for group in groups}}
+    cursor = db.agreements.find(query, projection) \
+        .sort([("created_at", 1), ("id", 1)]) \
+        .batch_size(EXPORT_ROW_BATCH_SIZE)
+    agreements = (serialize_agreement(agreement) async for agreement in cursor)
+    return export_rows_response(agreements, export_format, agreement_export_columns(groups), "hyresavtal")
+
+# Export Email Logs as rows
+@api_router.get("/exports/email-logs")
+async def export_email_log_rows(
+    export_format: str = Query("csv", alias="format", pattern="^(csv|ndjson)$"),
+    status: Optional[str] = None,
+    agreement_id: Optional[str] = None,
+    include_body: bool = False,
+):
+    query = {}
+    if status:
+        query["status"] = status
+    if agreement_id:
+        query["agreement_id"] = agreement_id
+    columns = list(EMAIL_LOG_EXPORT_COLUMNS) + (["body"] if include_body else [])
+    projection = {"_id": 0, **{column: 1 for column in columns}}
+    # _id order is insertion order and needs no extra index
+    cursor = db.email_logs.find(query, projection).sort("_id", 1).batch_size(EXPORT_ROW_BATCH_SIZE)
+    logs = (serialize_email_log(log) async for log in cursor)
+    return export_rows_response(logs, export_format, columns, "epostlogg")
+
+# Liveness: the process is up and serving; never touches the database
+@api_router.get("/health")
+async def health():
+    return {"status": "ok", "mongo_pool": mongo_pool_status()}
+
+# Readiness: the database answers and the startup indexes are in place
+@api_router.get("/ready")
+async def ready(response: Response):
+    body = {"status": "ready", "indexes_ready": database_state["indexes_ready"], "mongo_pool": mongo_pool_status()}
+    try:
+        body["mongo_ping_ms"] = round(await ping_database() * 1000, 2)
+    except (asyncio.TimeoutError, PyMongoError) as e:
+        logger.warning(f"Readiness ping failed: {e!r}")
+        body["status"] = "unavailable"
+        body["mongo_ping_ms"] = None
+    if body["status"] != "ready" or not body["indexes_ready"]:
+        body["status"] = "unavailable"
+        response.status_code = 503
+    return body
+
+# Get Email Logs (for admin panel), newest first
 @api_router.get("/email-logs")
-async def get_email_logs():
-    logs = await db.email_logs.find({}, {"_id": 0}).sort("sent_at", -1).to_list(50)
-    return logs
+async def get_email_logs(
+    to: Optional[str] = None,
+    agreement_id: Optional[str] = None,
+    subject: Optional[str] = None,  # case-insensitive substring
+    status: Optional[str] = None,
+    include_body: bool = False,
+    limit: int = Query(EMAIL_LOGS_PAGE_SIZE, ge=1, le=EMAIL_LOGS_MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+):
+    query = {}
+    if to:
+        query["to"] = to
+    if agreement_id:
+        query["agreement_id"] = agreement_id
+    if subject:
+        query["subject"] = {"$regex": re.escape(subject), "$options": "i"}
+    if status:
+        query["status"] = status
+    if cursor:
+        query.update(decode_email_log_cursor(cursor))
+    
+    # Fetch one extra row to know whether there is a next page
+    logs = await db.email_logs.find(query, email_log_projection(include_body)) \
+        .sort([("queued_at", -1), ("id", -1)]) \
+        .limit(limit + 1) \
+        .to_list(limit + 1)
+    
+    next_cursor = None
+    if len(logs) > limit:
+        logs = logs[:limit]
+        next_cursor = encode_email_log_cursor(logs[-1])
+    
+    return {"items": [serialize_email_log(log) for log in logs], "next_cursor": next_cursor}
+
+# Mail trail of one agreement, oldest first
+@api_router.get("/agreements/{agreement_id}/emails")
+async def get_agreement_emails(agreement_id: str, include_body: bool = False):
+    logs = await db.email_logs.find({"agreement_id": agreement_id}, email_log_projection(include_body)) \
+        .sort([("queued_at", 1), ("id", 1)]) \
+        .to_list(None)
+    return [serialize_email_log(log) for log in logs]
+
+# Metrics (Prometheus text format)
+@api_router.get("/metrics")
+async def get_metrics():
+    return Response(content=render_metrics(), media_type="text/plain; version=0.0.4")
+
+async def ensure_indexes():
+    """Every index the routes rely on; create_index is a no-op when it already exists"""
+    # Listing sorts on (created_at, id), optionally filtered by status
+    await db.agreements.create_index("id", unique=True)
+    await db.agreements.create_index([("created_at", -1), ("id", -1)])
+    await db.agreements.create_index([("status", 1), ("created_at", -1), ("id", -1)])
+    await db.agreements.create_index([("search_terms", 1), ("created_at", -1)])
+    # Status polls look sessions up by reference; expired sessions are removed by TTL
+    await db.bankid_sessions.create_index("order_ref", unique=True)
+    await db.bankid_sessions.create_index("expires_at", expireAfterSeconds=0)
+    await db.swish_sessions.create_index("payment_ref", unique=True)
+    await db.swish_sessions.create_index("expires_at", expireAfterSeconds=0)
+    # The sweeper looks for stale pending sessions and untouched agreements
+    await db.bankid_sessions.create_index([("status", 1), ("created_at", 1)])
+    await db.swish_sessions.create_index([("status", 1), ("created_at", 1)])
+    await db.bankid_sessions.create_index([("agreement_id", 1), ("created_at", -1)])
+    await db.swish_sessions.create_index([("agreement_id", 1), ("created_at", -1)])
+    await db.agreements.create_index([("status", 1), ("updated_at", 1)])
+    # Outbox recovery reads queued messages; the log viewer pages on (queued_at, id),
+    # optionally by recipient or agreement, which also serves an agreement's mail trail
+    await db.email_logs.create_index("id", unique=True)
+    await db.email_logs.create_index("status")
+    await db.email_logs.create_index([("queued_at", -1), ("id", -1)])
+    await db.email_logs.create_index([("to", 1), ("queued_at", -1), ("id", -1)])
+    await db.email_logs.create_index([("agreement_id", 1), ("queued_at", -1), ("id", -1)])
+    await db.email_logs.create_index("sent_at")
+    await ensure_email_log_retention()
+    # Retried requests find the stored response by (key, path); old keys expire by TTL
+    await db.idempotency_keys.create_index([("key", 1), ("path", 1)], unique=True)
+    await db.idempotency_keys.create_index("expires_at", expireAfterSeconds=0)
+    # One archived PDF per agreement; a second upload fails on this index
+    await db[f"{SIGNED_PDF_BUCKET}.files"].create_index("metadata.agreement_id", unique=True)
+
+async def ensure_email_log_retention():
+    """TTL index on queued_at; a changed retention is applied with collMod"""
+    if EMAIL_LOG_RETENTION_DAYS <= 0:
+        # Retention turned off after it was on: stop expiring logs
+        if "queued_at_ttl" in await db.email_logs.index_information():
+            await db.email_logs.drop_index("queued_at_ttl")
+        return
+    seconds = EMAIL_LOG_RETENTION_DAYS * 86400
+    try:
+        await db.email_logs.create_index("queued_at", name="queued_at_ttl", expireAfterSeconds=seconds)
+    except OperationFailure as e:
+        if e.code != 85:  # IndexOptionsConflict
+            raise
+        await db.command({
+            "collMod": "email_logs",
+            "index": {"name": "queued_at_ttl", "expireAfterSeconds": seconds},
+        })
+
+async def connect_database():
+    open_database()
+    ping = await ping_database()
+    await ensure_indexes()
+    database_state["indexes_ready"] = True
+    logger.info(f"MongoDB ready (ping {ping * 1000:.1f} ms, pool options {mongo_client_options() or 'default'})")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Startup, then shutdown once the server stops"""
+    # The database comes first, so everything after finds it reachable and indexed
+    await connect_database()
+    spawn(feed_event_bus())
+    start_pdf_executor()
+    await pdf_cache.load()
+    start_provider_http()
+    spawn(email_outbox.run())
+    # Jobs below run in one worker at a time (see run_as_leader)
+    spawn(run_as_leader("email-recovery", email_outbox.run_recovery))
+    spawn(run_as_leader("search-backfill", backfill_search_fields))
+    spawn(run_as_leader("timestamp-migration", migrate_timestamps))
+    spawn(run_as_leader("signed-pdf-backfill", backfill_signed_pdfs))
+    spawn(run_as_leader("stats-reconciliation", run_stats_reconciliation))
+    spawn(run_as_leader("sweeper", run_sweeper))
+    try:
+        yield
+    finally:
+        await shutdown()
+
+async def shutdown():
+    try:
+        await asyncio.wait_for(email_outbox.drain(), timeout=10)
+    except (asyncio.TimeoutError, PyMongoError):
+        logger.exception("Emails still queued at shutdown were not delivered")
+    for task in list(background_tasks):
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    stop_pdf_executor()
+    await stop_provider_http()
+    await agreement_cache.close()
+    await rate_limit_store.close()
+    close_database()
+
+app = FastAPI(lifespan=lifespan)
 
 # Include router
 app.include_router(api_router)
 
+# Inside CORS, so refused requests still carry CORS headers
+app.add_middleware(AdmissionControlMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Retry-After"],
 )
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
+# Outermost, so the timing covers CORS handling too
+app.add_middleware(RequestMetricsMiddleware)
@@ -0,0 +1,421 @@
+"""Latency and throughput benchmark for the full Securebooking signing flow.
+
+Each simulated client runs the whole flow: create agreement, tenant update,
+tenant BankID start + polls, landlord BankID start + polls, Swish start +
+polls and PDF download. By default the FastAPI app runs in-process against a
+mongomock-motor stand-in; use --mongo-url for a real (or embedded) mongod, or
+--url to drive an already running server. --workers N starts uvicorn with N
+worker processes against --mongo-url and drives that instead.
+
+    python backend_bench.py --flows 200 --concurrency 20
+    python backend_bench.py --save-baseline test_reports/bench_baseline.json
+    python backend_bench.py --baseline test_reports/bench_baseline.json --max-regression 0.25
+    python backend_bench.py --pdf-renders 200
+    python backend_bench.py --workers 4 --mongo-url mongodb://localhost:27017
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import socket
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+import httpx
+
+ROOT_DIR = Path(__file__).parent
+BACKEND_DIR = ROOT_DIR / "backend"
+
+AGREEMENT_DATA = {
+    "landlord": {
+        "name": "Erik Andersson",
+        "personnummer": "19850315-1234",
+        "address": "Storgatan 123",
+        "postal_code": "11122",
+        "city": "Stockholm",
+        "email": "erik@example.com",
+        "phone": "0701234567"
+    },
+    "tenant": {
+        "email": "anna@example.com"
+    },
+    "property": {
+        "address": "Testgatan 789",
+        "postal_code": "11144",
+        "city": "Stockholm",
+        "property_type": "lagenhet",
+        "other_info": "2 rum och kök"
+    },
+    "rental_period": {
+        "from_date": "2025-02-01",
+        "to_date": "2025-08-31",
+        "person_count": 2
+    },
+    "payment": {
+        "rent_amount": 15000,
+        "payment_method": "swish",
+        "security_type": "deposition",
+        "security_amount": "30000 SEK"
+    }
+}
+
+TENANT_DATA = {
+    "name": "Anna Svensson",
+    "personnummer": "19900520-5678",
+    "address": "Lillgatan 456",
+    "postal_code": "11133",
+    "city": "Stockholm",
+    "phone": "0709876543"
+}
+
+MAX_POLLS = 20
+
+
+class FlowError(Exception):
+    pass
+
+
+class LatencyRecorder:
+    """Collects client-side latency samples per endpoint"""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.recording = True
+
+    async def request(self, client, name, method, url, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+        except httpx.HTTPError as e:
+            if self.recording:
+                self.errors[name] += 1
+            raise FlowError(f"{name}: {e}")
+        elapsed = time.perf_counter() - start
+        if self.recording:
+            self.samples[name].append(elapsed)
+            if response.status_code >= 400:
+                self.errors[name] += 1
+        if response.status_code >= 400:
+            raise FlowError(f"{name}: HTTP {response.status_code}")
+        return response
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, round(pct / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+async def poll_until_complete(client, recorder, name, url, poll_interval):
+    for _ in range(MAX_POLLS):
+        response = await recorder.request(client, name, "GET", url)
+        if response.json()["status"] == "complete":
+            return
+        if poll_interval:
+            await asyncio.sleep(poll_interval)
+    raise FlowError(f"{name}: not complete after {MAX_POLLS} polls")
+
+
+async def run_flow(client, recorder, poll_interval):
+    """One agreement from creation to PDF download"""
+    response = await recorder.request(client, "POST /agreements", "POST", "/api/agreements", json=AGREEMENT_DATA)
+    agreement_id = response.json()["id"]
+    base = f"/api/agreements/{agreement_id}"
+
+    await recorder.request(client, "GET /agreements/{id}", "GET", base)
+    await recorder.request(client, "PUT /agreements/{id}/tenant", "PUT", f"{base}/tenant", json=TENANT_DATA)
+
+    for signer, personnummer in (("tenant", TENANT_DATA["personnummer"]), ("landlord", AGREEMENT_DATA["landlord"]["personnummer"])):
+        response = await recorder.request(
+            client, "POST /agreements/{id}/bankid/start", "POST", f"{base}/bankid/start",
+            json={"personnummer": personnummer, "signer_type": signer}
+        )
+        order_ref = response.json()["order_ref"]
+        await poll_until_complete(
+            client, recorder, "GET /agreements/{id}/bankid/status/{ref}",
+            f"{base}/bankid/status/{order_ref}", poll_interval
+        )
+
+    response = await recorder.request(
+        client, "POST /agreements/{id}/swish/start", "POST", f"{base}/swish/start",
+        json={"phone_number": "0701234567", "amount": 100}
+    )
+    payment_ref = response.json()["payment_ref"]
+    await poll_until_complete(
+        client, recorder, "GET /agreements/{id}/swish/status/{ref}",
+        f"{base}/swish/status/{payment_ref}", poll_interval
+    )
+
+    await recorder.request(client, "GET /agreements/{id}/pdf", "GET", f"{base}/pdf")
+
+
+def patch_mongomock():
+    """mongomock re-queries find_one_and_update results by the original filter
+    when the projection drops _id, so a post-image whose status changed comes
+    back as None. Keep _id for the lookup and drop it afterwards."""
+    import mongomock.collection
+
+    find_and_modify = mongomock.collection.Collection._find_and_modify
+
+    def _find_and_modify(self, query, projection=None, *args, **kwargs):
+        drop_id = isinstance(projection, dict) and projection.get("_id") == 0
+        if drop_id:
+            projection = {key: value for key, value in projection.items() if key != "_id"} or None
+        result = find_and_modify(self, query, projection, *args, **kwargs)
+        if drop_id and isinstance(result, dict):
+            result.pop("_id", None)
+        return result
+
+    mongomock.collection.Collection._find_and_modify = _find_and_modify
+
+
+def load_server(mongo_url):
+    # The flow's own polls drive the mock sessions; keep server-side collectors out of the way
+    os.environ.setdefault("SESSION_COLLECT_INTERVAL", "3600")
+    # Every flow comes from this one client; per-client limits would only measure the limiter
+    os.environ.setdefault("RATE_LIMIT_FACTOR", "0")
+    # Measure render latency at --concurrency rather than how many downloads get shed
+    os.environ.setdefault("ADMISSION_MAX_EXPENSIVE", "10000")
+    os.environ.setdefault("DB_NAME", "securebooking_bench")
+    if mongo_url:
+        os.environ["MONGO_URL"] = mongo_url
+    sys.path.insert(0, str(BACKEND_DIR))
+    import server
+
+    if not mongo_url:
+        from mongomock_motor import AsyncMongoMockClient
+
+        patch_mongomock()
+        server.client = AsyncMongoMockClient()
+        server.db = server.client["securebooking_bench"]
+    return server
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@asynccontextmanager
+async def serve_workers(args):
+    """Run the app under uvicorn with several worker processes; yields its URL"""
+    port = free_port()
+    env = {
+        **os.environ,
+        "MONGO_URL": args.mongo_url,
+        "DB_NAME": os.environ.get("DB_NAME", "securebooking_bench"),
+        "WEB_CONCURRENCY": str(args.workers),
+        "SESSION_COLLECT_INTERVAL": os.environ.get("SESSION_COLLECT_INTERVAL", "3600"),
+        "RATE_LIMIT_FACTOR": os.environ.get("RATE_LIMIT_FACTOR", "0"),
+        "ADMISSION_MAX_EXPENSIVE": os.environ.get("ADMISSION_MAX_EXPENSIVE", "10000"),
+    }
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(args.workers), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env,
+    )
+    url = f"http://127.0.0.1:{port}"
+    try:
+        async with httpx.AsyncClient(base_url=url, timeout=5) as client:
+            deadline = time.monotonic() + 60
+            while True:
+                if process.poll() is not None:
+                    raise SystemExit(f"uvicorn exited with code {process.returncode}")
+                try:
+                    if (await client.get("/api/ready")).status_code == 200:
+                        break
+                except httpx.HTTPError:
+                    pass
+                if time.monotonic() > deadline:
+                    raise SystemExit("uvicorn workers did not become ready within 60 s")
+                await asyncio.sleep(0.5)
+        yield url
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+
+@asynccontextmanager
+async def open_client(args):
+    if args.workers:
+        async with serve_workers(args) as url:
+            async with httpx.AsyncClient(base_url=url, timeout=30) as client:
+                yield client
+        return
+
+    if args.url:
+        async with httpx.AsyncClient(base_url=args.url, timeout=30) as client:
+            yield client
+        return
+
+    server = load_server(args.mongo_url)
+    logging.getLogger("server").setLevel(logging.WARNING)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    async with server.app.router.lifespan_context(server.app):
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=30) as client:
+            yield client
+
+
+async def run_benchmark(args):
+    recorder = LatencyRecorder()
+    failures = []
+
+    async with open_client(args) as client:
+        recorder.recording = False
+        for _ in range(args.warmup):
+            await run_flow(client, recorder, args.poll_interval)
+        recorder.recording = True
+
+        remaining = iter(range(args.flows))
+
+        async def worker():
+            for _ in remaining:
+                try:
+                    await run_flow(client, recorder, args.poll_interval)
+                except FlowError as e:
+                    failures.append(str(e))
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        duration = time.perf_counter() - start
+
+    return summarize(recorder, duration, args, failures)
+
+
+def signed_agreement():
+    now = "2025-01-15T10:30:00+00:00"
+    return {
+        **AGREEMENT_DATA,
+        "id": "3f1c9a52-6d0e-4c1b-9b7e-2a5d8e4f7c10",
+        "tenant": {**TENANT_DATA, "email": AGREEMENT_DATA["tenant"]["email"]},
+        "status": "completed",
+        "created_at": now,
+        "updated_at": now,
+        "tenant_signed_at": now,
+        "landlord_signed_at": now,
+        "payment_completed_at": now,
+    }
+
+
+def run_pdf_benchmark(renders):
+    """Single-process renders per second of generate_pdf, without the pool or cache"""
+    server = load_server(None)
+    agreement = signed_agreement()
+    server.generate_pdf(agreement)
+    start = time.perf_counter()
+    for _ in range(renders):
+        server.generate_pdf(agreement)
+    duration = time.perf_counter() - start
+    print(f"📄 generate_pdf: {renders} renders in {duration:.2f} s = {renders / duration:.1f} renders/s "
+          f"({duration / renders * 1000:.2f} ms each)")
+
+
+def summarize(recorder, duration, args, failures):
+    endpoints = {}
+    for name, samples in sorted(recorder.samples.items()):
+        ordered = sorted(samples)
+        endpoints[name] = {
+            "count": len(ordered),
+            "errors": recorder.errors.get(name, 0),
+            "p50_ms": round(percentile(ordered, 50) * 1000, 2),
+            "p95_ms": round(percentile(ordered, 95) * 1000, 2),
+            "p99_ms": round(percentile(ordered, 99) * 1000, 2),
+            "throughput_rps": round(len(ordered) / duration, 1),
+        }
+    return {
+        "flows": args.flows,
+        "concurrency": args.concurrency,
+        "failed_flows": len(failures),
+        "duration_s": round(duration, 2),
+        "flows_per_s": round((args.flows - len(failures)) / duration, 2),
+        "endpoints": endpoints,
+    }
+
+
+def print_report(result):
+    print("\n" + "=" * 100)
+    print("📊 BENCHMARK RESULTS")
+    print("=" * 100)
+    print(f"Flows: {result['flows']} (failed: {result['failed_flows']}) | Concurrency: {result['concurrency']} | "
+          f"Duration: {result['duration_s']} s | Flows/s: {result['flows_per_s']}")
+    print("-" * 100)
+    print(f"{'Endpoint':<44}{'count':>7}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>10}")
+    for name, stats in result["endpoints"].items():
+        print(f"{name:<44}{stats['count']:>7}{stats['errors']:>8}{stats['p50_ms']:>10}"
+              f"{stats['p95_ms']:>10}{stats['p99_ms']:>10}{stats['throughput_rps']:>10}")
+
+
+def compare_to_baseline(result, baseline, max_regression, noise_floor_ms):
+    """Return the endpoints whose p95 regressed beyond the allowed ratio"""
+    regressions = []
+    for name, previous in baseline.get("endpoints", {}).items():
+        current = result["endpoints"].get(name)
+        if not current:
+            continue
+        limit = previous["p95_ms"] * (1 + max_regression)
+        if current["p95_ms"] > limit and current["p95_ms"] - previous["p95_ms"] > noise_floor_ms:
+            regressions.append(f"{name}: p95 {previous['p95_ms']} ms -> {current['p95_ms']} ms")
+    if result["flows_per_s"] < baseline.get("flows_per_s", 0) / (1 + max_regression):
+        regressions.append(f"throughput: {baseline['flows_per_s']} -> {result['flows_per_s']} flows/s")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Securebooking signing flow")
+    parser.add_argument("--flows", type=int, default=100, help="number of complete flows to run")
+    parser.add_argument("--concurrency", type=int, default=10, help="flows running at the same time")
+    parser.add_argument("--warmup", type=int, default=3, help="unrecorded flows before measuring")
+    parser.add_argument("--poll-interval", type=float, default=0.0, help="seconds between status polls")
+    parser.add_argument("--url", help="benchmark a running server instead of the in-process app")
+    parser.add_argument("--mongo-url", help="real MongoDB for the in-process app (default: mongomock)")
+    parser.add_argument("--workers", type=int, help="run uvicorn with this many worker processes (needs --mongo-url)")
+    parser.add_argument("--baseline", help="baseline JSON to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.25, help="allowed p95 slowdown ratio")
+    parser.add_argument("--noise-floor-ms", type=float, default=5.0, help="ignore p95 changes smaller than this")
+    parser.add_argument("--save-baseline", help="write this run's results as the new baseline")
+    parser.add_argument("--output", help="write this run's results as JSON")
+    parser.add_argument("--pdf-renders", type=int, help="only micro-benchmark generate_pdf with this many renders")
+    args = parser.parse_args()
+
+    if args.pdf_renders:
+        run_pdf_benchmark(args.pdf_renders)
+        return 0
+    if args.workers and not args.mongo_url:
+        parser.error("--workers needs --mongo-url: mongomock cannot be shared between processes")
+
+    print("🚀 Starting Securebooking benchmark")
+    result = asyncio.run(run_benchmark(args))
+    print_report(result)
+
+    for path in filter(None, (args.output, args.save_baseline)):
+        Path(path).write_text(json.dumps(result, indent=2) + "\n")
+        print(f"\n💾 Results written to {path}")
+
+    if result["failed_flows"]:
+        print(f"\n❌ {result['failed_flows']} flows failed")
+        return 1
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+        regressions = compare_to_baseline(result, baseline, args.max_regression, args.noise_floor_ms)
+        if regressions:
+            print("\n❌ Regressions against baseline:")
+            for line in regressions:
+                print(f"   {line}")
+            return 1
+        print("\n✅ No regressions against baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,31 @@
+import { useEffect, useRef } from "react";
+
+const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
+const API = `${BACKEND_URL}/api`;
+
+// Subscribe to pushed status events for one agreement (Server-Sent Events).
+// Every (re)connection starts with a snapshot: the agreement status followed
+// by its latest BankID/Swish sessions, so a completion that happened while
+// the connection was down is not lost. After that only transitions are sent.
+// EventSource reconnects on its own.
+function useAgreementEvents(agreementId, onEvent, enabled = true) {
+  const handlerRef = useRef(onEvent);
+  handlerRef.current = onEvent;
+
+  useEffect(() => {
+    if (!agreementId || !enabled) return;
+
+    const source = new EventSource(`${API}/agreements/${agreementId}/events`);
+    source.onmessage = (message) => {
+      try {
+        handlerRef.current(JSON.parse(message.data));
+      } catch (error) {
+        console.error("Error handling agreement event:", error);
+      }
+    };
+
+    return () => source.close();
+  }, [agreementId, enabled]);
+}
+
+export { useAgreementEvents };
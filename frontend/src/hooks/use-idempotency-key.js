@@ -0,0 +1,28 @@
+import { useCallback, useRef } from "react";
+
+const newKey = () =>
+  window.crypto?.randomUUID?.() ?? `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+
+// Idempotency-Key for one user action. Retrying with the same payload reuses
+// the key, so the server replays its first response instead of creating a
+// second agreement or session; a changed payload gets a new key. Call
+// reset() after success so doing the action again is a new request.
+function useIdempotencyKey() {
+  const last = useRef(null);
+
+  const keyFor = useCallback((payload) => {
+    const body = JSON.stringify(payload);
+    if (!last.current || last.current.body !== body) {
+      last.current = { body, key: newKey() };
+    }
+    return last.current.key;
+  }, []);
+
+  const reset = useCallback(() => {
+    last.current = null;
+  }, []);
+
+  return { keyFor, reset };
+}
+
+export { useIdempotencyKey };
@@ -164,66 +164,118 @@ const AgreementRow = ({ agreement, onView }) => {
 // Main Admin Page
 const AdminPage = () => {
   const [agreements, setAgreements] = useState([]);
+  const [nextPage, setNextPage] = useState(null);
+  const [searchTruncated, setSearchTruncated] = useState(false);
   const [loading, setLoading] = useState(true);
+  const [loadingMore, setLoadingMore] = useState(false);
+  const [exporting, setExporting] = useState(false);
+  const [exportError, setExportError] = useState(null);
+  const [stats, setStats] = useState({ total: 0, pending: 0, completed: 0, revenue: 0 });
   const [searchTerm, setSearchTerm] = useState("");
+  const [query, setQuery] = useState("");
   const [statusFilter, setStatusFilter] = useState("all");
   const [showFilters, setShowFilters] = useState(false);
 
+  // Debounce the search box before querying the server
+  useEffect(() => {
+    const timeout = setTimeout(() => setQuery(searchTerm.trim()), 300);
+    return () => clearTimeout(timeout);
+  }, [searchTerm]);
+
+  const fetchPage = useCallback(async (next) => {
+    // Filtered, searched and paginated on the server
+    const params = {};
+    if (statusFilter !== "all") params.status = statusFilter;
+
+    if (query) {
+      params.q = query;
+      params.page = next || 1;
+      const response = await axios.get(`${API}/agreements/search`, { params });
+      const { items, page, has_more, truncated } = response.data;
+      return { items, next: has_more ? page + 1 : null, truncated };
+    }
+
+    params.order = "desc";
+    if (next) params.cursor = next;
+    const response = await axios.get(`${API}/agreements`, { params });
+    return { items: response.data.items, next: response.data.next_cursor };
+  }, [statusFilter, query]);
+
+  const fetchStats = useCallback(async () => {
+    try {
+      const response = await axios.get(`${API}/admin/stats`);
+      setStats(response.data);
+    } catch (error) {
+      console.error("Error fetching stats:", error);
+    }
+  }, []);
+
   const fetchAgreements = useCallback(async () => {
     try {
       setLoading(true);
-      const response = await axios.get(`${API}/agreements`);
-      // Sort by created_at descending (newest first)
-      const sorted = response.data.sort((a, b) => 
-        new Date(b.created_at) - new Date(a.created_at)
-      );
-      setAgreements(sorted);
+      const page = await fetchPage(null);
+      setAgreements(page.items);
+      setNextPage(page.next);
+      setSearchTruncated(Boolean(page.truncated));
     } catch (error) {
       console.error("Error fetching agreements:", error);
     } finally {
       setLoading(false);
     }
-  }, []);
+  }, [fetchPage]);
+
+  const exportPdfs = async () => {
+    try {
+      setExporting(true);
+      setExportError(null);
+      const body = statusFilter !== "all" ? { status: statusFilter } : {};
+      const response = await axios.post(`${API}/agreements/export`, body, { responseType: "blob" });
+      const url = URL.createObjectURL(response.data);
+      const link = document.createElement("a");
+      link.href = url;
+      link.download = "hyresavtal.zip";
+      link.click();
+      URL.revokeObjectURL(url);
+    } catch (error) {
+      console.error("Error exporting agreements:", error);
+      let detail = null;
+      try {
+        // The error body arrives as a blob too
+        detail = JSON.parse(await error.response.data.text()).detail;
+      } catch (parseError) {
+        // No response, or not a JSON error
+      }
+      setExportError(typeof detail === "string" ? detail : "Exporten misslyckades");
+    } finally {
+      setExporting(false);
+    }
+  };
+
+  const loadMore = async () => {
+    if (!nextPage) return;
+    try {
+      setLoadingMore(true);
+      const page = await fetchPage(nextPage);
+      setAgreements(prev => [...prev, ...page.items]);
+      setNextPage(page.next);
+    } catch (error) {
+      console.error("Error fetching agreements:", error);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
 
   useEffect(() => {
     fetchAgreements();
   }, [fetchAgreements]);
 
-  // Filter agreements
-  const filteredAgreements = agreements.filter(agreement => {
-    // Status filter
-    if (statusFilter !== "all" && agreement.status !== statusFilter) {
-      return false;
-    }
-    
-    // Search filter
-    if (searchTerm) {
-      const search = searchTerm.toLowerCase();
-      const matchesLandlord = agreement.landlord?.name?.toLowerCase().includes(search) ||
-                              agreement.landlord?.email?.toLowerCase().includes(search);
-      const matchesTenant = agreement.tenant?.name?.toLowerCase().includes(search) ||
-                            agreement.tenant?.email?.toLowerCase().includes(search);
-      const matchesProperty = agreement.property?.address?.toLowerCase().includes(search);
-      const matchesId = agreement.id.toLowerCase().includes(search);
-      
-      if (!matchesLandlord && !matchesTenant && !matchesProperty && !matchesId) {
-        return false;
-      }
-    }
-    
-    return true;
-  });
+  useEffect(() => {
+    fetchStats();
+  }, [fetchStats]);
 
-  // Calculate stats
-  const stats = {
-    total: agreements.length,
-    pending: agreements.filter(a => 
-      a.status === "pending_tenant_signature" || 
-      a.status === "pending_landlord_signature" ||
-      a.status === "pending_payment"
-    ).length,
-    completed: agreements.filter(a => a.status === "completed").length,
-    totalRevenue: agreements.filter(a => a.status === "completed").length * 100,
+  const refresh = () => {
+    fetchAgreements();
+    fetchStats();
   };
 
   return (
@@ -239,15 +291,35 @@ const AdminPage = () => {
                 Administratörspanel
               </h1>
               <p className="text-[#5A5A5A]">Översikt över alla hyresavtal</p>
+              {exportError && <p className="text-sm text-red-500 mt-2" data-testid="export-error">{exportError}</p>}
+            </div>
+            <div className="mt-4 md:mt-0 flex items-center gap-2">
+              <button
+                onClick={exportPdfs}
+                disabled={exporting}
+                className="btn-secondary inline-flex items-center gap-2"
+                data-testid="export-btn"
+              >
+                <Download className={`w-4 h-4 ${exporting ? 'animate-pulse' : ''}`} />
+                Exportera PDF:er
+              </button>
+              <a
+                href={`${API}/exports/agreements?format=csv${statusFilter !== "all" ? `&status=${statusFilter}` : ""}`}
+                className="btn-secondary inline-flex items-center gap-2"
+                data-testid="export-csv-btn"
+              >
+                <Download className="w-4 h-4" />
+                Exportera CSV
+              </a>
+              <button
+                onClick={refresh}
+                className="btn-secondary inline-flex items-center gap-2"
+                data-testid="refresh-btn"
+              >
+                <RefreshCw className={`w-4 h-4 ${loading ? 'animate-spin' : ''}`} />
+                Uppdatera
+              </button>
             </div>
-            <button
-              onClick={fetchAgreements}
-              className="mt-4 md:mt-0 btn-secondary inline-flex items-center gap-2"
-              data-testid="refresh-btn"
-            >
-              <RefreshCw className={`w-4 h-4 ${loading ? 'animate-spin' : ''}`} />
-              Uppdatera
-            </button>
           </div>
 
           {/* Stats */}
@@ -273,7 +345,7 @@ const AdminPage = () => {
             <StatsCard 
               icon={CreditCard} 
               label="Intäkter" 
-              value={`${stats.totalRevenue} SEK`}
+              value={`${stats.revenue} SEK`}
               color="bg-[#C66D5D]"
             />
           </div>
@@ -317,8 +389,13 @@ const AdminPage = () => {
           {/* Results count */}
           <div className="mb-4">
             <p className="text-sm text-[#5A5A5A]">
-              Visar {filteredAgreements.length} av {agreements.length} avtal
+              Visar {agreements.length}{nextPage ? "+" : ""} avtal
             </p>
+            {searchTruncated && (
+              <p className="text-sm text-[#5A5A5A] mt-1" data-testid="search-truncated">
+                Sökningen gav fler träffar än som kan visas. Bara de senaste visas, förfina sökningen för att hitta äldre avtal.
+              </p>
+            )}
           </div>
 
           {/* Table */}
@@ -344,7 +421,7 @@ const AdminPage = () => {
                         <p className="text-[#5A5A5A]">Laddar avtal...</p>
                       </td>
                     </tr>
-                  ) : filteredAgreements.length === 0 ? (
+                  ) : agreements.length === 0 ? (
                     <tr>
                       <td colSpan={7} className="py-12 text-center">
                         <FileText className="w-12 h-12 text-[#E2E2E0] mx-auto mb-2" />
@@ -352,13 +429,26 @@ const AdminPage = () => {
                       </td>
                     </tr>
                   ) : (
-                    filteredAgreements.map((agreement) => (
+                    agreements.map((agreement) => (
                       <AgreementRow key={agreement.id} agreement={agreement} />
                     ))
                   )}
                 </tbody>
               </table>
             </div>
+            {nextPage && !loading && (
+              <div className="p-4 border-t border-[#E2E2E0] text-center">
+                <button
+                  onClick={loadMore}
+                  disabled={loadingMore}
+                  className="btn-secondary inline-flex items-center gap-2"
+                  data-testid="load-more-btn"
+                >
+                  {loadingMore && <RefreshCw className="w-4 h-4 animate-spin" />}
+                  Visa fler
+                </button>
+              </div>
+            )}
           </div>
 
           {/* Email Log Section */}
@@ -18,6 +18,7 @@ import {
   CheckCircle2,
 } from "lucide-react";
 import axios from "axios";
+import { useIdempotencyKey } from "@/hooks/use-idempotency-key";
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
@@ -491,6 +492,7 @@ const FormPage = () => {
   const [isSubmitting, setIsSubmitting] = useState(false);
   const [showSuccess, setShowSuccess] = useState(false);
   const [createdAgreementId, setCreatedAgreementId] = useState(null);
+  const idempotency = useIdempotencyKey();
   const [errors, setErrors] = useState({});
   const [formData, setFormData] = useState({
     // Landlord
@@ -656,7 +658,10 @@ const FormPage = () => {
         }
       };
       
-      const response = await axios.post(`${API}/agreements`, agreementData);
+      const response = await axios.post(`${API}/agreements`, agreementData, {
+        headers: { "Idempotency-Key": idempotency.keyFor(agreementData) },
+      });
+      idempotency.reset();
       setCreatedAgreementId(response.data.id);
       setShowSuccess(true);
     } catch (error) {
@@ -1,4 +1,4 @@
-import { useState, useEffect, useCallback } from "react";
+import { useState, useEffect, useCallback, useRef } from "react";
 import { Link, useParams, useNavigate } from "react-router-dom";
 import {
   ShieldCheck,
@@ -19,6 +19,8 @@ import {
   Check,
 } from "lucide-react";
 import axios from "axios";
+import { useAgreementEvents } from "@/hooks/use-agreement-events";
+import { useIdempotencyKey } from "@/hooks/use-idempotency-key";
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
@@ -274,14 +276,19 @@ const BankIDSigning = ({ agreement, onComplete }) => {
   const [status, setStatus] = useState("idle");
   const [orderRef, setOrderRef] = useState(null);
   const [message, setMessage] = useState("");
+  const idempotency = useIdempotencyKey();
 
   const startSigning = async () => {
     setStatus("starting");
     try {
-      const response = await axios.post(`${API}/agreements/${agreement.id}/bankid/start`, {
+      const request = {
         personnummer: agreement.landlord?.personnummer,
         signer_type: "landlord"
+      };
+      const response = await axios.post(`${API}/agreements/${agreement.id}/bankid/start`, request, {
+        headers: { "Idempotency-Key": idempotency.keyFor(request) },
       });
+      idempotency.reset();
       setOrderRef(response.data.order_ref);
       setMessage(response.data.message);
       setStatus("pending");
@@ -291,28 +298,18 @@ const BankIDSigning = ({ agreement, onComplete }) => {
     }
   };
 
-  const checkStatus = useCallback(async () => {
-    if (!orderRef) return;
-    
-    try {
-      const response = await axios.get(`${API}/agreements/${agreement.id}/bankid/status/${orderRef}`);
-      setMessage(response.data.message);
-      
-      if (response.data.status === "complete") {
-        setStatus("complete");
-        setTimeout(() => onComplete(), 1500);
-      }
-    } catch (error) {
-      console.error("Error checking status:", error);
-    }
-  }, [orderRef, agreement.id, onComplete]);
-
-  useEffect(() => {
-    if (status === "pending" && orderRef) {
-      const interval = setInterval(checkStatus, 2000);
-      return () => clearInterval(interval);
+  // Completion is pushed by the server instead of polled
+  useAgreementEvents(agreement.id, (event) => {
+    if (event.type !== "bankid" || event.order_ref !== orderRef) return;
+    if (event.status === "complete") {
+      setMessage("Signering genomförd!");
+      setStatus("complete");
+      setTimeout(() => onComplete(), 1500);
+    } else if (event.status === "failed") {
+      setMessage("Signeringen avbröts");
+      setStatus("error");
     }
-  }, [status, orderRef, checkStatus]);
+  }, status === "starting" || status === "pending");
 
   return (
     <div className="card-elevated text-center" data-testid="bankid-signing">
@@ -388,15 +385,20 @@ const SwishPayment = ({ agreement, onComplete }) => {
   const [status, setStatus] = useState("idle");
   const [paymentRef, setPaymentRef] = useState(null);
   const [message, setMessage] = useState("");
+  const idempotency = useIdempotencyKey();
   const [phone, setPhone] = useState(agreement.landlord?.phone || "");
 
   const startPayment = async () => {
     setStatus("starting");
     try {
-      const response = await axios.post(`${API}/agreements/${agreement.id}/swish/start`, {
+      const request = {
         phone_number: phone || "0701234567",
         amount: SERVICE_FEE
+      };
+      const response = await axios.post(`${API}/agreements/${agreement.id}/swish/start`, request, {
+        headers: { "Idempotency-Key": idempotency.keyFor(request) },
       });
+      idempotency.reset();
       setPaymentRef(response.data.payment_ref);
       setMessage(response.data.message);
       setStatus("pending");
@@ -406,28 +408,18 @@ const SwishPayment = ({ agreement, onComplete }) => {
     }
   };
 
-  const checkStatus = useCallback(async () => {
-    if (!paymentRef) return;
-    
-    try {
-      const response = await axios.get(`${API}/agreements/${agreement.id}/swish/status/${paymentRef}`);
-      setMessage(response.data.message);
-      
-      if (response.data.status === "complete") {
-        setStatus("complete");
-        setTimeout(() => onComplete(), 1500);
-      }
-    } catch (error) {
-      console.error("Error checking status:", error);
-    }
-  }, [paymentRef, agreement.id, onComplete]);
-
-  useEffect(() => {
-    if (status === "pending" && paymentRef) {
-      const interval = setInterval(checkStatus, 2000);
-      return () => clearInterval(interval);
+  // Completion is pushed by the server instead of polled
+  useAgreementEvents(agreement.id, (event) => {
+    if (event.type !== "swish" || event.payment_ref !== paymentRef) return;
+    if (event.status === "complete") {
+      setMessage("Betalning genomförd!");
+      setStatus("complete");
+      setTimeout(() => onComplete(), 1500);
+    } else if (event.status === "failed") {
+      setMessage("Betalningen genomfördes inte");
+      setStatus("error");
     }
-  }, [status, paymentRef, checkStatus]);
+  }, status === "starting" || status === "pending");
 
   return (
     <div className="card-elevated text-center" data-testid="swish-payment">
@@ -599,10 +591,18 @@ const SigningPage = () => {
   const [step, setStep] = useState("loading"); // loading, waiting, review, sign, payment, complete
   const [manualStep, setManualStep] = useState(null); // Track manual step changes
 
+  const agreementRef = useRef(null);
+
   const fetchAgreement = useCallback(async () => {
     try {
-      const response = await axios.get(`${API}/agreements/${agreementId}`);
-      const data = response.data;
+      // With a copy in hand, only status progress is sent unless the content changed
+      const known = agreementRef.current;
+      const response = await axios.get(`${API}/agreements/${agreementId}`, {
+        params: known ? { since: known.updated_at } : {},
+      });
+      const { delta, ...changes } = response.data;
+      const data = delta ? { ...known, ...changes } : changes;
+      agreementRef.current = data;
       setAgreement(data);
       
       // Only update step if not manually overridden
@@ -634,16 +634,14 @@ const SigningPage = () => {
 
   useEffect(() => {
     fetchAgreement();
-    
-    // Poll for updates when waiting for tenant
-    const interval = setInterval(() => {
-      if (step === "waiting") {
-        fetchAgreement();
-      }
-    }, 10000);
-    
-    return () => clearInterval(interval);
-  }, [fetchAgreement, step]);
+  }, [fetchAgreement]);
+
+  // Refetch when the tenant signs instead of polling while waiting
+  useAgreementEvents(agreementId, (event) => {
+    if (event.type === "agreement" && event.status !== agreement?.status) {
+      fetchAgreement();
+    }
+  }, step === "waiting");
 
   const handleReviewComplete = () => {
     setManualStep("sign");
@@ -14,6 +14,8 @@ import {
   Check,
 } from "lucide-react";
 import axios from "axios";
+import { useAgreementEvents } from "@/hooks/use-agreement-events";
+import { useIdempotencyKey } from "@/hooks/use-idempotency-key";
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
@@ -214,6 +216,7 @@ const BankIDSigning = ({ agreement, onComplete }) => {
   const [orderRef, setOrderRef] = useState(null);
   const [message, setMessage] = useState("");
   const [personnummer, setPersonnummer] = useState("");
+  const idempotency = useIdempotencyKey();
 
   const startSigning = async () => {
     if (!personnummer) {
@@ -223,10 +226,14 @@ const BankIDSigning = ({ agreement, onComplete }) => {
     
     setStatus("starting");
     try {
-      const response = await axios.post(`${API}/agreements/${agreement.id}/bankid/start`, {
+      const request = {
         personnummer: personnummer,
         signer_type: "tenant"
+      };
+      const response = await axios.post(`${API}/agreements/${agreement.id}/bankid/start`, request, {
+        headers: { "Idempotency-Key": idempotency.keyFor(request) },
       });
+      idempotency.reset();
       setOrderRef(response.data.order_ref);
       setMessage(response.data.message);
       setStatus("pending");
@@ -236,28 +243,18 @@ const BankIDSigning = ({ agreement, onComplete }) => {
     }
   };
 
-  const checkStatus = useCallback(async () => {
-    if (!orderRef) return;
-    
-    try {
-      const response = await axios.get(`${API}/agreements/${agreement.id}/bankid/status/${orderRef}`);
-      setMessage(response.data.message);
-      
-      if (response.data.status === "complete") {
-        setStatus("complete");
-        setTimeout(() => onComplete(), 1500);
-      }
-    } catch (error) {
-      console.error("Error checking status:", error);
-    }
-  }, [orderRef, agreement.id, onComplete]);
-
-  useEffect(() => {
-    if (status === "pending" && orderRef) {
-      const interval = setInterval(checkStatus, 2000);
-      return () => clearInterval(interval);
+  // Completion is pushed by the server instead of polled
+  useAgreementEvents(agreement.id, (event) => {
+    if (event.type !== "bankid" || event.order_ref !== orderRef) return;
+    if (event.status === "complete") {
+      setMessage("Signering genomförd!");
+      setStatus("complete");
+      setTimeout(() => onComplete(), 1500);
+    } else if (event.status === "failed") {
+      setMessage("Signeringen avbröts");
+      setStatus("error");
     }
-  }, [status, orderRef, checkStatus]);
+  }, status === "starting" || status === "pending");
 
   return (
     <div className="card-elevated text-center" data-testid="bankid-signing">
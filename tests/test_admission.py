@@ -0,0 +1,100 @@
+from types import SimpleNamespace
+
+import pytest
+
+import server
+
+
+def scope(path="/", headers=(), client=("10.0.0.2", 50000)):
+    return {"type": "http", "path": path, "root_path": "", "headers": list(headers), "client": client}
+
+
+@pytest.fixture
+def behind_proxy(monkeypatch):
+    monkeypatch.setattr(server, "RATE_LIMIT_TRUSTED_PROXIES", 1)
+
+
+def test_client_is_taken_from_the_proxy_entry_of_x_forwarded_for(behind_proxy):
+    forwarded = scope(headers=[(b"x-forwarded-for", b"6.6.6.6, 203.0.113.7")])
+    assert server.client_address(forwarded) == "203.0.113.7"
+
+
+def test_client_spread_over_several_headers(behind_proxy):
+    forwarded = scope(headers=[(b"x-forwarded-for", b"6.6.6.6"), (b"x-forwarded-for", b"203.0.113.7")])
+    assert server.client_address(forwarded) == "203.0.113.7"
+
+
+def test_client_without_proxy_header_is_the_connecting_address(behind_proxy):
+    assert server.client_address(scope()) == "10.0.0.2"
+
+
+def test_direct_clients_cannot_choose_their_bucket():
+    forwarded = scope(headers=[(b"x-forwarded-for", b"203.0.113.7")])
+    assert server.client_address(forwarded) == "10.0.0.2"
+
+
+def test_match_route_finds_templates_with_admission_rules():
+    assert server.match_route(scope("/api/agreements/export")) == ("/api/agreements/export", {})
+    assert server.match_route(scope("/api/agreements/a1/bankid/start")) == (
+        "/api/agreements/{agreement_id}/bankid/start", {"agreement_id": "a1"},
+    )
+    assert server.match_route(scope("/api/agreements/a1")) == (None, {})
+
+
+def test_event_streams_are_never_rate_limited():
+    assert not any(template.endswith("/events") for _, template in server.RATE_LIMITS)
+    assert "/api/agreements/{agreement_id}/events" in server.ADMISSION_EXEMPT_ROUTES
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(server, "time", SimpleNamespace(monotonic=clock.monotonic))
+    return clock
+
+
+@pytest.mark.anyio
+async def test_token_bucket_allows_a_burst_then_asks_to_wait(clock):
+    store = server.MemoryRateLimitStore(max_buckets=10)
+    assert [await store.take("ip", rate=0.5, burst=3) for _ in range(3)] == [0, 0, 0]
+    assert await store.take("ip", rate=0.5, burst=3) == pytest.approx(2.0)
+
+
+@pytest.mark.anyio
+async def test_token_bucket_refills_with_time_up_to_the_burst(clock):
+    store = server.MemoryRateLimitStore(max_buckets=10)
+    for _ in range(2):
+        await store.take("ip", rate=1, burst=2)
+
+    clock.now += 0.5
+    assert await store.take("ip", rate=1, burst=2) == pytest.approx(0.5)
+    clock.now += 100
+    assert [await store.take("ip", rate=1, burst=2) for _ in range(3)] == [0, 0, pytest.approx(1.0)]
+
+
+@pytest.mark.anyio
+async def test_token_buckets_are_per_key(clock):
+    store = server.MemoryRateLimitStore(max_buckets=10)
+    assert await store.take("a", rate=1, burst=1) == 0
+    assert await store.take("a", rate=1, burst=1) > 0
+    assert await store.take("b", rate=1, burst=1) == 0
+
+
+@pytest.mark.anyio
+async def test_least_recently_used_buckets_are_evicted(clock):
+    store = server.MemoryRateLimitStore(max_buckets=2)
+    await store.take("a", rate=1, burst=1)
+    await store.take("b", rate=1, burst=1)
+    await store.take("a", rate=1, burst=1)  # a is used again, so b goes first
+    await store.take("c", rate=1, burst=1)
+
+    assert await store.take("b", rate=1, burst=1) == 0
+    assert await store.take("c", rate=1, burst=1) > 0
@@ -0,0 +1,136 @@
+import asyncio
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def cache():
+    return server.AgreementCache(ttl=60, max_entries=2)
+
+
+@pytest.fixture
+def fetches(db, monkeypatch):
+    """Count agreement reads; set `gate` to hold them until it is released"""
+    collection_type = type(db.agreements)
+    find_one = collection_type.find_one
+    state = {"count": 0, "gate": None}
+
+    async def counting(self, *args, **kwargs):
+        state["count"] += 1
+        if state["gate"] is not None:
+            await state["gate"].wait()
+        return await find_one(self, *args, **kwargs)
+
+    monkeypatch.setattr(collection_type, "find_one", counting)
+    return state
+
+
+async def test_hits_are_served_from_memory_as_copies(db, cache, fetches):
+    await db.agreements.insert_one({"id": "a1", "status": "draft"})
+
+    first = await cache.get("a1")
+    first["status"] = "changed by caller"
+
+    assert await cache.get("a1") == {"id": "a1", "status": "draft"}
+    assert fetches["count"] == 1
+
+
+async def test_missing_agreements_are_not_cached(db, cache, fetches):
+    assert await cache.get("nope") is None
+    assert await cache.get("nope") is None
+    assert fetches["count"] == 2
+
+
+async def test_invalidate_drops_the_cached_copy(db, cache, fetches):
+    await db.agreements.insert_one({"id": "a1", "status": "draft"})
+    await cache.get("a1")
+
+    await db.agreements.update_one({"id": "a1"}, {"$set": {"status": "cancelled"}})
+    await cache.invalidate("a1")
+
+    assert (await cache.get("a1"))["status"] == "cancelled"
+
+
+async def test_least_recently_used_entries_are_evicted(db, cache, fetches):
+    await db.agreements.insert_many([{"id": f"a{n}"} for n in range(3)])
+    for agreement_id in ("a0", "a1", "a0", "a2"):
+        await cache.get(agreement_id)
+    assert fetches["count"] == 3
+
+    await cache.get("a1")
+    assert fetches["count"] == 4
+
+
+async def test_expired_entries_are_fetched_again(db, fetches):
+    cache = server.AgreementCache(ttl=0, max_entries=2)
+    await db.agreements.insert_one({"id": "a1"})
+
+    await cache.get("a1")
+    await cache.get("a1")
+
+    assert fetches["count"] == 2
+
+
+async def test_concurrent_misses_share_one_fetch(db, cache, fetches):
+    await db.agreements.insert_one({"id": "a1", "status": "draft"})
+    fetches["gate"] = asyncio.Event()
+
+    readers = [asyncio.create_task(cache.get("a1")) for _ in range(5)]
+    await asyncio.sleep(0)
+    fetches["gate"].set()
+    results = await asyncio.gather(*readers)
+
+    assert fetches["count"] == 1
+    assert all(result == {"id": "a1", "status": "draft"} for result in results)
+    assert len({id(result) for result in results}) == 5
+
+
+async def test_waiters_fetch_themselves_when_the_loading_caller_is_cancelled(db, cache, fetches):
+    await db.agreements.insert_one({"id": "a1", "status": "draft"})
+    fetches["gate"] = asyncio.Event()
+
+    loader = asyncio.create_task(cache.get("a1"))
+    await asyncio.sleep(0)
+    waiter = asyncio.create_task(cache.get("a1"))
+    await asyncio.sleep(0)
+    loader.cancel()
+    await asyncio.sleep(0)
+    fetches["gate"].set()
+
+    assert await waiter == {"id": "a1", "status": "draft"}
+    with pytest.raises(asyncio.CancelledError):
+        await loader
+    assert fetches["count"] == 2
+
+
+async def test_cancelled_waiter_leaves_the_shared_fetch_running(db, cache, fetches):
+    await db.agreements.insert_one({"id": "a1", "status": "draft"})
+    fetches["gate"] = asyncio.Event()
+
+    loader = asyncio.create_task(cache.get("a1"))
+    await asyncio.sleep(0)
+    waiter = asyncio.create_task(cache.get("a1"))
+    await asyncio.sleep(0)
+    waiter.cancel()
+    fetches["gate"].set()
+
+    assert await loader == {"id": "a1", "status": "draft"}
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+
+
+async def test_fetch_invalidated_midway_is_returned_but_not_kept(db, cache, fetches):
+    await db.agreements.insert_one({"id": "a1", "status": "draft"})
+    fetches["gate"] = asyncio.Event()
+
+    loader = asyncio.create_task(cache.get("a1"))
+    await asyncio.sleep(0)
+    await cache.invalidate("a1")
+    fetches["gate"].set()
+
+    assert await loader == {"id": "a1", "status": "draft"}
+    assert len(cache) == 0
@@ -0,0 +1,124 @@
+import json
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+HEADER = "landlord.name;tenant.email;property.address;rental_period.from_date;rental_period.to_date;payment.rent_amount;payment.payment_method"
+
+
+async def body(*lines):
+    for line in lines:
+        yield line.encode() if isinstance(line, str) else line
+
+
+async def collect(rows):
+    return [row async for row in rows]
+
+
+async def test_csv_columns_become_nested_fields():
+    rows = await collect(server.csv_rows(body(
+        "﻿" + HEADER,
+        "Erik;anna@example.se;Storgatan 1;2025-06-01;2025-06-30;12000;swish",
+    )))
+
+    assert rows == [(1, {
+        "landlord": {"name": "Erik"},
+        "tenant": {"email": "anna@example.se"},
+        "property": {"address": "Storgatan 1"},
+        "rental_period": {"from_date": "2025-06-01", "to_date": "2025-06-30"},
+        "payment": {"rent_amount": "12000", "payment_method": "swish"},
+    }, None)]
+
+
+async def test_csv_delimiter_is_detected_from_the_header():
+    rows = await collect(server.csv_rows(body("landlord.name,other.comments\r", 'Erik,"Nyckel; i brevlådan"\r')))
+
+    assert rows == [(1, {"landlord": {"name": "Erik"}, "other": {"comments": "Nyckel; i brevlådan"}}, None)]
+
+
+async def test_csv_quoted_fields_may_span_lines():
+    rows = await collect(server.csv_rows(body(
+        "landlord.name;other.special_terms",
+        'Erik;"Inga husdjur.',
+        'Ingen rökning, ""absolut"" inte."',
+        "Karin;",
+    )))
+
+    assert rows == [
+        (1, {"landlord": {"name": "Erik"}, "other": {"special_terms": 'Inga husdjur.\nIngen rökning, "absolut" inte.'}}, None),
+        (2, {"landlord": {"name": "Karin"}}, None),
+    ]
+
+
+async def test_csv_rows_with_the_wrong_column_count_are_reported():
+    rows = await collect(server.csv_rows(body("landlord.name;tenant.email", "", "Erik", "Karin;k@example.se")))
+
+    assert rows[0][0] == 1 and rows[0][1] is None
+    assert rows[0][2] == [{"field": None, "message": "Raden har 1 kolumner, rubrikraden 2"}]
+    assert rows[1] == (2, {"landlord": {"name": "Karin"}, "tenant": {"email": "k@example.se"}}, None)
+
+
+async def test_csv_unterminated_quote_aborts():
+    with pytest.raises(server.BulkImportAborted):
+        await collect(server.csv_rows(body("landlord.name;other.comments", 'Erik;"aldrig stängd')))
+
+
+async def test_csv_must_be_utf8():
+    with pytest.raises(server.BulkImportAborted):
+        await collect(server.csv_rows(body("landlord.name", "Åsa".encode("latin-1"))))
+
+
+async def test_ndjson_reports_invalid_lines_and_skips_blank_ones():
+    rows = await collect(server.ndjson_rows(body('{"landlord": {"name": "Erik"}}', "  ", "{inte json")))
+
+    assert rows[0] == (1, {"landlord": {"name": "Erik"}}, None)
+    assert rows[1][0] == 2 and rows[1][1] is None
+    assert rows[1][2][0]["message"].startswith("Ogiltig JSON")
+
+
+async def import_csv(*lines):
+    with await server.import_agreement_rows(server.csv_rows(body(*lines)), notify=False) as results:
+        return [json.loads(line) for line in results]
+
+
+async def test_import_reports_each_row_and_a_summary(db):
+    results = await import_csv(
+        HEADER,
+        "Erik;anna@example.se;Storgatan 1;2025-06-01;2025-06-30;12000;swish",
+        "Karin;;Lillgatan 2;2025-07-01;2025-07-31;inte ett tal;bank",
+    )
+
+    assert results[0]["row"] == 1 and results[0]["status"] == "created"
+    assert results[1]["row"] == 2 and results[1]["status"] == "error"
+    assert {error["field"] for error in results[1]["errors"]} == {"tenant", "payment.rent_amount"}
+    assert results[2] == {"summary": {"created": 1, "failed": 1}}
+    stored = await db.agreements.find_one({"id": results[0]["id"]})
+    assert stored["status"] == "pending_tenant_signature"
+
+
+async def test_results_beyond_the_memory_limit_spill_to_disk(db, monkeypatch):
+    monkeypatch.setattr(server, "BULK_IMPORT_RESULTS_MEMORY_BYTES", 200)
+    monkeypatch.setattr(server, "BULK_IMPORT_BATCH_SIZE", 2)
+    row = "Erik;anna@example.se;Storgatan 1;2025-06-01;2025-06-30;12000;swish"
+
+    with await server.import_agreement_rows(server.csv_rows(body(HEADER, *[row] * 5)), notify=False) as results:
+        assert results._rolled
+        lines = [json.loads(line) for line in results]
+
+    assert [line["row"] for line in lines[:-1]] == [1, 2, 3, 4, 5]
+    assert lines[-1] == {"summary": {"created": 5, "failed": 0}}
+
+
+async def test_rows_past_the_cap_abort_the_import(db, monkeypatch):
+    monkeypatch.setattr(server, "BULK_IMPORT_MAX_ROWS", 1)
+    row = "Erik;anna@example.se;Storgatan 1;2025-06-01;2025-06-30;12000;swish"
+
+    results = await import_csv(HEADER, row, row)
+
+    assert results[0]["status"] == "created"
+    assert results[1]["summary"]["created"] == 1
+    assert results[1]["summary"]["aborted"].startswith("Högst 1 rader per import")
+    assert await db.agreements.count_documents({}) == 1
@@ -0,0 +1,41 @@
+import pytest
+from fastapi import HTTPException
+
+import server
+
+LENGTH = 100
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-9", (0, 9)),
+    ("bytes=90-", (90, 99)),
+    ("bytes=95-500", (95, 99)),
+    ("bytes=-10", (90, 99)),
+    ("bytes=-500", (0, 99)),
+    ("bytes=99-99", (99, 99)),
+])
+def test_satisfiable_ranges(header, expected):
+    assert server.parse_byte_range(header, LENGTH) == expected
+
+
+@pytest.mark.parametrize("header", [
+    None,
+    "",
+    "bytes=5-2",       # reversed
+    "bytes=0-1,5-9",   # several ranges
+    "bytes=-",
+    "bytes=a-b",
+    "bytes=--3",
+    "items=0-9",
+])
+def test_ignored_headers_send_the_whole_file(header):
+    assert server.parse_byte_range(header, LENGTH) is None
+
+
+@pytest.mark.parametrize("header", ["bytes=100-", "bytes=200-300", "bytes=-0"])
+def test_unsatisfiable_ranges_answer_416(header):
+    with pytest.raises(HTTPException) as refused:
+        server.parse_byte_range(header, LENGTH)
+
+    assert refused.value.status_code == 416
+    assert refused.value.headers["Content-Range"] == f"bytes */{LENGTH}"
@@ -0,0 +1,96 @@
+from datetime import datetime
+
+import httpx
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+CREATED = datetime(2025, 3, 1, 12, 0)
+
+
+@pytest.fixture
+async def api(db, monkeypatch):
+    monkeypatch.setattr(server, "agreement_cache", server.AgreementCache(ttl=60, max_entries=100))
+    await db.agreements.insert_one({
+        "id": "a1", "status": "pending_tenant_signature", "tenant": {"email": "anna@example.se"},
+        "created_at": CREATED, "updated_at": CREATED, "content_updated_at": CREATED,
+    })
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url="http://test") as client:
+        yield client
+
+
+async def sign(db):
+    """A status-only write, like a signature"""
+    await db.agreements.update_one({"id": "a1"}, {"$set": {
+        "status": "pending_landlord_signature", "updated_at": datetime(2025, 3, 1, 13, 0),
+        "tenant_signed_at": datetime(2025, 3, 1, 13, 0),
+    }})
+    await server.agreement_cache.invalidate("a1")
+
+
+async def test_full_read_hides_internal_fields_and_carries_an_etag(api):
+    response = await api.get("/api/agreements/a1")
+
+    assert response.status_code == 200
+    assert response.json()["tenant"] == {"email": "anna@example.se"}
+    assert "content_updated_at" not in response.json()
+    assert response.headers["etag"].startswith('"')
+    assert response.headers["cache-control"] == "private, no-cache"
+
+
+async def test_unchanged_agreement_answers_304(api):
+    etag = (await api.get("/api/agreements/a1")).headers["etag"]
+
+    for if_none_match in (etag, f"W/{etag}", f'"other", {etag}', "*"):
+        response = await api.get("/api/agreements/a1", headers={"If-None-Match": if_none_match})
+        assert response.status_code == 304, if_none_match
+        assert response.content == b""
+        assert response.headers["etag"] == etag
+
+
+async def test_any_write_changes_the_etag(api, db):
+    etag = (await api.get("/api/agreements/a1")).headers["etag"]
+    await sign(db)
+
+    response = await api.get("/api/agreements/a1", headers={"If-None-Match": etag})
+
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+
+
+async def test_fields_selects_top_level_fields(api):
+    full = await api.get("/api/agreements/a1")
+    response = await api.get("/api/agreements/a1", params={"fields": "status, updated_at"})
+
+    assert response.json() == {"id": "a1", "status": "pending_tenant_signature", "updated_at": "2025-03-01T12:00:00+00:00"}
+    assert response.headers["etag"] != full.headers["etag"]
+    assert (await api.get("/api/agreements/a1", params={"fields": "status,secret"})).status_code == 400
+
+
+async def test_since_returns_only_status_progress_when_content_is_unchanged(api, db):
+    await sign(db)
+
+    response = await api.get("/api/agreements/a1", params={"since": "2025-03-01T12:00:00+00:00"})
+
+    body = response.json()
+    assert body["delta"] is True
+    assert body["status"] == "pending_landlord_signature"
+    assert body["tenant_signed_at"] == "2025-03-01T13:00:00+00:00"
+    assert set(body) == set(server.AGREEMENT_PROGRESS_FIELDS) | {"delta"}
+
+
+async def test_since_returns_everything_after_a_content_change(api):
+    await server.update_agreement_in_status(
+        "a1", server.AgreementStatus.PENDING_TENANT_SIGNATURE, {"tenant.name": "Anna"}, content_changed=True,
+    )
+
+    response = await api.get("/api/agreements/a1", params={"since": "2025-03-01T12:00:00+00:00"})
+
+    assert "delta" not in response.json()
+    assert response.json()["tenant"]["name"] == "Anna"
+
+
+async def test_invalid_since_is_refused(api):
+    assert (await api.get("/api/agreements/a1", params={"since": "igår"})).status_code == 400
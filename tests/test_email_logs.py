@@ -0,0 +1,32 @@
+from datetime import datetime, timezone
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_email_logs_leave_out_the_delivery_lease(db):
+    now = datetime.now(timezone.utc)
+    await db.email_logs.insert_one({
+        "id": "m1", "agreement_id": "a1", "to": "t@x.se", "subject": "Hej", "body": "...",
+        "status": "queued", "attempts": 0, "queued_at": now, "lease_until": now,
+    })
+
+    logs = await server.get_agreement_emails("a1", include_body=True)
+
+    assert logs[0]["id"] == "m1"
+    assert "body" in logs[0]
+    assert "lease_until" not in logs[0]
+
+
+async def test_turning_retention_off_drops_the_ttl_index(db, monkeypatch):
+    await server.ensure_email_log_retention()
+    assert "queued_at_ttl" in await db.email_logs.index_information()
+
+    monkeypatch.setattr(server, "EMAIL_LOG_RETENTION_DAYS", 0)
+    await server.ensure_email_log_retention()
+    assert "queued_at_ttl" not in await db.email_logs.index_information()
+    # Nothing left to drop on the next start
+    await server.ensure_email_log_retention()
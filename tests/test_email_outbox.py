@@ -0,0 +1,121 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+class FlakyTransport:
+    """Fails the first `failures` sends, then delivers"""
+    delivered_status = "sent"
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.sent = []
+
+    async def send(self, message):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("SMTP unavailable")
+        self.sent.append(message["to"])
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(server, "OUTBOX_RETRY_BASE_DELAY", 0)
+    monkeypatch.setattr(server, "OUTBOX_FLUSH_INTERVAL", 0.01)
+
+
+@pytest.fixture
+async def indexed_db(db):
+    await db.email_logs.create_index("id", unique=True)
+    return db
+
+
+async def logs(db):
+    return await db.email_logs.find({}, {"_id": 0}).sort("to", 1).to_list(None)
+
+
+async def test_queued_mail_is_stored_and_delivered(indexed_db):
+    transport = FlakyTransport()
+    outbox = server.EmailOutbox(transport)
+    outbox.enqueue("a@example.se", "Hej", "Text", "a1")
+    outbox.enqueue("b@example.se", "Hej", "Text")
+
+    await outbox.drain()
+
+    assert transport.sent == ["a@example.se", "b@example.se"]
+    stored = await logs(indexed_db)
+    assert [(log["to"], log["status"], log["attempts"]) for log in stored] == [
+        ("a@example.se", "sent", 1), ("b@example.se", "sent", 1),
+    ]
+    assert stored[0]["agreement_id"] == "a1"
+    assert outbox.queued == 0
+
+
+async def test_failed_sends_are_retried(indexed_db):
+    outbox = server.EmailOutbox(FlakyTransport(failures=2))
+    outbox.enqueue("a@example.se", "Hej", "Text")
+
+    await outbox.drain()
+
+    [log] = await logs(indexed_db)
+    assert (log["status"], log["attempts"]) == ("sent", 3)
+
+
+async def test_delivery_gives_up_after_the_last_attempt(indexed_db, monkeypatch):
+    monkeypatch.setattr(server, "OUTBOX_MAX_ATTEMPTS", 2)
+    outbox = server.EmailOutbox(FlakyTransport(failures=5))
+    outbox.enqueue("a@example.se", "Hej", "Text")
+
+    await outbox.drain()
+
+    [log] = await logs(indexed_db)
+    assert (log["status"], log["attempts"], log["last_error"]) == ("failed", 2, "SMTP unavailable")
+
+
+async def test_worker_delivers_in_the_background(indexed_db):
+    transport = FlakyTransport()
+    outbox = server.EmailOutbox(transport)
+    worker = asyncio.create_task(outbox.run())
+    try:
+        for n in range(3):
+            outbox.enqueue(f"{n}@example.se", "Hej", "Text")
+        for _ in range(100):
+            if await indexed_db.email_logs.count_documents({"status": "sent"}) == 3:
+                break
+            await asyncio.sleep(0.01)
+    finally:
+        worker.cancel()
+
+    assert sorted(transport.sent) == ["0@example.se", "1@example.se", "2@example.se"]
+
+
+async def test_recovery_redelivers_only_mail_whose_lease_ran_out(indexed_db):
+    now = datetime.now(timezone.utc)
+    await indexed_db.email_logs.insert_many([
+        {"id": "m1", "to": "dead@example.se", "status": "queued", "attempts": 0, "lease_until": now - timedelta(seconds=1)},
+        {"id": "m2", "to": "busy@example.se", "status": "queued", "attempts": 0, "lease_until": now + timedelta(minutes=5)},
+        {"id": "m3", "to": "old@example.se", "status": "queued", "attempts": 0},
+    ])
+    transport = FlakyTransport()
+
+    assert await server.EmailOutbox(transport).recover() == 2
+
+    assert sorted(transport.sent) == ["dead@example.se", "old@example.se"]
+    statuses = {log["id"]: log["status"] for log in await logs(indexed_db)}
+    assert statuses == {"m1": "sent", "m2": "queued", "m3": "sent"}
+
+
+async def test_persisting_a_batch_again_keeps_the_stored_rows(indexed_db):
+    outbox = server.EmailOutbox(FlakyTransport())
+    outbox.enqueue("a@example.se", "Hej", "Text")
+    message = outbox._queue.get_nowait()
+
+    await outbox._persist([message])
+    await outbox._persist([message])
+
+    assert await indexed_db.email_logs.count_documents({}) == 1
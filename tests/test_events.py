@@ -0,0 +1,109 @@
+import asyncio
+import json
+
+import pytest
+from fastapi import HTTPException, Request
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+def request(disconnected=False):
+    async def receive():
+        if disconnected:
+            return {"type": "http.disconnect"}
+        await asyncio.Event().wait()
+
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": [], "query_string": b""}, receive)
+
+
+def parse(chunk):
+    assert chunk.startswith("data: ") and chunk.endswith("\n\n")
+    return json.loads(chunk[len("data: "):])
+
+
+@pytest.fixture
+async def agreement(db):
+    await db.agreements.insert_one({"id": "a1", "status": "pending_tenant_signature"})
+    await db.bankid_sessions.insert_many([
+        {"order_ref": "o1", "agreement_id": "a1", "status": "failed", "created_at": 1},
+        {"order_ref": "o2", "agreement_id": "a1", "status": "pending", "created_at": 2},
+    ])
+
+
+async def test_stream_starts_with_the_agreement_and_its_sessions(agreement):
+    response = await server.stream_agreement_events("a1", request())
+    stream = response.body_iterator
+    try:
+        assert parse(await anext(stream)) == {"type": "agreement", "status": "pending_tenant_signature", "updated_at": None}
+        assert parse(await anext(stream)) == {"type": "bankid", "order_ref": "o2", "status": "pending"}
+        assert parse(await anext(stream)) == {"type": "bankid", "order_ref": "o1", "status": "failed"}
+    finally:
+        await stream.aclose()
+    assert response.media_type == "text/event-stream"
+
+
+async def test_published_events_reach_subscribers_of_that_agreement(agreement, db):
+    await db.agreements.insert_one({"id": "a2", "status": "draft"})
+    response = await server.stream_agreement_events("a1", request())
+    stream = response.body_iterator
+    try:
+        for _ in range(3):
+            await anext(stream)
+        server.event_bus.publish("a2", {"type": "agreement", "status": "cancelled"})
+        await server.finish_session(db.bankid_sessions, "bankid", "order_ref", "o2", "a1", "complete", {})
+
+        assert parse(await anext(stream)) == {"type": "bankid", "order_ref": "o2", "status": "complete"}
+    finally:
+        await stream.aclose()
+
+
+async def test_closing_the_stream_unsubscribes(agreement):
+    response = await server.stream_agreement_events("a1", request())
+    await anext(response.body_iterator)
+    assert server.event_bus._subscribers["a1"]
+
+    await response.body_iterator.aclose()
+
+    assert "a1" not in server.event_bus._subscribers
+
+
+async def test_heartbeat_notices_a_disconnected_client(agreement, monkeypatch):
+    monkeypatch.setattr(server, "SSE_HEARTBEAT_SECONDS", 0.01)
+    response = await server.stream_agreement_events("a1", request(disconnected=True))
+
+    chunks = [chunk async for chunk in response.body_iterator]
+
+    assert len(chunks) == 3
+    assert "a1" not in server.event_bus._subscribers
+
+
+async def test_unknown_agreement_is_404_and_leaves_no_subscriber(db):
+    with pytest.raises(HTTPException) as refused:
+        await server.stream_agreement_events("nope", request())
+
+    assert refused.value.status_code == 404
+    assert "nope" not in server.event_bus._subscribers
+
+
+async def test_slow_subscribers_lose_their_oldest_events(monkeypatch):
+    monkeypatch.setattr(server, "SUBSCRIBER_QUEUE_SIZE", 2)
+    bus = server.EventBus()
+    queue = bus.subscribe("a1")
+
+    for status in ("one", "two", "three"):
+        bus.publish("a1", {"status": status})
+
+    assert [queue.get_nowait()["status"] for _ in range(queue.qsize())] == ["two", "three"]
+
+
+async def test_snapshot_keeps_the_latest_sessions_per_kind(db, monkeypatch):
+    monkeypatch.setattr(server, "SNAPSHOT_SESSIONS", 2)
+    await db.swish_sessions.insert_many([
+        {"payment_ref": f"p{n}", "agreement_id": "a1", "status": "failed", "created_at": n} for n in range(4)
+    ])
+
+    events = await server.session_snapshot("a1")
+
+    assert [event["payment_ref"] for event in events] == ["p3", "p2"]
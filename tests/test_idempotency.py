@@ -0,0 +1,120 @@
+import pytest
+from fastapi import HTTPException, Request, Response
+from pydantic import BaseModel
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+class Payload(BaseModel):
+    amount: int
+
+
+def post(key=None, path="/api/agreements/a1/swish/start"):
+    headers = [(b"idempotency-key", key.encode())] if key is not None else []
+    return Request({
+        "type": "http", "method": "POST", "path": path, "root_path": "", "query_string": b"",
+        "headers": headers, "scheme": "http", "server": ("testserver", 80),
+    })
+
+
+@pytest.fixture
+async def indexed_db(db):
+    await server.ensure_indexes()
+    return db
+
+
+def counting_handler(result=None, error=None):
+    calls = []
+
+    async def handler():
+        calls.append(1)
+        if error is not None:
+            raise error
+        return result or {"payment_ref": f"swish-{len(calls)}"}
+
+    handler.calls = calls
+    return handler
+
+
+async def test_retry_with_same_key_replays_the_stored_response(indexed_db):
+    handler = counting_handler()
+    first = await server.idempotent(post("k1"), Response(), Payload(amount=100), handler)
+    replay_response = Response()
+    replay = await server.idempotent(post("k1"), replay_response, Payload(amount=100), handler)
+
+    assert replay == first == {"payment_ref": "swish-1"}
+    assert len(handler.calls) == 1
+    assert replay_response.headers["Idempotent-Replayed"] == "true"
+
+
+async def test_same_key_with_another_body_is_rejected(indexed_db):
+    handler = counting_handler()
+    await server.idempotent(post("k1"), Response(), Payload(amount=100), handler)
+
+    with pytest.raises(HTTPException) as refused:
+        await server.idempotent(post("k1"), Response(), Payload(amount=200), handler)
+
+    assert refused.value.status_code == 422
+    assert len(handler.calls) == 1
+
+
+async def test_same_key_on_another_path_is_a_new_request(indexed_db):
+    handler = counting_handler()
+    await server.idempotent(post("k1"), Response(), Payload(amount=100), handler)
+    await server.idempotent(post("k1", path="/api/agreements/a2/swish/start"), Response(), Payload(amount=100), handler)
+
+    assert len(handler.calls) == 2
+
+
+async def test_failed_request_releases_its_key(indexed_db):
+    failing = counting_handler(error=HTTPException(status_code=503, detail="Swish är inte tillgängligt"))
+    with pytest.raises(HTTPException):
+        await server.idempotent(post("k1"), Response(), Payload(amount=100), failing)
+
+    handler = counting_handler()
+    result = await server.idempotent(post("k1"), Response(), Payload(amount=100), handler)
+
+    assert result == {"payment_ref": "swish-1"}
+
+
+async def test_request_still_running_answers_409(indexed_db):
+    await server.claim_idempotency_key("k1", "/api/agreements/a1/swish/start",
+                                       server.request_fingerprint(post("k1"), Payload(amount=100)))
+
+    with pytest.raises(HTTPException) as refused:
+        await server.idempotent(post("k1"), Response(), Payload(amount=100), counting_handler())
+
+    assert refused.value.status_code == 409
+
+
+async def test_requests_without_a_key_always_run(indexed_db):
+    handler = counting_handler()
+    await server.idempotent(post(), Response(), Payload(amount=100), handler)
+    await server.idempotent(post(), Response(), Payload(amount=100), handler)
+
+    assert len(handler.calls) == 2
+
+
+async def test_key_released_while_claiming_is_claimed_again(indexed_db, monkeypatch):
+    path = "/api/agreements/a1/swish/start"
+    fingerprint = server.request_fingerprint(post("k1"), Payload(amount=100))
+    await server.claim_idempotency_key("k1", path, fingerprint)
+    collection_type = type(indexed_db.idempotency_keys)
+    find_one = collection_type.find_one
+
+    async def released_first(self, *args, **kwargs):
+        # The first request fails between our insert and this read
+        monkeypatch.setattr(collection_type, "find_one", find_one)
+        await indexed_db.idempotency_keys.delete_one({"key": "k1", "path": path})
+        return await find_one(self, *args, **kwargs)
+
+    monkeypatch.setattr(collection_type, "find_one", released_first)
+    handler = counting_handler()
+    result = await server.idempotent(post("k1"), Response(), Payload(amount=100), handler)
+
+    assert result == {"payment_ref": "swish-1"}
+    stored = await indexed_db.idempotency_keys.find_one({"key": "k1", "path": path})
+    assert stored["status"] == "done"
+    assert stored["response"] == result
@@ -0,0 +1,68 @@
+import asyncio
+from contextlib import contextmanager
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture(autouse=True)
+def fast_leases(monkeypatch):
+    monkeypatch.setattr(server, "LEADER_LEASE_SECONDS", 0.3)
+    monkeypatch.setattr(server, "LEADER_RESTART_SECONDS", 0.05)
+
+
+@contextmanager
+def worker(worker_id):
+    """Act as another process sharing the database"""
+    original = server.WORKER_ID
+    server.WORKER_ID = worker_id
+    try:
+        yield
+    finally:
+        server.WORKER_ID = original
+
+
+async def test_lease_held_by_one_worker_until_it_expires(db):
+    with worker("a"):
+        assert await server.acquire_lease("sweeper", 0.2)
+    with worker("b"):
+        assert not await server.acquire_lease("sweeper", 0.2)
+    with worker("a"):
+        assert await server.acquire_lease("sweeper", 0.2)
+    await asyncio.sleep(0.25)
+    with worker("b"):
+        assert await server.acquire_lease("sweeper", 0.2)
+    with worker("a"):
+        assert not await server.acquire_lease("sweeper", 0.2)
+
+
+async def test_one_shot_job_is_not_rerun_by_other_workers(db):
+    runs = []
+
+    async def job():
+        runs.append(server.WORKER_ID)
+
+    with worker("a"):
+        await asyncio.wait_for(server.run_as_leader("backfill", job), 2)
+    with worker("b"):
+        await asyncio.wait_for(server.run_as_leader("backfill", job), 2)
+
+    assert runs == ["a"]
+    assert await server.lease_done("backfill")
+
+
+async def test_failing_job_is_restarted(db):
+    attempts = []
+
+    async def job():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise RuntimeError("boom")
+
+    await asyncio.wait_for(server.run_as_leader("flaky", job), 3)
+
+    assert len(attempts) == 3
+    assert await server.lease_done("flaky")
@@ -0,0 +1,110 @@
+import logging
+
+import httpx
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    """Metrics created in a test register here instead of in the app's list"""
+    metrics = []
+    monkeypatch.setattr(server, "registered_metrics", metrics)
+    return metrics
+
+
+@pytest.fixture
+async def api(db):
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url="http://test") as client:
+        yield client
+
+
+def test_counter_and_gauge_samples(registry):
+    lookups = server.Counter("lookups_total", "Lookups", ("result",))
+    server.Gauge("queue_size", "Queued items", lambda: 3)
+    lookups.inc("hit")
+    lookups.inc("hit")
+    lookups.inc('mi"ss\n', amount=0.5)
+
+    assert server.render_metrics().splitlines() == [
+        "# HELP lookups_total Lookups",
+        "# TYPE lookups_total counter",
+        'lookups_total{result="hit"} 2',
+        'lookups_total{result="mi\\"ss\\n"} 0.5',
+        "# HELP queue_size Queued items",
+        "# TYPE queue_size gauge",
+        "queue_size 3",
+    ]
+
+
+def test_histogram_buckets_are_cumulative(registry):
+    latency = server.Histogram("latency_seconds", "Latency", ("route",), buckets=(0.1, 1))
+    for seconds in (0.05, 0.1, 0.5, 3):
+        latency.observe(seconds, "/a")
+
+    assert list(latency.samples()) == [
+        'latency_seconds_bucket{route="/a",le="0.1"} 2',
+        'latency_seconds_bucket{route="/a",le="1"} 3',
+        'latency_seconds_bucket{route="/a",le="+Inf"} 4',
+        'latency_seconds_sum{route="/a"} 3.65',
+        'latency_seconds_count{route="/a"} 4',
+    ]
+
+
+def request_count(metrics_text, method, route, status):
+    prefix = f'http_request_duration_seconds_count{{method="{method}",route="{route}",status="{status}"}} '
+    for line in metrics_text.splitlines():
+        if line.startswith(prefix):
+            return int(line[len(prefix):])
+    return 0
+
+
+async def test_requests_are_timed_by_route_template(api):
+    before = (await api.get("/api/metrics")).text
+
+    await api.get("/api/agreements/a1")
+    await api.get("/api/agreements/a2")
+    await api.get("/api/no-such-route")
+
+    after = (await api.get("/api/metrics")).text
+    route = "/api/agreements/{agreement_id}"
+    assert request_count(after, "GET", route, 404) - request_count(before, "GET", route, 404) == 2
+    assert request_count(after, "GET", "unmatched", 404) - request_count(before, "GET", "unmatched", 404) == 1
+    assert "/api/agreements/a1" not in after
+
+
+async def test_metrics_are_served_as_prometheus_text(api):
+    response = await api.get("/api/metrics")
+
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert "# TYPE http_request_duration_seconds histogram" in response.text
+
+
+async def test_slow_requests_are_logged_with_their_template(api, monkeypatch, caplog):
+    monkeypatch.setattr(server, "SLOW_REQUEST_SECONDS", 0)
+
+    with caplog.at_level(logging.WARNING, logger="server"):
+        await api.get("/api/agreements/a1")
+
+    [record] = [record for record in caplog.records if record.getMessage().startswith("Slow request")]
+    assert "GET /api/agreements/a1 (/api/agreements/{agreement_id}) -> 404" in record.getMessage()
+    assert "other" in record.getMessage()
+
+
+async def test_event_streams_are_left_out_of_the_latency_histogram(registry, monkeypatch):
+    histogram = server.Histogram("http_request_duration_seconds", "Latency", ("method", "route", "status"))
+    monkeypatch.setattr(server, "http_request_duration", histogram)
+
+    async def stream(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"text/event-stream")]})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def send(message):
+        pass
+
+    await server.RequestMetricsMiddleware(stream)({"type": "http", "method": "GET", "path": "/"}, None, send)
+
+    assert list(histogram.samples()) == []
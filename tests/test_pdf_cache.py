@@ -0,0 +1,53 @@
+import os
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+def cache(directory, disk_bytes=1000):
+    return server.PdfCache(directory, memory_bytes=0, disk_bytes=disk_bytes)
+
+
+async def test_disk_tier_evicts_least_recently_used(tmp_path):
+    pdf_cache = cache(tmp_path)
+    await pdf_cache.load()
+    for key in ("a", "b", "c"):
+        await pdf_cache.put(key, b"x" * 300)
+    assert await pdf_cache.get("a") is not None  # now the most recent
+
+    await pdf_cache.put("d", b"x" * 300)
+
+    assert sorted(path.stem for path in tmp_path.glob("*.pdf")) == ["a", "c", "d"]
+    assert pdf_cache._disk_size == 900
+
+
+async def test_load_seeds_the_index_from_the_directory(tmp_path):
+    for age, key in enumerate(("new", "old")):
+        path = tmp_path / f"{key}.pdf"
+        path.write_bytes(b"x" * 400)
+        os.utime(path, (1000 - age, 1000 - age))
+
+    pdf_cache = cache(tmp_path)
+    await pdf_cache.load()
+    assert pdf_cache._disk_size == 800
+
+    await pdf_cache.put("next", b"x" * 400)
+    assert sorted(path.stem for path in tmp_path.glob("*.pdf")) == ["new", "next"]
+
+
+async def test_files_of_other_workers_count_once_over_the_limit(tmp_path):
+    pdf_cache = cache(tmp_path)
+    await pdf_cache.load()
+    await pdf_cache.put("mine", b"x" * 500)
+    # Written by another worker sharing the directory, unknown to this index
+    other = tmp_path / "theirs.pdf"
+    other.write_bytes(b"x" * 500)
+    os.utime(other, (1, 1))
+
+    await pdf_cache.put("later", b"x" * 600)
+
+    assert sorted(path.stem for path in tmp_path.glob("*.pdf")) == ["later"]
+    assert pdf_cache._disk_size == 600
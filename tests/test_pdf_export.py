@@ -0,0 +1,86 @@
+import io
+import zipfile
+from datetime import datetime, timezone
+
+import pytest
+from fastapi import HTTPException
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def agreements(db):
+    await db.agreements.insert_many([
+        {"id": f"a{n}", "status": status, "created_at": datetime(2025, 1, n + 1, tzinfo=timezone.utc)}
+        for n, status in enumerate(["pending_payment", "pending_payment", "draft", "cancelled"])
+    ])
+
+
+@pytest.fixture
+def renders(monkeypatch):
+    """Fake PDFs; agreements listed in `failing` fail to render"""
+    failing = set()
+
+    async def render(agreement, key=None):
+        if agreement["id"] in failing:
+            raise RuntimeError("render failed")
+        return f"%PDF {agreement['id']}".encode()
+
+    monkeypatch.setattr(server, "get_or_render_pdf", render)
+    return failing
+
+
+async def export(**request):
+    response = await server.export_agreements(server.AgreementExportRequest(**request))
+    body = b"".join([chunk async for chunk in response.body_iterator])
+    return response, zipfile.ZipFile(io.BytesIO(body))
+
+
+async def test_export_streams_a_zip_of_the_selected_agreements(agreements, renders):
+    response, archive = await export(status=server.AgreementStatus.PENDING_PAYMENT)
+
+    assert response.media_type == "application/zip"
+    assert response.headers["content-disposition"].startswith("attachment; filename=hyresavtal-")
+    assert sorted(archive.namelist()) == ["hyresavtal-a0.pdf", "hyresavtal-a1.pdf"]
+    assert archive.read("hyresavtal-a1.pdf") == b"%PDF a1"
+    assert archive.testzip() is None
+
+
+async def test_export_by_date_range(agreements, renders):
+    _, archive = await export(created_from="2025-01-02T00:00:00+00:00", created_to="2025-01-04T00:00:00+00:00")
+
+    assert sorted(archive.namelist()) == ["hyresavtal-a1.pdf", "hyresavtal-a2.pdf"]
+
+
+async def test_failed_and_missing_agreements_are_listed_in_the_archive(agreements, renders):
+    renders.add("a1")
+
+    _, archive = await export(ids=["a0", "a1", "nope"])
+
+    assert archive.namelist()[:-1] == ["hyresavtal-a0.pdf"]
+    errors = archive.read("fel.txt").decode().splitlines()
+    assert errors == ["a1: render failed", "nope: hittades inte"]
+
+
+async def test_selection_over_the_limit_is_refused_up_front(agreements, renders, monkeypatch):
+    monkeypatch.setattr(server, "EXPORT_MAX_AGREEMENTS", 3)
+
+    with pytest.raises(HTTPException) as refused:
+        await server.export_agreements(server.AgreementExportRequest())
+    assert refused.value.status_code == 400
+    assert refused.value.detail.startswith("Urvalet omfattar fler än 3 avtal")
+
+    with pytest.raises(HTTPException):
+        await server.export_agreements(server.AgreementExportRequest(ids=["a0", "a1", "a2", "a3"]))
+
+    _, archive = await export(status=server.AgreementStatus.PENDING_PAYMENT)
+    assert len(archive.namelist()) == 2
+
+
+async def test_invalid_dates_are_refused(agreements):
+    with pytest.raises(HTTPException) as refused:
+        await server.export_agreements(server.AgreementExportRequest(created_from="igår"))
+
+    assert refused.value.status_code == 400
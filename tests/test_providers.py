@@ -0,0 +1,74 @@
+import asyncio
+
+import httpx
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def provider(monkeypatch):
+    """A BankID provider whose HTTP answers come from the test's handler"""
+    responses = []
+
+    async def handler(request):
+        answer = responses.pop(0)
+        if callable(answer):
+            return await answer(request)
+        return answer
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(server, "provider_http", client)
+    bankid = server.HttpBankIDProvider("http://bankid.test")
+    bankid.breaker = server.CircuitBreaker("bankid_test", failure_threshold=1, reset_seconds=0)
+    bankid.responses = responses
+    yield bankid
+
+
+async def test_unmapped_client_error_is_unavailable(provider):
+    provider.responses.append(httpx.Response(401, text="no client certificate"))
+    with pytest.raises(server.ProviderUnavailable):
+        await provider.start({"personnummer": "190001011234"})
+
+
+async def test_non_json_answer_is_unavailable(provider):
+    provider.responses.append(httpx.Response(200, text="<html>maintenance</html>"))
+    with pytest.raises(server.ProviderUnavailable):
+        await provider.collect("order", {})
+
+
+async def test_answer_without_required_field_is_unavailable(provider):
+    provider.responses.append(httpx.Response(200, json={"hintCode": "started"}))
+    with pytest.raises(server.ProviderUnavailable):
+        await provider.collect("order", {})
+
+
+async def test_rejected_request_without_json_keeps_its_status(provider):
+    provider.responses.append(httpx.Response(400, text="bad request"))
+    result = await provider.collect("order", {})
+    assert result.status == "failed"
+    assert result.hint is None
+
+
+async def test_cancelled_trial_call_lets_the_next_call_try(provider):
+    provider.responses.append(httpx.Response(503))
+    with pytest.raises(server.ProviderUnavailable):
+        await provider.collect("order", {})
+    assert provider.breaker.opened_at is not None
+
+    async def hang(request):
+        await asyncio.sleep(10)
+
+    provider.responses.append(hang)
+    trial = asyncio.create_task(provider.collect("order", {}))
+    await asyncio.sleep(0.01)
+    trial.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await trial
+
+    provider.responses.append(httpx.Response(200, json={"status": "complete"}))
+    result = await provider.collect("order", {})
+    assert result.status == "complete"
+    assert provider.breaker.opened_at is None
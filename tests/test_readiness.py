@@ -0,0 +1,65 @@
+import pytest
+from fastapi import Response
+from mongomock_motor import AsyncMongoMockClient
+from motor.motor_asyncio import AsyncIOMotorClient
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    """An unconnected client, for the pool figures the probes report"""
+    client = AsyncIOMotorClient("mongodb://127.0.0.1:9", maxPoolSize=20, serverSelectionTimeoutMS=100)
+    monkeypatch.setattr(server, "client", client)
+    monkeypatch.setattr(server, "database_state", {"indexes_ready": True})
+    yield client
+    client.close()
+
+
+async def test_ready_reports_ping_and_pool(db, pool):
+    response = Response()
+    body = await server.ready(response)
+
+    assert response.status_code == 200
+    assert body["status"] == "ready"
+    assert body["mongo_ping_ms"] >= 0
+    assert body["mongo_pool"]["max_size"] == 20
+
+
+async def test_not_ready_until_indexes_exist(db, pool):
+    server.database_state["indexes_ready"] = False
+    response = Response()
+
+    body = await server.ready(response)
+
+    assert response.status_code == 503
+    assert body["status"] == "unavailable"
+
+
+async def test_not_ready_when_the_database_does_not_answer(pool, monkeypatch):
+    monkeypatch.setattr(server, "db", pool["test"])
+    response = Response()
+
+    body = await server.ready(response)
+
+    assert response.status_code == 503
+    assert body["mongo_ping_ms"] is None
+
+
+async def test_lifespan_indexes_the_database_and_closes_the_client(monkeypatch):
+    stand_in = AsyncMongoMockClient()
+    monkeypatch.setattr(server, "client", stand_in)
+    monkeypatch.setattr(server, "db", stand_in["test"])
+    monkeypatch.setattr(server, "database_state", {"indexes_ready": False})
+    db = server.db
+
+    async with server.lifespan(server.app):
+        assert server.database_state["indexes_ready"]
+        assert "id_1" in await db.agreements.index_information()
+        assert server.background_tasks
+
+    assert server.client is None and server.db is None
+    assert not server.database_state["indexes_ready"]
+    assert not server.background_tasks
@@ -0,0 +1,106 @@
+import csv
+import io
+import json
+from datetime import datetime
+
+import pytest
+from fastapi import HTTPException
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def agreements(db):
+    await db.agreements.insert_many([
+        {
+            "id": "a1", "status": "completed", "created_at": datetime(2025, 1, 1), "search_terms": ["er"],
+            "landlord": {"name": "Erik", "email": "erik@example.se"}, "payment": {"rent_amount": 12000},
+        },
+        {"id": "a2", "status": "draft", "created_at": datetime(2025, 1, 2), "landlord": {"name": 'Karin "K", AB'}},
+    ])
+
+
+async def body(response):
+    return b"".join([chunk async for chunk in response.body_iterator]).decode()
+
+
+async def export_agreements(**params):
+    params = {"export_format": "csv", "columns": None, "status": None, "created_from": None, "created_to": None, **params}
+    return await server.export_agreement_rows(**params)
+
+
+async def test_csv_export_flattens_groups_to_import_columns(agreements):
+    response = await export_agreements(columns="landlord,payment")
+    rows = list(csv.DictReader(io.StringIO(await body(response))))
+
+    assert response.media_type == "text/csv; charset=utf-8"
+    assert response.headers["content-disposition"].startswith("attachment; filename=hyresavtal-")
+    assert list(rows[0]) == server.agreement_export_columns(["landlord", "payment"])
+    assert rows[0]["id"] == "a1"
+    assert rows[0]["created_at"] == "2025-01-01T00:00:00+00:00"
+    assert rows[0]["landlord.email"] == "erik@example.se"
+    assert rows[0]["payment.rent_amount"] == "12000"
+    assert rows[1]["landlord.name"] == 'Karin "K", AB'
+    assert rows[1]["payment.rent_amount"] == ""
+
+
+async def test_csv_export_reads_back_through_the_import_parser(agreements):
+    text = await body(await export_agreements(columns="landlord"))
+
+    async def lines():
+        for line in text.splitlines():
+            yield line.encode()
+
+    rows = [row async for row in server.csv_rows(lines())]
+
+    assert rows[1][1]["landlord"] == {"name": 'Karin "K", AB'}
+
+
+async def test_ndjson_export_keeps_groups_nested(agreements):
+    response = await export_agreements(export_format="ndjson", status=server.AgreementStatus.COMPLETED)
+    rows = [json.loads(line) for line in (await body(response)).splitlines()]
+
+    assert response.media_type == "application/x-ndjson"
+    assert rows == [{
+        "id": "a1", "status": "completed", "created_at": "2025-01-01T00:00:00+00:00",
+        "landlord": {"name": "Erik", "email": "erik@example.se"}, "payment": {"rent_amount": 12000},
+    }]
+
+
+async def test_unknown_column_group_is_refused(agreements):
+    with pytest.raises(HTTPException) as refused:
+        await export_agreements(columns="landlord,secret")
+
+    assert refused.value.status_code == 400
+
+
+async def test_large_exports_are_sent_in_chunks(db, monkeypatch):
+    monkeypatch.setattr(server, "EXPORT_CHUNK_BYTES", 100)
+    await db.agreements.insert_many([{"id": f"a{n:03}", "status": "draft", "created_at": datetime(2025, 1, 1)} for n in range(20)])
+
+    response = await export_agreements(columns="landlord")
+    chunks = [chunk async for chunk in response.body_iterator]
+
+    assert len(chunks) > 5
+    assert len(b"".join(chunks).decode().splitlines()) == 21
+
+
+async def test_email_log_export_leaves_out_bodies_and_bookkeeping(db):
+    await db.email_logs.insert_one({
+        "id": "m1", "to": "a@example.se", "subject": "Hej", "body": "Text", "status": "sent",
+        "queued_at": datetime(2025, 1, 1), "lease_until": datetime(2025, 1, 1),
+    })
+
+    without_body = [json.loads(line) for line in (await body(await server.export_email_log_rows(
+        export_format="ndjson", status=None, agreement_id=None, include_body=False,
+    ))).splitlines()]
+    with_body = list(csv.DictReader(io.StringIO(await body(await server.export_email_log_rows(
+        export_format="csv", status=None, agreement_id=None, include_body=True,
+    )))))
+
+    assert without_body == [{"id": "m1", "to": "a@example.se", "subject": "Hej", "status": "sent",
+                             "queued_at": "2025-01-01T00:00:00+00:00"}]
+    assert with_body[0]["body"] == "Text"
+    assert "lease_until" not in with_body[0]
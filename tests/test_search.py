@@ -0,0 +1,96 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+START = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def add_agreement(db):
+    count = 0
+
+    async def add(landlord, tenant="", city="Stockholm", status="pending_tenant_signature"):
+        nonlocal count
+        count += 1
+        doc = {
+            "id": f"a{count}", "status": status, "created_at": START + timedelta(minutes=count),
+            "landlord": {"name": landlord}, "tenant": {"name": tenant}, "property": {"city": city},
+        }
+        doc.update(server.agreement_search_fields(doc))
+        await db.agreements.insert_one(doc)
+        return doc["id"]
+
+    return add
+
+
+async def search(q, **params):
+    params = {"status": None, "page": 1, "limit": server.AGREEMENTS_PAGE_SIZE, **params}
+    return await server.search_agreements(q=q, **params)
+
+
+def test_search_text_folds_case_and_diacritics():
+    assert server.search_tokens("Åsa Öberg-Ström, Malmö") == ["asa", "oberg", "strom", "malmo"]
+    assert server.search_tokens("a b") == []
+
+
+async def test_search_matches_without_diacritics_and_by_prefix(add_agreement):
+    astrom = await add_agreement("Erik Åström", city="Göteborg")
+    await add_agreement("Karin Berg")
+
+    for q in ("åström", "astrom", "ASTR", "erik ast", "gote"):
+        assert [item["id"] for item in (await search(q))["items"]] == [astrom], q
+
+
+async def test_every_word_must_match(add_agreement):
+    await add_agreement("Erik Berg")
+    both = await add_agreement("Erik Lund")
+
+    assert [item["id"] for item in (await search("erik lu"))["items"]] == [both]
+    assert (await search("erik nilsson"))["items"] == []
+
+
+async def test_whole_word_hits_rank_before_prefix_hits(add_agreement):
+    whole = await add_agreement("Anna Berg")
+    await add_agreement("Annika Berg")  # no match
+    prefix = await add_agreement("Annabelle Berg")  # newer, but only a prefix hit
+
+    ids = [item["id"] for item in (await search("anna"))["items"]]
+
+    assert ids == [whole, prefix]
+
+
+async def test_results_are_paged(add_agreement):
+    ids = [await add_agreement(f"Erik {n}") for n in range(5)]
+
+    first = await search("erik", limit=2)
+    last = await search("erik", limit=2, page=3)
+
+    assert [item["id"] for item in first["items"]] == ids[:-3:-1]
+    assert first["has_more"]
+    assert [item["id"] for item in last["items"]] == ids[:1]
+    assert not last["has_more"]
+
+
+async def test_status_filter(add_agreement):
+    await add_agreement("Erik Berg")
+    done = await add_agreement("Erik Lund", status="completed")
+
+    result = await search("erik", status=server.AgreementStatus.COMPLETED)
+
+    assert [item["id"] for item in result["items"]] == [done]
+
+
+async def test_more_matches_than_ranked_are_flagged(add_agreement, monkeypatch):
+    monkeypatch.setattr(server, "SEARCH_MAX_CANDIDATES", 2)
+    ids = [await add_agreement("Erik Berg") for _ in range(3)]
+
+    result = await search("erik")
+
+    assert [item["id"] for item in result["items"]] == ids[:0:-1]
+    assert not result["has_more"]
+    assert result["truncated"]
+    assert not (await search("erik", status=server.AgreementStatus.COMPLETED))["truncated"]
@@ -0,0 +1,60 @@
+from datetime import datetime, timezone
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+DAY = datetime(2025, 3, 1, 12, tzinfo=timezone.utc)
+
+
+async def insert_agreements(db, *statuses):
+    await db.agreements.insert_many([
+        {"id": f"a{n}", "status": status, "created_at": DAY,
+         "payment_completed_at": DAY if status == "completed" else None}
+        for n, status in enumerate(statuses)
+    ])
+
+
+async def test_reconcile_replaces_drifted_counters_and_stale_buckets(db):
+    await insert_agreements(db, "draft", "completed", "completed")
+    await db.stats.insert_many([
+        {"_id": server.STATS_COUNTERS_ID, "total": 99, "by_status": {"draft": 99}, "version": 7},
+        {"_id": "day:2025-03-01", "created": 1},
+        {"_id": "day:2024-01-01", "created": 5},
+    ])
+
+    counters = await server.reconcile_stats()
+
+    assert counters["total"] == 3
+    assert counters["by_status"] == {"draft": 1, "completed": 2}
+    assert counters["revenue"] == 2 * server.SERVICE_FEE_SEK
+    assert counters["version"] == 8
+    buckets = await db.stats.find({"_id": {"$gte": "day:", "$lt": "day;"}}).to_list(None)
+    assert buckets == [{"_id": "day:2025-03-01", "created": 3, "completed": 2, "revenue": 2 * server.SERVICE_FEE_SEK}]
+
+
+async def test_reconcile_recounts_when_totals_change_meanwhile(db, monkeypatch):
+    await insert_agreements(db, "draft")
+    collection_type = type(db.stats)
+    find_one = collection_type.find_one
+    reads = []
+
+    async def racing_find_one(collection, *args, **kwargs):
+        document = await find_one(collection, *args, **kwargs)
+        if collection.name == "stats" and not reads:
+            # Another worker counts a new agreement right after the version was read
+            await db.agreements.insert_one({"id": "late", "status": "draft", "created_at": DAY})
+            await server.record_created_stats([{"status": "draft", "created_at": DAY}])
+        reads.append(document)
+        return document
+
+    monkeypatch.setattr(collection_type, "find_one", racing_find_one)
+    counters = await server.reconcile_stats()
+
+    assert len(reads) == 2
+    assert counters["total"] == 2
+    stored = await db.stats.find_one({"_id": server.STATS_COUNTERS_ID})
+    assert stored["total"] == 2
+    assert stored["by_status"] == {"draft": 2}
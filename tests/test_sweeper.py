@@ -0,0 +1,85 @@
+from datetime import timedelta
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+def ago(**delta):
+    return server.utcnow() - timedelta(**delta)
+
+
+@pytest.fixture
+def fresh_cache(monkeypatch):
+    cache = server.AgreementCache(ttl=60, max_entries=100)
+    monkeypatch.setattr(server, "agreement_cache", cache)
+    return cache
+
+
+async def test_stale_pending_sessions_expire(db):
+    await db.bankid_sessions.insert_many([
+        {"order_ref": "old", "agreement_id": "a1", "status": "pending", "created_at": ago(minutes=20)},
+        {"order_ref": "new", "agreement_id": "a1", "status": "pending", "created_at": ago(minutes=5)},
+        {"order_ref": "done", "agreement_id": "a1", "status": "complete", "created_at": ago(minutes=20)},
+    ])
+    events = server.event_bus.subscribe("a1")
+    try:
+        report = await server.sweep()
+    finally:
+        server.event_bus.unsubscribe("a1", events)
+
+    assert report["bankid_sessions_expired"] == 1
+    statuses = {s["order_ref"]: (s["status"], s.get("hint")) async for s in db.bankid_sessions.find()}
+    assert statuses == {"old": ("failed", "expired"), "new": ("pending", None), "done": ("complete", None)}
+    assert events.get_nowait() == {"type": "bankid", "order_ref": "old", "status": "failed"}
+    assert events.empty()
+
+
+async def test_sessions_are_expired_in_batches(db, monkeypatch):
+    monkeypatch.setattr(server, "SWEEP_BATCH_SIZE", 2)
+    await db.swish_sessions.insert_many([
+        {"payment_ref": f"p{n}", "agreement_id": "a1", "status": "pending", "created_at": ago(hours=1)} for n in range(5)
+    ])
+
+    assert (await server.sweep())["swish_sessions_expired"] == 5
+    assert await db.swish_sessions.count_documents({"status": "pending"}) == 0
+
+
+async def test_abandoned_agreements_are_cancelled(db, fresh_cache):
+    await db.agreements.insert_many([
+        {"id": "draft", "status": "draft", "updated_at": ago(days=40)},
+        {"id": "unsigned", "status": "pending_tenant_signature", "updated_at": ago(days=40)},
+        {"id": "recent", "status": "pending_tenant_signature", "updated_at": ago(days=2)},
+        {"id": "signed", "status": "pending_landlord_signature", "updated_at": ago(days=40)},
+    ])
+    await db.stats.insert_one({"_id": server.STATS_COUNTERS_ID, "by_status": {"draft": 1, "pending_tenant_signature": 2}})
+    await fresh_cache.get("unsigned")
+
+    report = await server.sweep()
+
+    assert report["agreements_cancelled"] == 2
+    statuses = {a["id"]: a["status"] async for a in db.agreements.find()}
+    assert statuses == {"draft": "cancelled", "unsigned": "cancelled", "recent": "pending_tenant_signature",
+                        "signed": "pending_landlord_signature"}
+    counters = await db.stats.find_one({"_id": server.STATS_COUNTERS_ID})
+    assert counters["by_status"] == {"draft": 0, "pending_tenant_signature": 1, "cancelled": 2}
+    assert (await fresh_cache.get("unsigned"))["status"] == "cancelled"
+
+
+async def test_abandoned_agreements_are_kept_when_turned_off(db, fresh_cache, monkeypatch):
+    monkeypatch.setattr(server, "ABANDONED_AGREEMENT_DAYS", 0)
+    await db.agreements.insert_one({"id": "draft", "status": "draft", "updated_at": ago(days=400)})
+
+    assert (await server.sweep())["agreements_cancelled"] == 0
+    assert (await db.agreements.find_one({"id": "draft"}))["status"] == "draft"
+
+
+async def test_legacy_check_collections_are_dropped_once(db):
+    await db.bankid_checks.insert_one({"order_ref": "o1"})
+    await db.agreements.insert_one({"id": "a1", "status": "completed", "updated_at": ago(days=1)})
+
+    assert (await server.sweep())["collections_dropped"] == 1
+    assert (await server.sweep())["collections_dropped"] == 0
+    assert "bankid_checks" not in await db.list_collection_names()
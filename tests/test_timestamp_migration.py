@@ -0,0 +1,89 @@
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+FIELDS = ("created_at", "updated_at")
+
+
+@pytest.fixture
+async def agreements(db):
+    docs = [
+        {"id": f"a{index}", "created_at": f"2024-01-0{index + 1}T10:00:00+00:00", "updated_at": "2024-02-01T10:00:00"}
+        for index in range(5)
+    ]
+    result = await db.agreements.insert_many(docs)
+    return result.inserted_ids
+
+
+@pytest.fixture
+def batches(monkeypatch):
+    """Record the _ids of each batch; fail the batch whose index is in fail_on"""
+    migrate = server.migrate_timestamp_batch
+    seen = []
+    fail_on = set()
+
+    async def recording(name, docs, fields):
+        seen.append([doc["_id"] for doc in docs])
+        if len(seen) - 1 in fail_on:
+            raise RuntimeError("worker stopped")
+        return await migrate(name, docs, fields)
+
+    monkeypatch.setattr(server, "migrate_timestamp_batch", recording)
+    recording.seen = seen
+    recording.fail_on = fail_on
+    return recording
+
+
+async def test_interrupted_migration_resumes_after_the_last_batch(db, agreements, batches):
+    batches.fail_on.add(1)
+    with pytest.raises(RuntimeError):
+        await server.migrate_collection_timestamps("agreements", FIELDS, batch_size=2)
+
+    checkpoint = await db.migrations.find_one({"_id": "timestamps:agreements"})
+    assert checkpoint["last_id"] == agreements[1]
+    assert checkpoint["converted"] == 2
+    assert not checkpoint.get("done")
+
+    batches.fail_on.clear()
+    batches.seen.clear()
+    converted = await server.migrate_collection_timestamps("agreements", FIELDS, batch_size=2)
+
+    assert batches.seen[0] == agreements[2:4]
+    assert converted == 3
+    checkpoint = await db.migrations.find_one({"_id": "timestamps:agreements"})
+    assert checkpoint["done"] is True
+    assert checkpoint["converted"] == 5
+    async for doc in db.agreements.find():
+        assert all(isinstance(doc[field], datetime) for field in FIELDS)
+
+
+async def test_finished_migration_is_not_run_again(db, agreements, batches):
+    await server.migrate_collection_timestamps("agreements", FIELDS, batch_size=2)
+    batches.seen.clear()
+
+    assert await server.migrate_collection_timestamps("agreements", FIELDS, batch_size=2) == 0
+    assert batches.seen == []
+
+
+async def test_documents_written_as_strings_during_the_pass_are_caught_up(db, agreements, monkeypatch):
+    migrate = server.migrate_timestamp_batch
+    calls = []
+
+    async def with_late_write(name, docs, fields):
+        calls.append(docs)
+        if len(calls) == 2:
+            # An old worker writes behind the scan position
+            await db.agreements.insert_one({"_id": ObjectId("0" * 24), "id": "old", "created_at": "2023-12-31T10:00:00"})
+        return await migrate(name, docs, fields)
+
+    monkeypatch.setattr(server, "migrate_timestamp_batch", with_late_write)
+    converted = await server.migrate_collection_timestamps("agreements", FIELDS, batch_size=2)
+
+    assert converted == 6
+    late = await db.agreements.find_one({"id": "old"})
+    assert isinstance(late["created_at"], datetime)
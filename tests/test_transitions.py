@@ -0,0 +1,139 @@
+import pytest
+
+import server
+from server import AgreementStatus
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture(autouse=True)
+def post_image_by_id(monkeypatch):
+    # mongomock looks the post-image up again with the original filter unless
+    # _id is in the projection, which misses once the status has changed.
+    projection = {key: value for key, value in server.AGREEMENT_PROJECTION.items() if key != "_id"}
+    monkeypatch.setattr(server, "AGREEMENT_PROJECTION", projection)
+
+
+@pytest.fixture
+async def agreement(db):
+    doc = {
+        "id": "a1", "status": AgreementStatus.PENDING_TENANT_SIGNATURE.value,
+        "landlord": {"name": "Erik", "email": "erik@example.se"},
+        "tenant": {"name": "Anna", "email": "anna@example.se"},
+        "property": {"address": "Storgatan 1"},
+    }
+    await db.agreements.insert_one(dict(doc))
+    return doc
+
+
+@pytest.mark.parametrize("from_status, to_status", [
+    (AgreementStatus.PENDING_TENANT_SIGNATURE, AgreementStatus.COMPLETED),
+    (AgreementStatus.PENDING_TENANT_SIGNATURE, AgreementStatus.PENDING_PAYMENT),
+    (AgreementStatus.PENDING_LANDLORD_SIGNATURE, AgreementStatus.PENDING_TENANT_SIGNATURE),
+    (AgreementStatus.COMPLETED, AgreementStatus.CANCELLED),
+    (AgreementStatus.CANCELLED, AgreementStatus.DRAFT),
+])
+async def test_illegal_transitions_are_refused(db, agreement, from_status, to_status):
+    with pytest.raises(ValueError):
+        await server.transition_agreement("a1", from_status, to_status)
+
+    stored = await db.agreements.find_one({"id": "a1"})
+    assert stored["status"] == AgreementStatus.PENDING_TENANT_SIGNATURE.value
+
+
+async def test_transition_from_a_status_already_left_does_nothing(db, agreement):
+    moved = await server.transition_agreement(
+        "a1", AgreementStatus.PENDING_LANDLORD_SIGNATURE, AgreementStatus.PENDING_PAYMENT
+    )
+
+    assert moved is None
+    assert await db.stats.count_documents({}) == 0
+
+
+async def test_legal_transition_moves_status_and_counters(db, agreement):
+    moved = await server.transition_agreement(
+        "a1", AgreementStatus.PENDING_TENANT_SIGNATURE, AgreementStatus.PENDING_LANDLORD_SIGNATURE,
+        {"tenant_signed_at": server.utcnow()},
+    )
+
+    assert moved["status"] == AgreementStatus.PENDING_LANDLORD_SIGNATURE
+    assert isinstance(moved["tenant_signed_at"], str)
+    counters = await db.stats.find_one({"_id": server.STATS_COUNTERS_ID})
+    assert counters["by_status"] == {"pending_tenant_signature": -1, "pending_landlord_signature": 1}
+
+
+async def test_only_one_of_two_racing_transitions_wins(db, agreement):
+    first = await server.transition_agreement(
+        "a1", AgreementStatus.PENDING_TENANT_SIGNATURE, AgreementStatus.PENDING_LANDLORD_SIGNATURE
+    )
+    second = await server.transition_agreement(
+        "a1", AgreementStatus.PENDING_TENANT_SIGNATURE, AgreementStatus.CANCELLED
+    )
+
+    assert first is not None
+    assert second is None
+
+
+class CompletedOrders:
+    """A provider whose orders and payments have all gone through"""
+
+    async def collect(self, ref, session):
+        return server.ProviderResult(status="complete")
+
+
+@pytest.fixture
+def completed_orders(monkeypatch):
+    monkeypatch.setattr(server, "bankid_provider", CompletedOrders())
+    monkeypatch.setattr(server, "swish_provider", CompletedOrders())
+
+
+async def start_bankid(db, signer):
+    await db.bankid_sessions.insert_one({"order_ref": f"o-{signer}", "agreement_id": "a1", "signer_type": signer, "status": "pending"})
+
+
+async def test_signature_moves_the_agreement_on(db, agreement, completed_orders):
+    await start_bankid(db, "tenant")
+
+    result = await server.poll_bankid_session("a1", "o-tenant")
+
+    assert result["status"] == "complete"
+    stored = await db.agreements.find_one({"id": "a1"})
+    assert stored["status"] == AgreementStatus.PENDING_LANDLORD_SIGNATURE
+
+
+async def test_signature_out_of_turn_fails_the_session(db, agreement, completed_orders):
+    await start_bankid(db, "landlord")
+
+    result = await server.poll_bankid_session("a1", "o-landlord")
+
+    assert result["status"] == "failed"
+    assert result["message"] == server.BANKID_FAILURES[server.SESSION_CONFLICT_HINT]
+    session = await db.bankid_sessions.find_one({"order_ref": "o-landlord"})
+    assert session["status"] == "failed"
+    stored = await db.agreements.find_one({"id": "a1"})
+    assert stored["status"] == AgreementStatus.PENDING_TENANT_SIGNATURE
+    assert "landlord_signed_at" not in stored
+    # Later polls keep explaining why
+    assert await server.poll_bankid_session("a1", "o-landlord") == result
+
+
+async def test_signature_already_recorded_by_another_poll_is_complete(db, agreement, completed_orders):
+    await start_bankid(db, "tenant")
+    await server.transition_agreement("a1", AgreementStatus.PENDING_TENANT_SIGNATURE, AgreementStatus.PENDING_LANDLORD_SIGNATURE)
+
+    result = await server.poll_bankid_session("a1", "o-tenant")
+
+    assert result["status"] == "complete"
+    session = await db.bankid_sessions.find_one({"order_ref": "o-tenant"})
+    assert session["status"] == "complete"
+
+
+async def test_payment_for_a_cancelled_agreement_fails(db, agreement, completed_orders):
+    await server.transition_agreement("a1", AgreementStatus.PENDING_TENANT_SIGNATURE, AgreementStatus.CANCELLED)
+    await db.swish_sessions.insert_one({"payment_ref": "p1", "agreement_id": "a1", "status": "pending"})
+
+    result = await server.poll_swish_session("a1", "p1")
+
+    assert result == {"status": "failed", "message": server.SWISH_FAILURES[server.SESSION_CONFLICT_HINT]}
+    stored = await db.agreements.find_one({"id": "a1"})
+    assert stored["status"] == AgreementStatus.CANCELLED